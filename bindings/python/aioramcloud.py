@@ -0,0 +1,335 @@
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Asynchronous facade for L{ramcloud.RAMCloud} and L{txramcloud.TxRAMCloud}.
+
+Every C{rc_*} call blocks the calling thread until its RPC completes, so a
+single client has at most one RPC outstanding. L{AsyncRAMCloud} runs the calls
+on a fixed set of worker threads, each with its own native client, and hands
+back a future for each request. ctypes releases the GIL for the duration of
+each foreign call, so the workers' RPCs really do overlap.
+
+Without an event loop the methods return a L{Future}. Given an asyncio (or
+trollius) event loop, they return futures of that loop instead, which can be
+awaited from coroutines:
+
+    >>> rc = AsyncRAMCloud(loop=asyncio.get_event_loop())
+    >>> value, version = yield From(rc.read(table, 'key'))
+
+At most C{max_pending} requests wait for a worker at a time. Past that,
+issuing a request blocks the caller until a worker frees up, unless there is an
+event loop: blocking would stall the loop, so the request's future fails with
+L{QueueFull} instead.
+"""
+
+from __future__ import with_statement
+
+import Queue
+import threading
+
+import ramcloud
+import txramcloud
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+class TimeoutError(Exception):
+    """Raised by L{Future.result} when the result isn't ready in time."""
+    pass
+
+class QueueFull(Exception):
+    """Set on the future of a request issued through an event loop while
+    C{max_pending} requests were already waiting for a worker."""
+    pass
+
+class Future(object):
+    """The eventual result of a request issued through L{AsyncRAMCloud}.
+
+    This is a small, thread-safe subset of C{concurrent.futures.Future}.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        """Return whether the request has completed."""
+        with self._cond:
+            return self._done
+
+    def _wait(self, timeout):
+        with self._cond:
+            if not self._done:
+                self._cond.wait(timeout)
+            if not self._done:
+                raise TimeoutError()
+
+    def result(self, timeout=None):
+        """Wait for the request and return its result.
+
+        @param timeout: seconds to wait, or C{None} to wait forever
+        @type  timeout: C{float}
+
+        @raise Exception: whatever the request raised.
+        @raise TimeoutError: The request didn't complete in time.
+        """
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the request and return what it raised, or C{None}."""
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """Call C{fn(future)} once the request completes.
+
+        The callback runs on the worker thread that completed the request, or
+        right away if the request has already completed.
+        """
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _set(self, result, exception):
+        with self._cond:
+            self._result = result
+            self._exception = exception
+            self._done = True
+            self._cond.notifyAll()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+    def set_result(self, result):
+        self._set(result, None)
+
+    def set_exception(self, exception):
+        self._set(None, exception)
+
+def _copy_to_loop_future(future, loop_future):
+    # runs on the event loop's thread
+    if loop_future.cancelled():
+        return
+    if future.exception() is not None:
+        loop_future.set_exception(future.exception())
+    else:
+        loop_future.set_result(future.result())
+
+def _enumerate(client, table_id):
+    return list(client.iter_table(table_id))
+
+class AsyncRAMCloud(object):
+    """Issues RAMCloud requests from a pool of worker threads.
+
+    Each worker connects its own client at startup. If that fails, the worker
+    tries again for each request until it succeeds, and a request it couldn't
+    connect for fails with the connect's exception. Call L{close} to stop the
+    workers once you're done.
+    """
+
+    def __init__(self, locator=ramcloud.DEFAULT_LOCATOR,
+                 cluster_name='main', workers=8, max_pending=256, loop=None,
+                 client_factory=ramcloud.RAMCloud):
+        """
+        @param locator: the coordinator's service locator
+        @type  locator: C{str}
+
+        @param workers: the number of worker threads and native clients
+        @type  workers: C{int}
+
+        @param max_pending: how many requests may wait for a worker before
+                            issuing another one blocks, or fails with
+                            L{QueueFull} if there is a loop
+        @type  max_pending: C{int}
+
+        @param loop: an asyncio event loop, or C{None} to return L{Future}s
+        @type  loop: C{asyncio.AbstractEventLoop}
+
+        @param client_factory: makes an unconnected client for each worker
+        @type  client_factory: callable
+        """
+        if loop is not None and asyncio is None:
+            raise ImportError("an event loop needs asyncio or trollius")
+        self.locator = locator
+        self.cluster_name = cluster_name
+        self.loop = loop
+        self.client_factory = client_factory
+        self._requests = Queue.Queue(max_pending)
+        self._closed = False
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker,
+                                      name='AsyncRAMCloud-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _connect(self):
+        client = self.client_factory()
+        client.connect(self.locator, self.cluster_name)
+        return client
+
+    def _worker(self):
+        try:
+            client = self._connect()
+        except Exception:
+            # the first request tries again, and fails if that does too
+            client = None
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            future, fn, args = request
+            try:
+                if client is None:
+                    client = self._connect()
+                result = fn(client, *args)
+            except Exception, e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def submit(self, fn, *args):
+        """Run C{fn(client, *args)} on a worker.
+
+        @param fn: the function to run, given the worker's client first
+        @type  fn: callable
+
+        @return: a future for the return value of C{fn}
+        @rtype: L{Future}, or an asyncio future if a loop was given
+        """
+        if self._closed:
+            raise RuntimeError("AsyncRAMCloud is closed")
+        future = Future()
+        if self.loop is None:
+            self._requests.put((future, fn, args))
+            return future
+        loop_future = asyncio.Future(loop=self.loop)
+        try:
+            self._requests.put_nowait((future, fn, args))
+        except Queue.Full:
+            loop_future.set_exception(QueueFull())
+            return loop_future
+        future.add_done_callback(lambda f: self.loop.call_soon_threadsafe(
+                                    _copy_to_loop_future, f, loop_future))
+        return loop_future
+
+    def _call(self, method, *args):
+        return self.submit(lambda client, *args: getattr(client, method)(*args),
+                           *args)
+
+    def close(self):
+        """Stop the workers once they've finished the requests issued so far.
+
+        Blocks until every worker has exited.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for thread in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def create_table(self, name, serverSpan=1):
+        return self._call('create_table', name, serverSpan)
+
+    def drop_table(self, name):
+        return self._call('drop_table', name)
+
+    def get_table_id(self, name):
+        return self._call('get_table_id', name)
+
+    def create(self, table_id, id, data):
+        return self._call('create', table_id, id, data)
+
+    def read(self, table_id, id, want_version=None):
+        return self._call('read', table_id, id, want_version)
+
+    def read_rr(self, table_id, id, reject_rules):
+        return self._call('read_rr', table_id, id, reject_rules)
+
+    def write(self, table_id, id, data, want_version=None):
+        return self._call('write', table_id, id, data, want_version)
+
+    def write_rr(self, table_id, id, data, reject_rules):
+        return self._call('write_rr', table_id, id, data, reject_rules)
+
+    def delete(self, table_id, id, want_version=None):
+        return self._call('delete', table_id, id, want_version)
+
+    def delete_rr(self, table_id, id, reject_rules):
+        return self._call('delete_rr', table_id, id, reject_rules)
+
+    def multi_read(self, table_id, keys):
+        return self._call('multi_read', table_id, keys)
+
+    def multi_write(self, table_id, requests):
+        return self._call('multi_write', table_id, requests)
+
+    def multi_remove(self, table_id, requests):
+        return self._call('multi_remove', table_id, requests)
+
+    def enumerate(self, table_id):
+        """Read a whole table.
+
+        The enumeration runs start to finish on one worker.
+
+        @return: a future for a list of (key, value) tuples
+        """
+        return self.submit(_enumerate, table_id)
+
+class AsyncTxRAMCloud(AsyncRAMCloud):
+    """L{AsyncRAMCloud} over L{txramcloud.TxRAMCloud} clients.
+
+    Besides the plain operations, which go through the transactional read and
+    write paths, this adds L{mt_commit}.
+    """
+
+    def __init__(self, tx_table, **kwargs):
+        """
+        @param tx_table: a table reserved for L{txramcloud}'s use
+        @type  tx_table: C{int}
+
+        See L{AsyncRAMCloud.__init__} for the other arguments.
+        """
+        kwargs.setdefault('client_factory',
+                          lambda: txramcloud.TxRAMCloud(tx_table))
+        AsyncRAMCloud.__init__(self, **kwargs)
+
+    def mt_commit(self, mt):
+        """Commit a minitransaction on a worker.
+
+        @return: a future for the result of L{txramcloud.TxRAMCloud.mt_commit}
+        """
+        return self._call('mt_commit', mt)
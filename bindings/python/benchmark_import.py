@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Measure how long it takes to import the Python binding.
+
+Each sample starts fresh interpreters that import L{ramcloud} and then bind
+the library, either lazily, touching a single function through
+L{ramcloud.so}, or the old way, declaring every prototype up front with
+L{ramcloud.load_so}.
+
+This doesn't need a running cluster, but it does need libramcloud.so. Run this
+program with --help for usage."""
+
+import subprocess
+import sys
+from optparse import OptionParser
+
+PROBE = """
+import sys, time
+start = time.time()
+import ramcloud
+imported = time.time()
+if sys.argv[1] == 'lazy':
+    ramcloud.so.rc_connect
+else:
+    ramcloud.load_so()
+print imported - start, time.time() - start
+"""
+
+def sample(mode):
+    """Return (import, import and bind) seconds in a fresh interpreter."""
+    out = subprocess.check_output([sys.executable, '-c', PROBE, mode])
+    return tuple(float(t) for t in out.split())
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.set_description(__doc__.split('\n\n', 1)[0])
+    parser.add_option("-n", "--num-runs",
+                      dest="num_runs", type="int", default=20,
+                      help="start NUM interpreters, defaults to 20",
+                      metavar="NUM")
+    (options, args) = parser.parse_args()
+    assert not args
+
+    print "%6s %12s %12s" % ('', 'import', 'bound')
+    for mode in ['lazy', 'eager']:
+        samples = [sample(mode) for i in range(options.num_runs)]
+        print "%6s %10.2fms %10.2fms" % ((mode,) + tuple(
+            median([s[i] for s in samples]) * 1000 for i in range(2)))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Compare transaction intent encodings for speed and size.
+
+For minitransactions of a few sizes, measures encoding and decoding with
+pickle (as intents were stored before L{txramcloud.serialize}) and with
+L{txramcloud.serialize} and L{txramcloud.unserialize}, and looking up one
+operation through a lazily decoded L{txramcloud.IntentView}.
+
+This doesn't need a running cluster. Run this program with --help for
+usage."""
+
+import time
+import cPickle as pickle
+from optparse import OptionParser
+
+import ramcloud
+import txramcloud
+
+def make_mt(ops, data_size):
+    """Return a minitransaction of writes, with masked versions."""
+    mt = txramcloud.MiniTransaction()
+    for i in range(ops):
+        mt[(1, 'key-%d' % i)] = txramcloud.MTWrite(
+                'x' * data_size, ramcloud.RejectRules.exactly(i + 1))
+    mt.masked_versions = dict((obj, 1000) for obj in mt.keys())
+    return mt
+
+def measure(f, count):
+    """Return microseconds per call of C{f()}."""
+    start = time.time()
+    for i in xrange(count):
+        f()
+    return (time.time() - start) / count * 1e6
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.set_description(__doc__.split('\n\n', 1)[0])
+    parser.add_option("-n", "--num-runs",
+                      dest="num_runs", type="int", default=2000,
+                      help="repeat each measurement NUM times, "
+                           "defaults to 2000", metavar="NUM")
+    parser.add_option("-o", "--ops",
+                      dest="ops", default="1,10,100",
+                      help=("comma-separated operations per minitransaction, "
+                            "defaults to 1,10,100"),
+                      metavar="OPS")
+    parser.add_option("-s", "--size",
+                      dest="size", type="int", default=100,
+                      help="bytes written by each operation, defaults to 100",
+                      metavar="BYTES")
+    (options, args) = parser.parse_args()
+    assert not args
+
+    print "%5s %8s %10s %10s %10s" % ('ops', 'encoding', 'bytes',
+                                      'encode us', 'decode us')
+    for ops in [int(o) for o in options.ops.split(',')]:
+        mt = make_mt(ops, options.size)
+        pickled = pickle.dumps(mt, protocol=2)
+        blob = txramcloud.serialize(mt)
+        last = (1, 'key-%d' % (ops - 1))
+        rows = [('pickle', pickled,
+                 lambda: pickle.dumps(mt, protocol=2),
+                 lambda: pickle.loads(pickled)),
+                ('binary', blob,
+                 lambda: txramcloud.serialize(mt),
+                 lambda: txramcloud.unserialize(blob)),
+                ('lookup', blob, None,
+                 lambda: txramcloud.load_intent(blob)[last])]
+        for (name, encoded, encode, decode) in rows:
+            if encode is None:
+                encode_us = '-'
+            else:
+                encode_us = '%.1f' % measure(encode, options.num_runs)
+            print "%5d %8s %10d %10s %10.1f" % (
+                ops, name, len(encoded), encode_us,
+                measure(decode, options.num_runs))
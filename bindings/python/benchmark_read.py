@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Measure reads/sec of the Python binding for a few object sizes.
+
+Compares the old read path (a fresh 2 MiB buffer per read, copied out in full
+before slicing) with L{ramcloud.RAMCloud.read_rr} and
+L{ramcloud.RAMCloud.read_rr_view}.
+
+This needs a running cluster. Run this program with --help for usage."""
+
+import ctypes
+import time
+from optparse import OptionParser
+
+import ramcloud
+
+def legacy_read_rr(rc, table_id, id, reject_rules):
+    """The read path as it was before L{ramcloud.BufferPool}."""
+    max_length = 1024 * 1024 * 2
+    buf = ctypes.create_string_buffer(max_length)
+    actual_length = ctypes.c_uint32()
+    got_version = ctypes.c_uint64()
+    reject_rules.object_doesnt_exist = True
+    s = ramcloud.so.rc_read(rc.client, table_id, ramcloud.get_key(id),
+                            ramcloud.get_keyLength(id),
+                            ctypes.byref(reject_rules),
+                            ctypes.byref(got_version), ctypes.byref(buf),
+                            max_length, ctypes.byref(actual_length))
+    rc.handle_error(s, got_version.value)
+    return (buf.raw[0:actual_length.value], got_version.value)
+
+def pooled_read_rr(rc, table_id, id, reject_rules):
+    return rc.read_rr(table_id, id, reject_rules)
+
+def view_read_rr(rc, table_id, id, reject_rules):
+    return rc.read_rr_view(table_id, id, reject_rules)
+
+def measure(read, rc, table, key, count):
+    """Return reads/sec for C{count} reads of C{key}."""
+    reject_rules = ramcloud.RejectRules(object_doesnt_exist=True)
+    start = time.time()
+    for i in xrange(count):
+        read(rc, table, key, reject_rules)
+    return count / (time.time() - start)
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.set_description(__doc__.split('\n\n', 1)[0])
+    parser.add_option("-l", "--locator",
+                      dest="locator",
+                      default="fast+udp:host=127.0.0.1,port=12242",
+                      help="coordinator service locator", metavar="LOC")
+    parser.add_option("-n", "--num-reads",
+                      dest="num_reads", type="int", default=10000,
+                      help="read each object NUM times, defaults to 10000",
+                      metavar="NUM")
+    parser.add_option("-s", "--sizes",
+                      dest="sizes", default="100,10240,1048576",
+                      help=("comma-separated object sizes in bytes, " +
+                            "defaults to 100,10240,1048576"),
+                      metavar="SIZES")
+    (options, args) = parser.parse_args()
+    assert not args
+
+    r = ramcloud.RAMCloud()
+    r.connect(options.locator)
+    r.create_table("benchmark_read")
+    table = r.get_table_id("benchmark_read")
+
+    sizes = [int(s) for s in options.sizes.split(',')]
+    variants = [('legacy', legacy_read_rr),
+                ('pooled', pooled_read_rr),
+                ('view', view_read_rr)]
+
+    print "%10s %12s %12s %12s" % (('size',) + tuple(n for n, f in variants))
+    try:
+        for size in sizes:
+            key = 'object-%d' % size
+            r.write(table, key, 'x' * size)
+            rates = [measure(f, r, table, key, options.num_reads)
+                     for (n, f) in variants]
+            print "%10d %12.0f %12.0f %12.0f" % ((size,) + tuple(rates))
+    finally:
+        r.drop_table("benchmark_read")
@@ -22,7 +22,7 @@ OIDRES_VERSION = 1
 OIDRES_HEADER = "oidres\0" + chr(OIDRES_VERSION)
 
 def unpack(blob):
-    """Unserialize a RAMCloud object into next_avail."""
+    """Unserialize a version 1 reservation object into next_avail."""
     header = blob[:8]
     next_avail = blob[8:]
 
@@ -35,7 +35,7 @@ def unpack(blob):
     return next_avail
 
 def pack(next_avail):
-    """Serialize next_avail into a RAMCloud object."""
+    """Serialize next_avail into a version 1 reservation object."""
 
     next_avail = ctypes.c_uint64(next_avail)
     sb = ctypes.create_string_buffer(8)
@@ -108,13 +108,14 @@ class OIDRes:
     class.
 
     As L{delta} defines the batch size, in expectation, each object ID reserved
-    costs M{2 / L{delta}} round trips to the RAMCloud server. Different clients
+    costs M{1 / L{delta}} round trips to the RAMCloud server: a batch is
+    reserved with a single L{ramcloud.RAMCloud.increment}. Different clients
     reserving from the same RAMCloud object may have different values of
     L{delta}.
 
-    The RAMCloud object used holds the next unreserved object ID. If it does
-    not exist, it is assumed to have a value of 0 and will be created during
-    the first reservation.
+    The RAMCloud object used is a counter, see L{ramcloud.pack_counter}, that
+    holds the next unreserved object ID. If it does not exist, it is assumed to
+    have a value of 0 and will be created during the first reservation.
 
     @type delta: int
     @ivar delta: size of a batch of object IDs
@@ -142,22 +143,34 @@ class OIDRes:
         self._table = table
         self._oid = oid
         self._reserved = []
+        self._upgraded = False
         self.delta = delta
 
-    def _read(self):
-        """Wrapper for L{ramcloud.RAMCloud.read}"""
-        data, version = self._rc.read(self._table, self._oid)
-        return (unpack(data), version)
+    def _upgrade(self, retry_strategy):
+        """Turn a reservation object written by version 1 of this module into
+        a plain counter for L{ramcloud.RAMCloud.increment}.
 
-    def _update(self, next_avail, version):
-        """Wrapper for L{ramcloud.RAMCloud.update}"""
-        data = pack(next_avail)
-        self._rc.update(self._table, self._oid, data, version)
-
-    def _create(self, next_avail):
-        """Wrapper for L{ramcloud.RAMCloud.create}"""
-        data = pack(next_avail)
-        self._rc.create(self._table, self._oid, data)
+        Version 1 put L{OIDRES_HEADER} in front of the count. This reads and
+        writes the object raw, since the client may add headers of its own, as
+        L{txramcloud.TxRAMCloud} does.
+        """
+        for retry in retry_strategy():
+            try:
+                blob, version = ramcloud.RAMCloud.read_rr(
+                        self._rc, self._table, self._oid,
+                        ramcloud.RejectRules(object_doesnt_exist=True))
+            except ramcloud.NoObjectError:
+                return
+            if blob[-16:-8] != OIDRES_HEADER:
+                return
+            next_avail = unpack(blob[-16:])
+            try:
+                ramcloud.RAMCloud.write_rr(
+                        self._rc, self._table, self._oid,
+                        ramcloud.pack_counter(next_avail),
+                        ramcloud.RejectRules.exactly(version))
+            except (ramcloud.NoObjectError, ramcloud.VersionError):
+                retry.later()
 
     def next(self, retry_strategy=retries.FuzzyExponentialBackoff):
         """Return the next reserved object ID.
@@ -166,7 +179,8 @@ class OIDRes:
         server.
 
         @type  retry_strategy: callable that returns L{ImmediateRetry} instance
-        @param retry_strategy: how to execute the retry loop
+        @param retry_strategy: how to execute the retry loop that upgrades an
+                               old reservation object
 
             Defaults to L{retries.FuzzyExponentialBackoff}, which is
             reasonable. This is here for testing purposes.
@@ -177,21 +191,12 @@ class OIDRes:
         if self._reserved:
             return self._reserved.pop()
 
-        for retry in retry_strategy():
-            try:
-                (next_avail, version) = self._read()
-            except ramcloud.NoObjectError:
-                next_avail = 0
-                try:
-                    self._create(next_avail + self.delta)
-                except ramcloud.ObjectExistsError:
-                    retry.later()
-            else:
-                try:
-                    self._update(next_avail + self.delta, version)
-                except (ramcloud.NoObjectError, ramcloud.VersionError):
-                    retry.later()
+        if not self._upgraded:
+            self._upgrade(retry_strategy)
+            self._upgraded = True
 
+        next_avail = self._rc.increment(self._table, self._oid,
+                                        self.delta) - self.delta
         self._reserved = range(next_avail + self.delta - 1, next_avail, -1)
         return next_avail
 
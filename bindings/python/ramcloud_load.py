@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Load the records of a file into a RAMCloud table.
+
+The file is mapped into memory and its records are written in batches, by
+several pooled clients at once. Two formats are understood:
+
+ - C{json}: one JSON object per line, either C{{"key": ..., "value": ...}},
+   where a value that isn't a string is stored as JSON, or, with
+   C{--key-field}, any object, stored as the line itself under one of its
+   fields. Dragonflow's tables can be rebuilt from dumps of their objects,
+   one per line, with C{--key-field name}.
+ - C{binary}: records one after another, each a little-endian 32-bit key
+   length and value length followed by the key and the value. See
+   L{pack_record}. Values are written straight out of the mapping.
+
+The loader checkpoints how far into the file every record has been written.
+After a failure, run it again with C{--resume} to carry on from there.
+
+Run this program with --help for usage."""
+
+from __future__ import with_statement
+
+import json
+import mmap
+import os
+import Queue
+import struct
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+import ramcloud
+
+RECORD_HEADER = struct.Struct('<II')
+
+def pack_record(key, value):
+    """Serialize a record in the C{binary} format."""
+    return RECORD_HEADER.pack(len(key), len(value)) + key + value
+
+def binary_records(data, offset=0):
+    """Parse records in the C{binary} format.
+
+    @param data: the file's contents, such as an C{mmap}
+    @param offset: where to start
+
+    @return: a generator of (key, value, end) tuples, where C{end} is the
+             offset just past the record. Values are C{buffer}s into
+             C{data}.
+    """
+    size = len(data)
+    while offset < size:
+        start = offset + RECORD_HEADER.size
+        if start > size:
+            raise ValueError("truncated record at offset %d" % offset)
+        key_length, value_length = RECORD_HEADER.unpack(data[offset:start])
+        end = start + key_length + value_length
+        if end > size:
+            raise ValueError("truncated record at offset %d" % offset)
+        yield (data[start:start + key_length],
+               buffer(data, start + key_length, value_length), end)
+        offset = end
+
+def _bytes(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    if not isinstance(s, str):
+        return str(s)
+    return s
+
+def json_records(data, offset=0, key_field=None):
+    """Parse records in the C{json} format.
+
+    @param data: the file's contents, such as an C{mmap}
+    @param offset: where to start
+
+    @param key_field: the field of each object to use as its key, storing
+                      the line as the value, or C{None} for objects with a
+                      C{key} and a C{value}
+
+    @return: a generator of (key, value, end) tuples, where C{end} is the
+             offset just past the record
+    """
+    size = len(data)
+    while offset < size:
+        newline = data.find('\n', offset)
+        if newline == -1:
+            newline = size
+        line = data[offset:newline].strip()
+        end = newline + 1
+        if line:
+            try:
+                record = json.loads(line)
+                if key_field is None:
+                    key, value = record['key'], record['value']
+                    if not isinstance(value, basestring):
+                        value = json.dumps(value)
+                else:
+                    key, value = record[key_field], line
+            except (ValueError, KeyError, TypeError), e:
+                raise ValueError("bad record at offset %d: %s" % (offset, e))
+            yield (_bytes(key), _bytes(value), min(end, size))
+        offset = end
+
+class Checkpoint(object):
+    """Remembers how far into a file every record has been loaded.
+
+    It is kept as JSON in a file of its own, which is replaced atomically.
+    """
+
+    def __init__(self, path, source):
+        """
+        @param path: where to keep the checkpoint
+        @param source: the path of the file being loaded
+        """
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.size = os.path.getsize(source)
+
+    def read(self):
+        """Return the offset to resume from, 0 if there's no checkpoint.
+
+        @raise ValueError: The checkpoint is for another file, or the file
+                           has changed size since.
+        """
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except IOError:
+            return 0
+        if state['source'] != self.source or state['size'] != self.size:
+            raise ValueError("checkpoint %s is for another file, or the file "
+                             "has changed" % self.path)
+        return state['offset']
+
+    def write(self, offset, records):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'source': self.source, 'size': self.size,
+                       'offset': offset, 'records': records}, f)
+        os.rename(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+class LoadError(Exception):
+    """A batch couldn't be written. The checkpoint covers the records
+    before it."""
+    pass
+
+class Loader(object):
+    """Writes batches of records from several pooled clients at once."""
+
+    def __init__(self, pool, table_id, batch=256, threads=4, checkpoint=None,
+                 progress_interval=5, out=sys.stderr):
+        """
+        @param pool: where the writing threads borrow clients from
+        @type  pool: L{ramcloud.RAMCloudPool}
+
+        @param batch: how many records to write with each
+                      L{ramcloud.RAMCloud.multi_write}
+        @type  batch: C{int}
+
+        @param threads: how many batches to have in flight at once
+        @type  threads: C{int}
+
+        @param checkpoint: where to record progress, or C{None}
+        @type  checkpoint: L{Checkpoint}
+
+        @param progress_interval: seconds between progress reports, or
+                                  C{None} for none
+        @type  progress_interval: C{float}
+        """
+        self.pool = pool
+        self.table_id = table_id
+        self.batch = batch
+        self.threads = threads
+        self.checkpoint = checkpoint
+        self.progress_interval = progress_interval
+        self.out = out
+        self.records = 0
+        self.bytes = 0
+        self.offset = 0
+        self.error = None
+        self._lock = threading.Lock()
+        self._finished = {}     # seq -> (end, records, bytes), out of order
+        self._next_seq = 0      # the first batch not yet accounted for
+        self._start = None
+        self._last_report = None
+
+    def _writer(self, batches):
+        while True:
+            item = batches.get()
+            if item is None:
+                return
+            seq, end, requests = item
+            if self.error is not None:
+                # drain the queue so the reader isn't blocked on it
+                continue
+            try:
+                with self.pool.client() as client:
+                    results = client.multi_write(self.table_id, requests)
+                for (request, result) in zip(requests, results):
+                    if isinstance(result, Exception):
+                        raise LoadError("writing %r failed: %r" %
+                                        (request[0], result))
+            except Exception, e:
+                with self._lock:
+                    if self.error is None:
+                        self.error = e
+                continue
+            self._finish(seq, end, len(requests),
+                         sum(len(r[1]) for r in requests))
+
+    def _finish(self, seq, end, records, nbytes):
+        with self._lock:
+            self._finished[seq] = (end, records, nbytes)
+            advanced = False
+            # batches complete out of order; only count the records before
+            # the first batch that hasn't
+            while self._next_seq in self._finished:
+                end, records, nbytes = self._finished.pop(self._next_seq)
+                self._next_seq += 1
+                self.offset = end
+                self.records += records
+                self.bytes += nbytes
+                advanced = True
+            if advanced:
+                now = time.time()
+                if (self.progress_interval is not None and
+                    now - self._last_report >= self.progress_interval):
+                    self._last_report = now
+                    self.report()
+                    if self.checkpoint is not None:
+                        self.checkpoint.write(self.offset, self.records)
+
+    def report(self):
+        """Print how many records have been loaded and how fast."""
+        if self.out is None:
+            return
+        elapsed = max(time.time() - self._start, 1e-6)
+        print >>self.out, ("%d records, %.1f MB, %.0f records/s, %.2f MB/s" %
+                           (self.records, self.bytes / 1e6,
+                            self.records / elapsed,
+                            self.bytes / 1e6 / elapsed))
+
+    def load(self, records, offset=0):
+        """Write records, as from L{json_records} or L{binary_records}.
+
+        @param offset: where in the file C{records} start
+
+        @raise LoadError: Some batch couldn't be written. Others may have
+                          been, but the checkpoint only covers the records
+                          before the first that wasn't.
+        """
+        self._start = self._last_report = time.time()
+        self.offset = offset
+        batches = Queue.Queue(self.threads * 2)
+        threads = [threading.Thread(target=self._writer, args=(batches,))
+                   for i in range(self.threads)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        rr = ramcloud.RejectRules()
+        seq = 0
+        requests = []
+        try:
+            for (key, value, end) in records:
+                requests.append((key, value, rr))
+                if len(requests) == self.batch:
+                    if self.error is not None:
+                        break
+                    batches.put((seq, end, requests))
+                    seq += 1
+                    requests = []
+            if requests and self.error is None:
+                batches.put((seq, end, requests))
+        finally:
+            for thread in threads:
+                batches.put(None)
+            for thread in threads:
+                thread.join()
+            if self.checkpoint is not None:
+                self.checkpoint.write(self.offset, self.records)
+        if self.error is not None:
+            raise LoadError(str(self.error))
+        self.report()
+
+def map_file(path):
+    """Map a file into memory read-only, or return C{''} if it's empty."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def main(argv=None):
+    parser = OptionParser(usage="%prog [options] -t TABLE FILE")
+    parser.set_description(__doc__.split('\n\n', 1)[0])
+    parser.add_option("-l", "--locator",
+                      dest="locator",
+                      default="fast+udp:host=127.0.0.1,port=12242",
+                      help="coordinator service locator", metavar="LOC")
+    parser.add_option("-t", "--table", dest="table",
+                      help="the table to load into", metavar="TABLE")
+    parser.add_option("--create", dest="create", action="store_true",
+                      default=False, help="create the table first")
+    parser.add_option("-f", "--format", dest="format", default="json",
+                      choices=["json", "binary"],
+                      help="json (the default) or binary")
+    parser.add_option("-k", "--key-field", dest="key_field",
+                      help="store each JSON line under this field",
+                      metavar="FIELD")
+    parser.add_option("-c", "--clients", dest="clients", type="int",
+                      default=4, help="clients writing at once, defaults to 4",
+                      metavar="NUM")
+    parser.add_option("-b", "--batch", dest="batch", type="int", default=256,
+                      help="records per batch, defaults to 256",
+                      metavar="NUM")
+    parser.add_option("-z", "--compress", dest="compress",
+                      action="store_true", default=False,
+                      help="store values through ramcloud.ZlibValueCodec")
+    parser.add_option("--checkpoint", dest="checkpoint",
+                      help="where to record progress, defaults to FILE.ckpt",
+                      metavar="PATH")
+    parser.add_option("-r", "--resume", dest="resume", action="store_true",
+                      default=False, help="carry on from the checkpoint")
+    parser.add_option("-p", "--progress", dest="progress", type="float",
+                      default=5, help="seconds between progress reports",
+                      metavar="SECS")
+    parser.add_option("-q", "--quiet", dest="quiet", action="store_true",
+                      default=False, help="only report errors")
+    (options, args) = parser.parse_args(argv)
+    if len(args) != 1 or options.table is None:
+        parser.error("need a table and a file")
+    path = args[0]
+
+    checkpoint = Checkpoint(options.checkpoint or path + '.ckpt', path)
+    offset = 0
+    if options.resume:
+        offset = checkpoint.read()
+        if not options.quiet:
+            print >>sys.stderr, "resuming at offset %d" % offset
+
+    codec = None
+    if options.compress:
+        codec = ramcloud.ZlibValueCodec()
+    pool = ramcloud.RAMCloudPool(size=options.clients,
+                                 serverLocator=options.locator,
+                                 value_codec=codec)
+    with pool.client() as client:
+        if options.create:
+            client.create_table(options.table)
+        table_id = client.get_table_id(options.table)
+
+    data = map_file(path)
+    if options.format == 'json':
+        records = json_records(data, offset, options.key_field)
+    else:
+        records = binary_records(data, offset)
+    loader = Loader(pool, table_id, batch=options.batch,
+                    threads=options.clients, checkpoint=checkpoint,
+                    progress_interval=options.progress,
+                    out=None if options.quiet else sys.stderr)
+    try:
+        loader.load(records, offset)
+    except (LoadError, ValueError), e:
+        print >>sys.stderr, "%s; rerun with --resume to carry on" % e
+        return 1
+    checkpoint.remove()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
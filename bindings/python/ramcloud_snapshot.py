@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Save a RAMCloud table to a snapshot file, and load one back.
+
+A snapshot is written as the table is enumerated, a block at a time, so
+exporting doesn't hold the table in memory. Loading maps the file into
+memory and writes its records from several pooled clients at once.
+
+The file starts with a header (see L{HEADER}) and ends with an index of its
+blocks (see L{INDEX_ENTRY}). Each block holds records in the C{binary}
+format of L{ramcloud_load}, compressed as a whole with zlib if the header's
+L{FLAG_ZLIB} is set. Objects are copied byte for byte: values stored
+through a value codec stay encoded, and chunked values are copied as their
+manifests and chunks.
+
+Run this program with --help for usage."""
+
+from __future__ import with_statement
+
+import struct
+import sys
+import zlib
+from optparse import OptionParser
+
+import ramcloud
+import ramcloud_load
+
+SNAPSHOT_MAGIC = 'rcsnap\0\0'
+SNAPSHOT_VERSION = 1
+
+# The blocks are compressed with zlib.
+FLAG_ZLIB = 1
+
+# magic, version, flags, record count, block count, index offset
+HEADER = struct.Struct('<8sIIQQQ')
+
+# block offset, stored length, uncompressed length, record count
+INDEX_ENTRY = struct.Struct('<QIII')
+
+BLOCK_SIZE = 1024 * 1024
+
+class SnapshotWriter(object):
+    """Writes a snapshot a record at a time.
+
+    The file must be seekable, since the header is filled in by L{close}.
+    """
+
+    def __init__(self, f, compress=False, block_size=BLOCK_SIZE, level=6):
+        """
+        @param f: a file open for writing in binary mode
+
+        @param compress: whether to compress the blocks
+        @type  compress: C{bool}
+
+        @param block_size: about how many bytes of records go in a block
+        @type  block_size: C{int}
+        """
+        self.f = f
+        self.flags = FLAG_ZLIB if compress else 0
+        self.block_size = block_size
+        self.level = level
+        self.records = 0
+        self.index = []
+        self._block = []
+        self._block_bytes = 0
+        self._block_records = 0
+        self._start = f.tell()
+        self._offset = self._start + HEADER.size
+        f.write('\0' * HEADER.size)
+
+    def add(self, key, value):
+        """Append a record."""
+        record = ramcloud_load.pack_record(key, value)
+        self._block.append(record)
+        self._block_bytes += len(record)
+        self._block_records += 1
+        self.records += 1
+        if self._block_bytes >= self.block_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._block:
+            return
+        block = ''.join(self._block)
+        if self.flags & FLAG_ZLIB:
+            stored = zlib.compress(block, self.level)
+        else:
+            stored = block
+        self.f.write(stored)
+        self.index.append((self._offset, len(stored), len(block),
+                           self._block_records))
+        self._offset += len(stored)
+        self._block = []
+        self._block_bytes = 0
+        self._block_records = 0
+
+    def close(self):
+        """Write out the last block, the index and the header."""
+        self._flush()
+        for entry in self.index:
+            self.f.write(INDEX_ENTRY.pack(*entry))
+        end = self.f.tell()
+        self.f.seek(self._start)
+        self.f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.flags,
+                                 self.records, len(self.index),
+                                 self._offset))
+        self.f.seek(end)
+
+class Snapshot(object):
+    """A snapshot read from memory, such as a mapped file."""
+
+    def __init__(self, data):
+        """
+        @param data: the snapshot's bytes, such as from
+                     L{ramcloud_load.map_file}
+
+        @raise ValueError: C{data} isn't a snapshot this can read.
+        """
+        if len(data) < HEADER.size:
+            raise ValueError("not a snapshot: too short")
+        (magic, version, self.flags, self.records, blocks,
+         index_offset) = HEADER.unpack(data[:HEADER.size])
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("not a snapshot")
+        if version > SNAPSHOT_VERSION:
+            raise ValueError("snapshot version %d is too new" % version)
+        if index_offset + blocks * INDEX_ENTRY.size > len(data):
+            raise ValueError("snapshot is truncated")
+        self.data = data
+        self.index = [INDEX_ENTRY.unpack(
+                          data[index_offset + i * INDEX_ENTRY.size:
+                               index_offset + (i + 1) * INDEX_ENTRY.size])
+                      for i in xrange(blocks)]
+
+    @classmethod
+    def open(cls, path):
+        return cls(ramcloud_load.map_file(path))
+
+    def block(self, i):
+        """Return the records of block C{i}, uncompressed."""
+        offset, stored, length, records = self.index[i]
+        if self.flags & FLAG_ZLIB:
+            block = zlib.decompress(buffer(self.data, offset, stored))
+            if len(block) != length:
+                raise ValueError("block %d is corrupt" % i)
+            return block
+        return buffer(self.data, offset, length)
+
+    def __iter__(self):
+        """Yield the (key, value) of every record."""
+        for i in xrange(len(self.index)):
+            for (key, value, end) in ramcloud_load.binary_records(
+                                         self.block(i)):
+                yield (key, value)
+
+def export_table(client, table_id, f, compress=False, block_size=BLOCK_SIZE):
+    """Write a snapshot of a table, as it is enumerated.
+
+    @param client: a client without a value codec, so that values are
+                   copied as they are stored
+    @type  client: L{ramcloud.RAMCloud}
+
+    @return: the number of records written
+    """
+    writer = SnapshotWriter(f, compress, block_size)
+    for (key, value) in client.iter_table(table_id):
+        writer.add(key, value)
+    writer.close()
+    return writer.records
+
+def import_snapshot(pool, table_id, snapshot, threads=4, batch=256,
+                    out=None):
+    """Write every record of a snapshot into a table.
+
+    @param pool: where the writing threads borrow clients from; its clients
+                 shouldn't have a value codec
+    @type  pool: L{ramcloud.RAMCloudPool}
+
+    @type  snapshot: L{Snapshot}
+
+    @return: the number of records written
+
+    @raise ramcloud_load.LoadError: Some batch couldn't be written.
+    """
+    loader = ramcloud_load.Loader(pool, table_id, batch=batch,
+                                  threads=threads,
+                                  progress_interval=5 if out else None,
+                                  out=out)
+    loader.load((key, value, 0) for (key, value) in snapshot)
+    return loader.records
+
+def main(argv=None):
+    parser = OptionParser(usage="%prog export|import [options] -t TABLE FILE")
+    parser.set_description(__doc__.split('\n\n', 1)[0])
+    parser.add_option("-l", "--locator",
+                      dest="locator",
+                      default="fast+udp:host=127.0.0.1,port=12242",
+                      help="coordinator service locator", metavar="LOC")
+    parser.add_option("-t", "--table", dest="table",
+                      help="the table to export or import", metavar="TABLE")
+    parser.add_option("--create", dest="create", action="store_true",
+                      default=False, help="create the table before importing")
+    parser.add_option("-z", "--compress", dest="compress",
+                      action="store_true", default=False,
+                      help="compress the snapshot's blocks when exporting")
+    parser.add_option("-c", "--clients", dest="clients", type="int",
+                      default=4,
+                      help="clients writing at once when importing, "
+                           "defaults to 4", metavar="NUM")
+    parser.add_option("-b", "--batch", dest="batch", type="int", default=256,
+                      help="records per batch when importing, "
+                           "defaults to 256", metavar="NUM")
+    parser.add_option("-q", "--quiet", dest="quiet", action="store_true",
+                      default=False, help="only report errors")
+    (options, args) = parser.parse_args(argv)
+    if (len(args) != 2 or args[0] not in ('export', 'import') or
+        options.table is None):
+        parser.error("need export or import, a table and a file")
+    command, path = args
+
+    pool = ramcloud.RAMCloudPool(size=options.clients,
+                                 serverLocator=options.locator)
+    with pool.client() as client:
+        if command == 'import' and options.create:
+            client.create_table(options.table)
+        table_id = client.get_table_id(options.table)
+        if command == 'export':
+            with open(path, 'wb') as f:
+                records = export_table(client, table_id, f, options.compress)
+    if command == 'import':
+        try:
+            records = import_snapshot(
+                    pool, table_id, Snapshot.open(path),
+                    threads=options.clients, batch=options.batch,
+                    out=None if options.quiet else sys.stderr)
+        except (ramcloud_load.LoadError, ValueError), e:
+            print >>sys.stderr, e
+            return 1
+    if not options.quiet:
+        print >>sys.stderr, "%sed %d records" % (command, records)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,550 @@
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""A simulated RAMCloud cluster that runs inside the Python process.
+
+L{SimLibrary} implements the C{rc_*} functions of libramcloud.so in Python,
+over the tables and objects of a L{Cluster}. Installing one as
+L{ramcloud.so} puts every client in the process on the simulated cluster:
+L{ramcloud.RAMCloud}, L{txramcloud.TxRAMCloud}, L{ramcloud.RAMCloudPool} and
+anything built on them, such as Dragonflow's C{RamcloudNbApi}.
+
+    >>> with simulated(Cluster(latency=exponential(0.000005))) as cluster:
+    ...     rc = ramcloud.RAMCloud()
+    ...     rc.connect()
+
+The simulation follows the server's rules for versions and
+L{ramcloud.RejectRules}. Each RPC can be delayed by a latency distribution
+plus its payload over a bandwidth limit, and a cluster's servers can be
+limited to a few RPCs at a time, so contended keys queue up the way they would
+on a real server. L{Cluster.inject_fault} makes RPCs fail.
+
+The simulated library doesn't export the batched operations, so clients fall
+back to issuing them one object at a time.
+"""
+
+from __future__ import with_statement
+
+import contextlib
+import ctypes
+import itertools
+import math
+import random
+import threading
+import time
+
+import ramcloud
+
+STATUS_OK = 0
+STATUS_TABLE_DOESNT_EXIST = 1
+STATUS_OBJECT_DOESNT_EXIST = 2
+STATUS_OBJECT_EXISTS = 3
+STATUS_WRONG_VERSION = 4
+STATUS_INVALID_OBJECT = 22
+
+def deref(arg):
+    """Return the object passed to C{ctypes.byref}."""
+    return arg._obj
+
+def constant(seconds):
+    """A latency distribution that always takes C{seconds}."""
+    return lambda rng: seconds
+
+def uniform(low, high):
+    """A latency distribution uniform over [C{low}, C{high}] seconds."""
+    return lambda rng: rng.uniform(low, high)
+
+def exponential(mean):
+    """A latency distribution exponential with a mean of C{mean} seconds."""
+    return lambda rng: rng.expovariate(1.0 / mean)
+
+def lognormal(median, sigma):
+    """A latency distribution log-normal around C{median} seconds.
+
+    Good for modelling a long tail: C{sigma} around 1 puts the 99th
+    percentile at about ten times the median.
+    """
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+class Fault(object):
+    """Makes matching RPCs fail. See L{Cluster.inject_fault}."""
+
+    def __init__(self, status, op=None, table_id=None, probability=1.0,
+                 count=None):
+        self.status = status
+        self.op = op
+        self.table_id = table_id
+        self.probability = probability
+        self.count = count
+
+    def matches(self, op, table_id):
+        return ((self.op is None or self.op == op) and
+                (self.table_id is None or self.table_id == table_id) and
+                self.count != 0)
+
+class Cluster(object):
+    """The tables, objects and servers of a simulated cluster.
+
+    Versions start at 1 in each table and only ever increase: a new object
+    gets a version above every version the table has handed out, and an
+    overwrite bumps the object's version by one.
+
+    @ivar rpcs: the number of RPCs issued, by operation name
+    @type rpcs: C{dict}
+    """
+
+    def __init__(self, num_servers=1, server_threads=None, latency=None,
+                 op_latency=None, bandwidth=None, seed=None, sleep=time.sleep):
+        """
+        @param num_servers: the number of servers that tables are spread
+                            over, by key hash
+        @type  num_servers: C{int}
+
+        @param server_threads: how many RPCs each server handles at a time,
+                               or C{None} for no limit
+        @type  server_threads: C{int} or C{None}
+
+        @param latency: how long each RPC takes: a distribution such as
+                        L{exponential}, a number of seconds, or C{None} for
+                        no delay
+        @type  latency: callable, C{float} or C{None}
+
+        @param op_latency: overrides C{latency} for some operations, such as
+                           C{'read'} or C{'write'}
+        @type  op_latency: C{dict}
+
+        @param bandwidth: the payload bytes per second each RPC can move, or
+                          C{None} for no limit
+        @type  bandwidth: C{float} or C{None}
+
+        @param seed: seeds the random numbers behind latencies and faults
+        @type  seed: hashable
+
+        @param sleep: waits out each delay; tests can pass a recorder
+        @type  sleep: callable
+        """
+        self.num_servers = num_servers
+        if server_threads is None:
+            self.servers = [None] * num_servers
+        else:
+            self.servers = [threading.Semaphore(server_threads)
+                            for i in range(num_servers)]
+        self.latency = self._distribution(latency)
+        self.op_latency = dict((op, self._distribution(l))
+                               for (op, l) in (op_latency or {}).items())
+        self.bandwidth = bandwidth
+        self.rng = random.Random(seed)
+        self.sleep = sleep
+        self.faults = []
+        self.rpcs = {}
+        self.lock = threading.RLock()
+        self.table_ids = {}
+        self.tables = {}
+        self.safe_versions = {}
+        self.next_table_id = 1
+
+    @staticmethod
+    def _distribution(latency):
+        if latency is None or callable(latency):
+            return latency
+        return constant(latency)
+
+    def inject_fault(self, status, op=None, table_id=None, probability=1.0,
+                     count=None):
+        """Make RPCs fail with C{status} instead of running.
+
+        @param op: only fail this operation, such as C{'read'}
+        @type  op: C{str} or C{None}
+
+        @param table_id: only fail operations on this table
+        @type  table_id: C{int} or C{None}
+
+        @param probability: the chance that a matching RPC fails
+        @type  probability: C{float}
+
+        @param count: stop after failing this many RPCs, or C{None} to go on
+        @type  count: C{int} or C{None}
+
+        @rtype: L{Fault}
+        """
+        fault = Fault(status, op, table_id, probability, count)
+        with self.lock:
+            self.faults.append(fault)
+        return fault
+
+    def clear_faults(self):
+        with self.lock:
+            del self.faults[:]
+
+    def server_id(self, table_id, key):
+        """Return the index of the server that holds a key."""
+        return hash((table_id, key)) % self.num_servers
+
+    def _fault(self, op, table_id):
+        with self.lock:
+            for fault in self.faults:
+                if (fault.matches(op, table_id) and
+                    self.rng.random() < fault.probability):
+                    if fault.count is not None:
+                        fault.count -= 1
+                    return fault.status
+        return None
+
+    def _delay(self, op, nbytes):
+        latency = self.op_latency.get(op, self.latency)
+        with self.lock:
+            delay = latency(self.rng) if latency is not None else 0.0
+        if self.bandwidth is not None:
+            delay += float(nbytes) / self.bandwidth
+        return delay
+
+    def rpc(self, op, table_id, key, run, nbytes=0):
+        """Issue one RPC: wait out its delay, then run C{run()}.
+
+        C{run} is called with the cluster locked and returns a status code
+        and the number of payload bytes it returned, which add to the delay.
+
+        @return: the status code
+        """
+        with self.lock:
+            self.rpcs[op] = self.rpcs.get(op, 0) + 1
+        status = self._fault(op, table_id)
+        if status is not None:
+            return status
+        server = self.servers[self.server_id(table_id, key)]
+        if server is not None:
+            server.acquire()
+        try:
+            with self.lock:
+                status, returned = run()
+            delay = self._delay(op, nbytes + returned)
+            if delay > 0:
+                self.sleep(delay)
+        finally:
+            if server is not None:
+                server.release()
+        return status
+
+    # The data operations below are called with the cluster locked. They
+    # return (status, version), where version is the object's version after
+    # the operation or, if it was rejected, its current version.
+
+    def _object(self, table_id, key):
+        return self.tables[table_id].get(key)
+
+    def _reject(self, obj, reject_rules):
+        if obj is None:
+            if reject_rules.object_doesnt_exist:
+                return STATUS_OBJECT_DOESNT_EXIST
+            return STATUS_OK
+        e = ramcloud.reject_error(reject_rules, obj[1])
+        if isinstance(e, ramcloud.ObjectExistsError):
+            return STATUS_OBJECT_EXISTS
+        if e is not None:
+            return STATUS_WRONG_VERSION
+        return STATUS_OK
+
+    def read(self, table_id, key, reject_rules):
+        """Return (status, version, data)."""
+        if table_id not in self.tables:
+            return (STATUS_TABLE_DOESNT_EXIST, 0, None)
+        obj = self._object(table_id, key)
+        rules = ramcloud.RejectRules.from_buffer_copy(reject_rules)
+        # a read of a missing object always fails
+        rules.object_doesnt_exist = True
+        status = self._reject(obj, rules)
+        if status != STATUS_OK:
+            return (status, obj and obj[1] or 0, None)
+        return (STATUS_OK, obj[1], obj[0])
+
+    def write(self, table_id, key, data, reject_rules):
+        if table_id not in self.tables:
+            return (STATUS_TABLE_DOESNT_EXIST, 0)
+        obj = self._object(table_id, key)
+        status = self._reject(obj, reject_rules)
+        if status != STATUS_OK:
+            return (status, obj and obj[1] or 0)
+        if obj is None:
+            version = self.safe_versions[table_id] + 1
+        else:
+            version = obj[1] + 1
+        self.safe_versions[table_id] = max(self.safe_versions[table_id],
+                                           version)
+        self.tables[table_id][key] = (data, version)
+        return (STATUS_OK, version)
+
+    def increment(self, table_id, key, delta, reject_rules):
+        """Return (status, version, new value)."""
+        if table_id not in self.tables:
+            return (STATUS_TABLE_DOESNT_EXIST, 0, 0)
+        obj = self._object(table_id, key)
+        value = 0
+        if obj is not None:
+            try:
+                value = ramcloud.unpack_counter(obj[0])
+            except ValueError:
+                return (STATUS_INVALID_OBJECT, obj[1], 0)
+        value += delta
+        status, version = self.write(table_id, key,
+                                     ramcloud.pack_counter(value),
+                                     reject_rules)
+        return (status, version, value)
+
+    def remove(self, table_id, key, reject_rules):
+        if table_id not in self.tables:
+            return (STATUS_TABLE_DOESNT_EXIST, 0)
+        obj = self._object(table_id, key)
+        status = self._reject(obj, reject_rules)
+        if status != STATUS_OK or obj is None:
+            return (status, obj and obj[1] or 0)
+        del self.tables[table_id][key]
+        return (STATUS_OK, obj[1])
+
+    def create_table(self, name):
+        if name not in self.table_ids:
+            table_id = self.next_table_id
+            self.next_table_id += 1
+            self.table_ids[name] = table_id
+            self.tables[table_id] = {}
+            self.safe_versions[table_id] = 0
+
+    def drop_table(self, name):
+        table_id = self.table_ids.pop(name, None)
+        if table_id is not None:
+            del self.tables[table_id]
+            del self.safe_versions[table_id]
+
+class _Enumeration(object):
+    def __init__(self, table_id, items, keys_only):
+        self.table_id = table_id
+        self.items = iter(items)
+        self.keys_only = keys_only
+        # the buffers handed out last, kept alive until the next call
+        self.buffers = None
+
+class SimLibrary(object):
+    """Stands in for libramcloud.so, running every RPC on a L{Cluster}.
+
+    The functions take the same arguments as the C library, as passed by
+    L{ramcloud.RAMCloud}.
+    """
+
+    def __init__(self, cluster=None,
+                 wrong_version_status=STATUS_WRONG_VERSION):
+        """
+        @param cluster: the simulated cluster, or C{None} for a new one with
+                        no delays
+        @type  cluster: L{Cluster}
+
+        @param wrong_version_status: the status code that the client maps to
+                                     L{ramcloud.VersionError}. Dragonflow's
+                                     copy of the bindings expects 5.
+        @type  wrong_version_status: C{int}
+        """
+        if cluster is None:
+            cluster = Cluster()
+        self.cluster = cluster
+        self.wrong_version_status = wrong_version_status
+        self._handles = itertools.count(1)
+        self._enumerations = {}
+
+    def _status(self, status):
+        if status == STATUS_WRONG_VERSION:
+            return self.wrong_version_status
+        return status
+
+    def rc_connect(self, serverLocator, clusterName, client):
+        status = self.cluster.rpc('connect', None, None,
+                                  lambda: (STATUS_OK, 0))
+        if status == STATUS_OK:
+            deref(client).value = self._handles.next()
+        return status
+
+    def rc_disconnect(self, client):
+        pass
+
+    def rc_getStatus(self):
+        return STATUS_OK
+
+    def rc_ping(self, client, serviceLocator, nonce, nanoseconds, result):
+        deref(result).value = nonce
+        return self.cluster.rpc('ping', None, None, lambda: (STATUS_OK, 0))
+
+    def rc_createTable(self, client, name, serverSpan):
+        def run():
+            self.cluster.create_table(name)
+            return (STATUS_OK, 0)
+        return self.cluster.rpc('create_table', None, None, run)
+
+    def rc_dropTable(self, client, name):
+        def run():
+            self.cluster.drop_table(name)
+            return (STATUS_OK, 0)
+        return self.cluster.rpc('drop_table', None, None, run)
+
+    def rc_getTableId(self, client, name, table_id):
+        def run():
+            if name not in self.cluster.table_ids:
+                return (STATUS_TABLE_DOESNT_EXIST, 0)
+            deref(table_id).value = self.cluster.table_ids[name]
+            return (STATUS_OK, 0)
+        return self.cluster.rpc('get_table_id', None, None, run)
+
+    def rc_read(self, client, table_id, key, keyLength, rejectRules,
+                version, buf, maxLength, actualLength):
+        key = key[:keyLength]
+        def run():
+            status, got_version, data = self.cluster.read(
+                    table_id, key, deref(rejectRules))
+            deref(version).value = got_version
+            if status != STATUS_OK:
+                return (status, 0)
+            deref(actualLength).value = len(data)
+            ctypes.memmove(deref(buf), data, min(len(data), maxLength))
+            return (STATUS_OK, len(data))
+        return self._status(self.cluster.rpc('read', table_id, key, run))
+
+    def rc_write(self, client, table_id, key, keyLength, buf, length,
+                 rejectRules, version):
+        key = key[:keyLength]
+        data = str(buffer(buf, 0, length))
+        def run():
+            status, got_version = self.cluster.write(table_id, key, data,
+                                                     deref(rejectRules))
+            deref(version).value = got_version
+            return (status, 0)
+        return self._status(self.cluster.rpc('write', table_id, key, run,
+                                             nbytes=length))
+
+    def rc_incrementInt64(self, client, table_id, key, keyLength, delta,
+                          rejectRules, version, newValue):
+        key = key[:keyLength]
+        def run():
+            status, got_version, value = self.cluster.increment(
+                    table_id, key, delta, deref(rejectRules))
+            deref(version).value = got_version
+            deref(newValue).value = value
+            return (status, 0)
+        return self._status(self.cluster.rpc('increment', table_id, key,
+                                             run))
+
+    def rc_remove(self, client, table_id, key, keyLength, rejectRules,
+                  version):
+        key = key[:keyLength]
+        def run():
+            status, got_version = self.cluster.remove(table_id, key,
+                                                      deref(rejectRules))
+            deref(version).value = got_version
+            return (status, 0)
+        return self._status(self.cluster.rpc('remove', table_id, key, run))
+
+    def rc_enumerateTablePrepare(self, client, table_id, keysOnly, state):
+        handle = self._handles.next()
+        with self.cluster.lock:
+            items = sorted(self.cluster.tables.get(table_id, {}).items())
+        self._enumerations[handle] = _Enumeration(table_id, items, keysOnly)
+        deref(state).value = handle
+
+    def rc_enumerateTableNext(self, client, state, keyLength, key, dataLength,
+                              data):
+        enumeration = self._enumerations[state.value]
+        def run():
+            if enumeration.table_id not in self.cluster.tables:
+                return (STATUS_TABLE_DOESNT_EXIST, 0)
+            try:
+                k, (value, version) = enumeration.items.next()
+            except StopIteration:
+                deref(keyLength).value = 0
+                deref(dataLength).value = 0
+                return (STATUS_OK, 0)
+            key_buf = ctypes.create_string_buffer(k, len(k))
+            deref(keyLength).value = len(k)
+            deref(key).value = ctypes.addressof(key_buf)
+            if enumeration.keys_only:
+                enumeration.buffers = (key_buf,)
+                deref(dataLength).value = 0
+                deref(data).value = None
+                return (STATUS_OK, len(k))
+            data_buf = ctypes.create_string_buffer(value, len(value))
+            enumeration.buffers = (key_buf, data_buf)
+            deref(dataLength).value = len(value)
+            deref(data).value = ctypes.addressof(data_buf)
+            return (STATUS_OK, len(k) + len(value))
+        return self.cluster.rpc('enumerate', enumeration.table_id, None, run)
+
+    def rc_enumerateTableFinalize(self, state):
+        self._enumerations.pop(state.value, None)
+
+    def rc_testing_kill(self, client, table_id, key, keyLength):
+        # recovery would restore every object, so there's nothing to lose
+        return STATUS_OK
+
+    def rc_testing_fill(self, client, table_id, key, keyLength, objectCount,
+                        objectSize):
+        def run():
+            for i in range(objectCount):
+                status, version = self.cluster.write(
+                        table_id, str(i), '0' * objectSize,
+                        ramcloud.RejectRules())
+                if status != STATUS_OK:
+                    return (status, 0)
+            return (STATUS_OK, 0)
+        return self.cluster.rpc('fill', table_id, key[:keyLength], run)
+
+    def rc_testing_get_server_id(self, client, table_id, key, keyLength,
+                                 serverId):
+        deref(serverId).value = self.cluster.server_id(table_id,
+                                                       key[:keyLength])
+        return STATUS_OK
+
+    def rc_testing_get_service_locator(self, client, table_id, key, keyLength,
+                                       serviceLocator, bufferLength):
+        server = self.cluster.server_id(table_id, key[:keyLength])
+        serviceLocator.value = ('sim:server=%d' % server)[:bufferLength - 1]
+        return STATUS_OK
+
+    def rc_set_runtime_option(self, client, option, value):
+        return STATUS_OK
+
+    def rc_testing_wait_for_all_tablets_normal(self, client, nanoseconds):
+        pass
+
+    def rc_set_log_file(self, path):
+        pass
+
+@contextlib.contextmanager
+def simulated(cluster=None, module=ramcloud, **kwargs):
+    """Run the clients of C{module} on a simulated cluster for a while.
+
+    Installs a L{SimLibrary} as C{module.so} and puts back the real library
+    on the way out.
+
+    @param cluster: the simulated cluster, or C{None} for a new one
+    @type  cluster: L{Cluster}
+
+    @param module: the bindings module to patch, such as Dragonflow's copy
+                   of L{ramcloud}
+
+    Other keyword arguments go to L{SimLibrary}.
+
+    @return: the cluster
+    """
+    library = SimLibrary(cluster, **kwargs)
+    saved = module.so
+    module.so = library
+    try:
+        yield library.cluster
+    finally:
+        module.so = saved
@@ -71,6 +71,17 @@ class Test(object):
         self.options = options
         self.args = args
 
+    def fill_cache(self, oids):
+        """Read the objects in C{oids} that aren't cached in one batch."""
+        missing = [oid for oid in oids if self.cache[oid] is None]
+        if not missing:
+            return
+        for (oid, r) in zip(missing, self.txrc.multi_read(self.table, missing)):
+            if isinstance(r, Exception):
+                raise r
+            blob, version = r
+            self.cache[oid] = (int(blob), version)
+
     def __call__(self):
         # Called by the child in its address space
         # self.global_stats, self.die are in shared memory
@@ -103,11 +114,7 @@ class Test(object):
                               Stats.to_str(self.local_stats))
                         return
                     try:
-                        for oid in accts:
-                            if self.cache[oid] is None:
-                                blob, version = self.txrc.read(self.table, oid)
-                                value = int(blob)
-                                self.cache[oid] = (value, version)
+                        self.fill_cache(accts)
                         if not self.algo(accts):
                             retry.later()
                     except BreakException:
@@ -192,6 +199,8 @@ if __name__ == '__main__':
     assert not args
 
     r = txramcloud.TxRAMCloud(7)
+    # the tables are created from scratch, so any codec will do
+    r.set_key_codec(ramcloud.IntKeyCodec())
     r.connect()
 
     r.create_table("test")
@@ -74,6 +74,17 @@ class Test(object):
     def algo(self):
         raise NotImplementedError()
 
+    def fill_cache(self, oids):
+        """Read the objects in C{oids} that aren't cached in one batch."""
+        missing = [oid for oid in oids if self.cache[oid] is None]
+        if not missing:
+            return
+        for (oid, r) in zip(missing, self.txrc.multi_read(self.table, missing)):
+            if isinstance(r, Exception):
+                raise r
+            blob, version = r
+            self.cache[oid] = (int(blob), version)
+
     def __call__(self):
         # Called by the child in its address space
         # self.global_stats, self.die are in shared memory
@@ -98,11 +109,7 @@ class Test(object):
                 for retry in RetryStrategy():
                     if die.value:
                         return
-                    for oid in self.oids:
-                        if self.cache[oid] is None:
-                            blob, version = self.txrc.read(self.table, oid)
-                            value = int(blob)
-                            self.cache[oid] = (value, version)
+                    self.fill_cache(self.oids)
                     if not self.algo():
                         retry.later()
                 i += 1
@@ -185,6 +192,8 @@ if __name__ == '__main__':
     assert not args
 
     r = txramcloud.TxRAMCloud(7)
+    # the tables are created from scratch, so any codec will do
+    r.set_key_codec(ramcloud.IntKeyCodec())
     r.connect()
 
     r.create_table("test")
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Unit tests for C{aioramcloud.py}.
+
+@see: L{aioramcloud}
+
+"""
+
+from __future__ import with_statement
+
+import threading
+import unittest
+
+import aioramcloud
+import ramcloud
+
+class MockClient(object):
+    """Stands in for L{ramcloud.RAMCloud} on each worker."""
+
+    def __init__(self, log):
+        self.log = log
+
+    def connect(self, locator, cluster_name):
+        self.log.append(('connect', locator))
+
+    def read(self, table_id, id, want_version=None):
+        if id == 'missing':
+            raise ramcloud.NoObjectError()
+        return (id * 2, 7)
+
+    def iter_table(self, table_id):
+        self.log.append('iter_table')
+        return iter([('a', '1'), ('b', '2')])
+
+    def mt_commit(self, mt):
+        return dict((k, 1) for k in mt)
+
+class FlakyClient(MockClient):
+    """A L{MockClient} whose first C{failures} connects fail."""
+
+    failures = 0
+
+    def connect(self, locator, cluster_name):
+        MockClient.connect(self, locator, cluster_name)
+        if FlakyClient.failures > 0:
+            FlakyClient.failures -= 1
+            raise ramcloud.RCException(12)
+
+class MockLoopFuture(aioramcloud.Future):
+    """Stands in for an asyncio future."""
+
+    def __init__(self, loop):
+        aioramcloud.Future.__init__(self)
+
+    def cancelled(self):
+        return False
+
+class MockAsyncio(object):
+    Future = MockLoopFuture
+
+class MockLoop(object):
+    def call_soon_threadsafe(self, fn, *args):
+        fn(*args)
+
+class TestFuture(unittest.TestCase):
+    def test_result(self):
+        f = aioramcloud.Future()
+        self.assertFalse(f.done())
+        self.assertRaises(aioramcloud.TimeoutError, f.result, 0)
+        f.set_result(3)
+        self.assert_(f.done())
+        self.assertEqual(f.result(), 3)
+        self.assertEqual(f.exception(), None)
+
+    def test_exception(self):
+        f = aioramcloud.Future()
+        e = ramcloud.NoObjectError()
+        f.set_exception(e)
+        self.assertRaises(ramcloud.NoObjectError, f.result)
+        self.assert_(f.exception() is e)
+
+    def test_callbacks(self):
+        f = aioramcloud.Future()
+        called = []
+        f.add_done_callback(called.append)
+        self.assertEqual(called, [])
+        f.set_result(3)
+        self.assertEqual(called, [f])
+        f.add_done_callback(called.append)
+        self.assertEqual(called, [f, f])
+
+class TestAsyncRAMCloud(unittest.TestCase):
+    def setUp(self):
+        self.log = []
+        self.arc = aioramcloud.AsyncRAMCloud(
+                        locator='mock', workers=3,
+                        client_factory=lambda: MockClient(self.log))
+
+    def tearDown(self):
+        self.arc.close()
+
+    def test_connect_per_worker(self):
+        self.arc.close()
+        self.assertEqual(self.log, [('connect', 'mock')] * 3)
+
+    def test_read(self):
+        futures = [self.arc.read(1, str(i)) for i in range(20)]
+        self.assertEqual([f.result(1) for f in futures],
+                         [(str(i) * 2, 7) for i in range(20)])
+
+    def test_read_error(self):
+        f = self.arc.read(1, 'missing')
+        self.assert_(isinstance(f.exception(1), ramcloud.NoObjectError))
+
+    def test_concurrent(self):
+        # each request waits until all three workers are running one
+        cond = threading.Condition()
+        arrived = []
+        def wait(client):
+            with cond:
+                arrived.append(client)
+                cond.notifyAll()
+                while len(arrived) < 3:
+                    cond.wait(1)
+                    if len(arrived) < 3:
+                        return False
+            return True
+        futures = [self.arc.submit(wait) for i in range(3)]
+        self.assertEqual([f.result(1) for f in futures], [True] * 3)
+
+    def test_enumerate(self):
+        f = self.arc.enumerate(1)
+        self.assertEqual(f.result(1), [('a', '1'), ('b', '2')])
+        self.assertEqual(self.log[-1], 'iter_table')
+
+    def test_closed(self):
+        self.arc.close()
+        self.assertRaises(RuntimeError, self.arc.read, 1, 'a')
+
+class TestReconnect(unittest.TestCase):
+    def setUp(self):
+        self.log = []
+        FlakyClient.failures = 2
+        self.arc = aioramcloud.AsyncRAMCloud(
+                        locator='mock', workers=1,
+                        client_factory=lambda: FlakyClient(self.log))
+
+    def tearDown(self):
+        FlakyClient.failures = 0
+        self.arc.close()
+
+    def test_retries_connect(self):
+        # the connect at startup and the one for the first request fail
+        f = self.arc.read(1, 'a')
+        e = f.exception(1)
+        self.assert_(isinstance(e, ramcloud.RCException))
+        self.assertEqual(e.status, 12)
+        self.assertEqual(self.arc.read(1, 'a').result(1), ('aa', 7))
+        self.assertEqual(self.arc.read(1, 'b').result(1), ('bb', 7))
+        self.assertEqual(self.log, [('connect', 'mock')] * 3)
+
+class TestLoop(unittest.TestCase):
+    def setUp(self):
+        self.asyncio = aioramcloud.asyncio
+        aioramcloud.asyncio = MockAsyncio()
+        self.arc = aioramcloud.AsyncRAMCloud(
+                        locator='mock', workers=1, max_pending=1,
+                        loop=MockLoop(),
+                        client_factory=lambda: MockClient([]))
+
+    def tearDown(self):
+        self.arc.close()
+        aioramcloud.asyncio = self.asyncio
+
+    def test_read(self):
+        f = self.arc.read(1, 'a')
+        self.assert_(isinstance(f, MockLoopFuture))
+        self.assertEqual(f.result(1), ('aa', 7))
+
+    def test_queue_full(self):
+        started = threading.Event()
+        release = threading.Event()
+        def block(client):
+            started.set()
+            release.wait(1)
+            return True
+        first = self.arc.submit(block)
+        started.wait(1)
+        queued = self.arc.read(1, 'a')
+        # a full queue fails the request rather than blocking the loop
+        full = self.arc.read(1, 'b')
+        self.assert_(full.done())
+        self.assert_(isinstance(full.exception(), aioramcloud.QueueFull))
+        release.set()
+        self.assertEqual(first.result(1), True)
+        self.assertEqual(queued.result(1), ('aa', 7))
+
+class TestAsyncTxRAMCloud(unittest.TestCase):
+    def test_mt_commit(self):
+        log = []
+        with aioramcloud.AsyncTxRAMCloud(
+                    7, locator='mock', workers=1,
+                    client_factory=lambda: MockClient(log)) as arc:
+            f = arc.mt_commit({(1, 'a'): None})
+            self.assertEqual(f.result(1), {(1, 'a'): 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,10 +23,12 @@ from __future__ import with_statement
 import unittest
 
 from testutil import Opaque, Counter, BreakException, MockRetry
+from test_ramcloud import SimulatedTestCase
 
 import ramcloud
 import retries
 import oidres
+import txramcloud
 
 class TestOIDRes(unittest.TestCase):
 
@@ -37,21 +39,16 @@ class TestOIDRes(unittest.TestCase):
         def __init__(self, testcase):
             self.tc = testcase
 
-        def read(self, table, oid):
+        def increment(self, table, oid, delta):
             self.tc.assertEqual(table, self.tc.table)
             self.tc.assertEqual(oid, self.tc.oid)
-            next_avail, version = self.real_read()
-            return (oidres.pack(next_avail), version)
+            return self.real_increment(delta)
 
-        def update(self, table, oid, data, want_version):
-            self.tc.assertEqual(table, self.tc.table)
-            self.tc.assertEqual(oid, self.tc.oid)
-            self.real_update(oidres.unpack(data), want_version)
-
-        def create(self, table, oid, data):
-            self.tc.assertEqual(table, self.tc.table)
-            self.tc.assertEqual(oid, self.tc.oid)
-            self.real_create(oidres.unpack(data))
+    def oidres(self, rc, delta):
+        res = oidres.OIDRes(rc, self.table, self.oid, delta=delta)
+        # see TestUpgrade
+        res._upgraded = True
+        return res
 
     def assertPackable(self, x):
         self.assertEqual(oidres.unpack(oidres.pack(x)), x)
@@ -72,111 +69,97 @@ class TestOIDRes(unittest.TestCase):
     def test_next_object(self):
         """Test that L{oidres.OIDRes.next} works in the common case."""
 
-        with Counter(self, 4) as counter:
+        with Counter(self, 2) as counter:
             class xMockRAMCloud(self.MockRAMCloud):
-                def real_read(self):
-                    i = counter.bump([0, 2])
-                    if i == 0:
-                        return (70, 54321)
-                    elif i == 2:
-                        return (900, 123450)
-
-                def real_update(self, next_avail, want_version):
-                    i = counter.bump([1, 3])
-                    if i == 1:
-                        self.tc.assertEqual(next_avail, 70 + 737)
-                        self.tc.assertEqual(want_version, 54321)
-                    elif i == 3:
-                        self.tc.assertEqual(next_avail, 900 + 737)
-                        self.tc.assertEqual(want_version, 123450)
-
-            rc = xMockRAMCloud(self)
-            res = oidres.OIDRes(rc, self.table, self.oid, delta=737)
+                def real_increment(self, delta):
+                    i = counter.bump()
+                    self.tc.assertEqual(delta, 737)
+                    return [70, 900][i] + 737
+
+            res = self.oidres(xMockRAMCloud(self), delta=737)
             for i in range(737):
-                retry_strategy = MockRetry(self)
-                self.assertEqual(res.next(retry_strategy), i + 70)
-                retry_strategy.done()
-                self.assertEqual(counter.count, 1)
+                self.assertEqual(res.next(), i + 70)
+                self.assertEqual(counter.count, 0)
             self.assertEqual(res.next(), 900)
 
     def test_next_no_object(self):
         """Test that L{oidres.OIDRes.next} works when there is no object."""
 
-        with Counter(self, 2) as counter:
+        with Counter(self, 1) as counter:
             class xMockRAMCloud(self.MockRAMCloud):
-                def real_read(self):
+                def real_increment(self, delta):
                     counter.bump(0)
-                    raise ramcloud.NoObjectError()
-
-                def real_create(self, next_avail):
-                    counter.bump(1)
-                    self.tc.assertEqual(next_avail, 737)
+                    # a missing counter counts as 0
+                    return delta
 
-            rc = xMockRAMCloud(self)
-            res = oidres.OIDRes(rc, self.table, self.oid, delta=737)
+            res = self.oidres(xMockRAMCloud(self), delta=737)
             for i in range(737):
-                retry_strategy = MockRetry(self)
-                self.assertEqual(res.next(retry_strategy), i)
-                retry_strategy.done()
-
-    def test_mismatched_version(self):
-        """Test that L{oidres.OIDRes.next} works under contention."""
-
-        with Counter(self, 2) as counter:
-            class xMockRAMCloud(self.MockRAMCloud):
-                def real_read(self):
-                    counter.bump(0)
-                    return (70, 54321)
-
-                def real_update(self, next_avail, want_version):
-                    counter.bump(1)
-                    self.tc.assertEqual(next_avail, 70 + 737)
-                    self.tc.assertEqual(want_version, 54321)
-                    raise ramcloud.VersionError(54321, 54322)
-
-            rc = xMockRAMCloud(self)
-            res = oidres.OIDRes(rc, self.table, self.oid, delta=737)
-            retry_strategy = MockRetry(self, expect_later=True)
-            self.assertRaises(BreakException, lambda: res.next(retry_strategy))
-            retry_strategy.done()
+                self.assertEqual(res.next(), i)
 
     def test_reserve_lazily(self):
         """Test that L{oidres.OIDRes.reserve_lazily} works."""
 
-        with Counter(self, 4) as counter:
+        with Counter(self, 2) as counter:
 
             class xMockRAMCloud(self.MockRAMCloud):
-                def real_read(self):
-                    i = counter.bump([0, 2])
-                    if i == 0:
-                        return (70, 54321)
-                    elif i == 2:
-                        return (900, 123450)
-
-                def real_update(self, next_avail, want_version):
-                    i = counter.bump([1, 3])
-                    if i == 1:
-                        self.tc.assertEqual(next_avail, 70 + 737)
-                        self.tc.assertEqual(want_version, 54321)
-                    elif i == 3:
-                        self.tc.assertEqual(next_avail, 900 + 737)
-                        self.tc.assertEqual(want_version, 123450)
-
-            rc = xMockRAMCloud(self)
-            res = oidres.OIDRes(rc, self.table, self.oid, delta=737)
+                def real_increment(self, delta):
+                    return [70, 900][counter.bump()] + delta
+
+            res = self.oidres(xMockRAMCloud(self), delta=737)
             l = []
             for i in range(740):
                 l.append(res.reserve_lazily())
             self.assertEqual(counter.count, -1)
             self.assertEqual(int(l[30]), 70)
-            self.assertEqual(counter.count, 1)
+            self.assertEqual(counter.count, 0)
             self.assertEqual(int(l[739]), 71)
             self.assertEqual(int(l[0]), 72)
-            self.assertEqual(counter.count, 1)
+            self.assertEqual(counter.count, 0)
             for i in range(740):
                 int(l[i])
             self.assertEqual(int(l[737]), 901)
             self.assertEqual(int(l[738]), 902)
 
+class TestUpgrade(SimulatedTestCase):
+    """Reservation objects written by version 1 of L{oidres} are turned into
+    counters, on a simulated cluster."""
+
+    def test_plain(self):
+        self.rc.write(self.table, 'res', oidres.pack(70))
+        res = oidres.OIDRes(self.rc, self.table, 'res', delta=10)
+        self.assertEqual(res.next(), 70)
+        self.assertEqual(self.rc.read(self.table, 'res')[0],
+                         ramcloud.pack_counter(80))
+
+    def test_packed_by_txramcloud(self):
+        txrc = txramcloud.TxRAMCloud(self.table)
+        txrc.connect()
+        txrc.write(self.table, txramcloud.TXID_RES_OID, oidres.pack(70))
+        self.assertEqual(txrc.txid_res.next(), 70)
+        self.assertEqual(self.rc.read(self.table, txramcloud.TXID_RES_OID)[0],
+                         ramcloud.pack_counter(80))
+
+    def test_missing(self):
+        res = oidres.OIDRes(self.rc, self.table, 'res', delta=10)
+        self.assertEqual(res.next(), 0)
+        self.assertEqual(res.next(), 1)
+
+    def test_retry(self):
+        self.rc.write(self.table, 'res', oidres.pack(70))
+        res = oidres.OIDRes(self.rc, self.table, 'res', delta=10)
+        real_write_rr = ramcloud.RAMCloud.__dict__['write_rr']
+        def write_rr(rc, table_id, key, data, reject_rules):
+            # someone else upgrades it first
+            ramcloud.RAMCloud.write_rr = real_write_rr
+            self.rc.write(self.table, 'res', ramcloud.pack_counter(100))
+            return real_write_rr(rc, table_id, key, data, reject_rules)
+        ramcloud.RAMCloud.write_rr = write_rr
+        try:
+            retry_strategy = MockRetry(self, expect_later=True)
+            self.assertRaises(BreakException, res._upgrade, retry_strategy)
+            retry_strategy.done()
+        finally:
+            ramcloud.RAMCloud.write_rr = real_write_rr
+
 if __name__ == '__main__':
     unittest.main()
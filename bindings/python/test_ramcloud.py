@@ -0,0 +1,1247 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Unit tests for C{ramcloud.py}.
+
+These tests replace L{ramcloud.so} with a mock, so they don't need a running
+cluster.
+
+@see: L{ramcloud}
+
+"""
+
+from __future__ import with_statement
+
+import ctypes
+import os
+import signal
+import threading
+import time
+import unittest
+
+from testutil import Counter
+import ramcloud
+import simramcloud
+
+class MockSO(object):
+    """Stands in for the C{libramcloud.so} handle.
+
+    Each test assigns the C{rc_*} functions it expects to be called.
+    """
+    pass
+
+def deref(arg):
+    """Return the object passed to C{ctypes.byref}."""
+    return arg._obj
+
+class RAMCloudTestCase(unittest.TestCase):
+    def setUp(self):
+        self.save_so = ramcloud.so
+        self.so = MockSO()
+        ramcloud.so = self.so
+        self.rc = ramcloud.RAMCloud()
+
+    def tearDown(self):
+        del self.rc
+        ramcloud.so = self.save_so
+
+class SimulatedTestCase(unittest.TestCase):
+    """Runs each test on a fresh simulated cluster, with a connected client
+    in C{self.rc} and the id of its table C{'t'} in C{self.table}."""
+
+    def setUp(self):
+        self.sim = simramcloud.simulated()
+        self.cluster = self.sim.__enter__()
+        self.rc = ramcloud.RAMCloud()
+        self.rc.connect()
+        self.rc.create_table('t')
+        self.table = self.rc.get_table_id('t')
+
+    def tearDown(self):
+        del self.rc
+        self.sim.__exit__(None, None, None)
+
+class TestBufferPool(unittest.TestCase):
+    def test_reuse(self):
+        pool = ramcloud.BufferPool(initial_size=64)
+        buf = pool.get()
+        self.assertEqual(len(buf), 64)
+        pool.put(buf)
+        self.assert_(pool.get() is buf)
+
+    def test_grow(self):
+        pool = ramcloud.BufferPool(initial_size=64)
+        buf = pool.grow(pool.get(), 1000)
+        self.assertEqual(len(buf), 1024)
+
+    def test_put_too_large(self):
+        pool = ramcloud.BufferPool(initial_size=64, max_size=128)
+        pool.put(pool.grow(pool.get(), 1000))
+        self.assertEqual(len(pool.get()), 64)
+
+    def test_max_free(self):
+        pool = ramcloud.BufferPool(initial_size=64, max_free=1)
+        a = pool.get()
+        b = pool.get()
+        pool.put(a)
+        pool.put(b)
+        self.assert_(pool.get() is a)
+        self.assert_(pool.get() is not b)
+
+class TestRead(RAMCloudTestCase):
+    def mock_read(self, objects, counter=None):
+        def rc_read(client, table_id, key, key_length, reject_rules,
+                    got_version, buf, max_length, actual_length):
+            if counter is not None:
+                counter.bump()
+            data = objects[key[:key_length]]
+            ctypes.memmove(deref(buf), data, min(len(data), max_length))
+            deref(actual_length).value = len(data)
+            deref(got_version).value = 7
+            return 0
+        self.so.rc_read = rc_read
+
+    def test_read_small(self):
+        self.mock_read({'k': 'x' * 100})
+        self.assertEqual(self.rc.read(3, 'k'), ('x' * 100, 7))
+
+    def test_read_binary(self):
+        self.mock_read({'k': 'binary\0safe?'})
+        self.assertEqual(self.rc.read(3, 'k'), ('binary\0safe?', 7))
+
+    def test_read_grows_buffer(self):
+        big = ''.join(chr(i % 251) for i in range(10000))
+        with Counter(self, 3) as counter:
+            self.mock_read({'big': big}, counter)
+            self.assertEqual(self.rc.read(3, 'big'), (big, 7))
+            # the grown buffer is kept, so the second read takes one call
+            self.assertEqual(self.rc.read(3, 'big'), (big, 7))
+
+    def test_read_view(self):
+        self.mock_read({'k': 'hello'})
+        view, version = self.rc.read_rr_view(3, 'k', ramcloud.RejectRules())
+        self.assertEqual(view.tobytes(), 'hello')
+        self.assertEqual(len(view), 5)
+        self.assertEqual(version, 7)
+
+    def test_read_error_returns_buffer(self):
+        def rc_read(*args):
+            return 2
+        self.so.rc_read = rc_read
+        self.assertRaises(ramcloud.NoObjectError, self.rc.read, 3, 'k')
+        self.assertEqual(len(self.rc.buffers._free), 1)
+
+class TestRejectError(unittest.TestCase):
+    def test_accept(self):
+        self.assertEqual(ramcloud.reject_error(ramcloud.RejectRules(), 5),
+                         None)
+        rr = ramcloud.RejectRules.exactly(5)
+        self.assertEqual(ramcloud.reject_error(rr, 5), None)
+
+    def test_reject(self):
+        rr = ramcloud.RejectRules(object_exists=True)
+        self.assert_(isinstance(ramcloud.reject_error(rr, 5),
+                                ramcloud.ObjectExistsError))
+        rr = ramcloud.RejectRules(version_eq_given=True, given_version=5)
+        self.assert_(isinstance(ramcloud.reject_error(rr, 5),
+                                ramcloud.VersionError))
+        rr = ramcloud.RejectRules.exactly(4)
+        e = ramcloud.reject_error(rr, 5)
+        self.assertEqual((e.want_version, e.got_version), (4, 5))
+
+class TestMultiRead(RAMCloudTestCase):
+    def test_fallback(self):
+        objects = {'a': 'apple', 'c': 'cherry'}
+        def rc_read(client, table_id, key, key_length, reject_rules,
+                    got_version, buf, max_length, actual_length):
+            key = key[:key_length]
+            if key not in objects:
+                return 2
+            ctypes.memmove(deref(buf), objects[key], len(objects[key]))
+            deref(actual_length).value = len(objects[key])
+            deref(got_version).value = ord(key)
+            return 0
+        self.so.rc_read = rc_read
+        r = self.rc.multi_read(3, ['a', 'b', 'c'])
+        self.assertEqual(r[0], ('apple', ord('a')))
+        self.assert_(isinstance(r[1], ramcloud.NoObjectError))
+        self.assertEqual(r[2], ('cherry', ord('c')))
+
+    def test_native(self):
+        objects = {'a': ('apple', 0), 'b': ('', 2), 'c': ('cherry', 0)}
+        created = {}
+        destroyed = []
+        self.so.rc_multiOpSizeOf = lambda type: 16
+        def rc_multiReadCreate(table_id, key, key_length, buf, max_length,
+                               actual_length, where):
+            self.assertEqual(table_id, 3)
+            created[where] = (key[:key_length], deref(buf),
+                              deref(actual_length))
+        def rc_multiRead(client, objs, count):
+            self.assertEqual(count, 3)
+            for i in range(count):
+                key, buf, actual_length = created[objs[i]]
+                data = objects[key][0]
+                ctypes.memmove(buf, data, len(data))
+                actual_length.value = len(data)
+        def rc_multiOpStatus(where, type):
+            return objects[created[where][0]][1]
+        def rc_multiOpVersion(where, type):
+            return 9
+        self.so.rc_multiReadCreate = rc_multiReadCreate
+        self.so.rc_multiRead = rc_multiRead
+        self.so.rc_multiOpStatus = rc_multiOpStatus
+        self.so.rc_multiOpVersion = rc_multiOpVersion
+        self.so.rc_multiOpDestroy = lambda where, type: destroyed.append(where)
+
+        rr = ramcloud.RejectRules(object_doesnt_exist=True)
+        r = self.rc.multi_read_rr(3, [('a', rr), ('b', rr),
+                                      ('c', ramcloud.RejectRules.exactly(8))])
+        self.assertEqual(r[0], ('apple', 9))
+        self.assert_(isinstance(r[1], ramcloud.NoObjectError))
+        self.assert_(isinstance(r[2], ramcloud.VersionError))
+        self.assertEqual(sorted(destroyed), sorted(created.keys()))
+
+class TestMultiWrite(RAMCloudTestCase):
+    def test_fallback(self):
+        objects = {'a': 'old'}
+        def rc_write(client, table_id, key, key_length, data, length,
+                     reject_rules, got_version):
+            key = key[:key_length]
+            if deref(reject_rules).object_exists and key in objects:
+                return 3
+            objects[key] = data[:length]
+            deref(got_version).value = 5
+            return 0
+        self.so.rc_write = rc_write
+        rr = ramcloud.RejectRules(object_exists=True)
+        r = self.rc.multi_write(3, [('a', 'x', rr), ('b', 'y', rr)])
+        self.assert_(isinstance(r[0], ramcloud.ObjectExistsError))
+        self.assertEqual(r[1], 5)
+        self.assertEqual(objects, {'a': 'old', 'b': 'y'})
+
+    def mock_multi_op(self, name, statuses):
+        created = {}
+        destroyed = []
+        self.so.rc_multiOpSizeOf = lambda type: 16
+        def create(table_id, key, key_length, *args):
+            self.assertEqual(table_id, 3)
+            created[args[-1]] = key[:key_length]
+        def multi_op(client, objs, count):
+            self.assertEqual(count, len(statuses))
+        setattr(self.so, 'rc_%sCreate' % name, create)
+        setattr(self.so, 'rc_%s' % name, multi_op)
+        self.so.rc_multiRead = multi_op
+        self.so.rc_multiOpStatus = lambda where, type: statuses[created[where]]
+        self.so.rc_multiOpVersion = lambda where, type: 9
+        self.so.rc_multiOpDestroy = lambda where, type: destroyed.append(where)
+        return created, destroyed
+
+    def test_native_write(self):
+        created, destroyed = self.mock_multi_op('multiWrite',
+                                                {'a': 0, 'b': 4})
+        r = self.rc.multi_write(3, [('a', 'x', ramcloud.RejectRules()),
+                                    ('b', 'y', ramcloud.RejectRules.exactly(8))])
+        self.assertEqual(r[0], 9)
+        self.assert_(isinstance(r[1], ramcloud.VersionError))
+        self.assertEqual((r[1].want_version, r[1].got_version), (8, 9))
+        self.assertEqual(sorted(destroyed), sorted(created.keys()))
+
+    def test_native_remove(self):
+        created, destroyed = self.mock_multi_op('multiRemove',
+                                                {'a': 0, 'b': 2})
+        rr = ramcloud.RejectRules(object_doesnt_exist=True)
+        r = self.rc.multi_remove(3, [('a', rr), ('b', rr)])
+        self.assertEqual(r[0], 9)
+        self.assert_(isinstance(r[1], ramcloud.NoObjectError))
+        self.assertEqual(sorted(destroyed), sorted(created.keys()))
+
+class MockPoolClient(object):
+    def __init__(self, log):
+        self.log = log
+        self.healthy = True
+        log.append('new')
+
+    def connect(self, serverLocator, clusterName):
+        self.log.append(('connect', serverLocator))
+
+    def check(self):
+        self.log.append('check')
+        if not self.healthy:
+            raise ramcloud.RCException(12)
+
+    def read(self, table_id, id):
+        return (id, 1)
+
+    def iter_table(self, table_id):
+        for i in range(3):
+            yield (str(i), self)
+
+class TestRAMCloudPool(unittest.TestCase):
+    def setUp(self):
+        self.log = []
+        self.pool = ramcloud.RAMCloudPool(
+                        size=2, serverLocator='loc', timeout=0.01,
+                        client_factory=lambda: MockPoolClient(self.log))
+
+    def test_lazy_connect(self):
+        self.assertEqual(self.log, [])
+        with self.pool.client() as a:
+            self.assertEqual(self.log, ['new', ('connect', 'loc')])
+        with self.pool.client() as b:
+            self.assert_(a is b)
+        self.assertEqual(len(self.log), 2)
+
+    def test_nested(self):
+        with self.pool.client() as a:
+            with self.pool.client() as b:
+                self.assert_(a is b)
+            # still held by the outer block
+            with self.pool.client() as c:
+                self.assert_(c is a)
+
+    def hold_in_thread(self):
+        # Acquires a client on another thread and holds it until the returned
+        # release function is called.
+        got = []
+        acquired = threading.Event()
+        release = threading.Event()
+        def hold():
+            got.append(self.pool.acquire())
+            acquired.set()
+            release.wait()
+            self.pool.release(got[0])
+        t = threading.Thread(target=hold)
+        t.start()
+        acquired.wait()
+        def finish():
+            release.set()
+            t.join()
+        return got[0], finish
+
+    def test_timeout(self):
+        a = self.pool.acquire()
+        b, finish = self.hold_in_thread()
+        self.assert_(a is not b)
+        failed = []
+        def third():
+            try:
+                self.pool.acquire()
+            except ramcloud.PoolTimeout:
+                failed.append(True)
+        t = threading.Thread(target=third)
+        t.start()
+        t.join()
+        self.assertEqual(failed, [True])
+        finish()
+        self.pool.release(a)
+
+    def test_affinity(self):
+        a = self.pool.acquire()
+        b, finish = self.hold_in_thread()
+        self.pool.release(a)
+        finish()
+        # b was released last, but this thread gets a back
+        self.assert_(self.pool.acquire() is a)
+
+    def test_broken(self):
+        try:
+            with self.pool.client() as a:
+                raise ramcloud.RCException(12)
+        except ramcloud.RCException:
+            pass
+        with self.pool.client() as b:
+            self.assert_(a is not b)
+
+    def test_missing_table_keeps_client(self):
+        try:
+            with self.pool.client() as a:
+                raise ramcloud.TableDoesntExistError(
+                        ramcloud.STATUS_TABLE_DOESNT_EXIST)
+        except ramcloud.TableDoesntExistError:
+            pass
+        with self.pool.client() as b:
+            self.assert_(a is b)
+
+    def test_object_error_keeps_client(self):
+        try:
+            with self.pool.client() as a:
+                raise ramcloud.NoObjectError()
+        except ramcloud.NoObjectError:
+            pass
+        with self.pool.client() as b:
+            self.assert_(a is b)
+
+    def test_health_check(self):
+        self.pool.check_interval = 0
+        with self.pool.client() as a:
+            pass
+        time.sleep(0.001)
+        with self.pool.client() as b:
+            self.assert_(a is b)
+        self.assertEqual(self.log[-1], 'check')
+        a.healthy = False
+        time.sleep(0.001)
+        with self.pool.client() as c:
+            self.assert_(c is not a)
+
+    def test_health_check_any_error(self):
+        self.pool.check_interval = 0
+        with self.pool.client() as a:
+            pass
+        def check():
+            raise AttributeError('rc_getTableId')
+        a.check = check
+        time.sleep(0.001)
+        with self.pool.client() as b:
+            self.assert_(b is not a)
+
+    def test_shared_table_ids(self):
+        a = self.pool.acquire()
+        b, finish = self.hold_in_thread()
+        self.assert_(a.table_ids is b.table_ids is self.pool.table_ids)
+        finish()
+        self.pool.release(a)
+
+    def test_proxy(self):
+        rc = self.pool.proxy()
+        self.assertEqual(rc.read(1, 'k'), ('k', 1))
+        self.assertRaises(AttributeError, getattr, rc, 'no_such_method')
+
+    def test_proxy_iter_closed_on_other_thread(self):
+        it = self.pool.proxy().iter_table(1)
+        key, a = it.next()
+        errors = []
+        def close():
+            try:
+                it.close()
+            except Exception, e:
+                errors.append(e)
+        thread = threading.Thread(target=close)
+        thread.start()
+        thread.join()
+        self.assertEqual(errors, [])
+        # the client went back to the pool, and isn't this thread's
+        with self.pool.client() as b:
+            with self.pool.client() as c:
+                pass
+        self.assert_(a in (b, c))
+        self.assertEqual(self.pool._local.client, None)
+
+    def test_proxy_iter_in_block(self):
+        with self.pool.client() as a:
+            objs = list(self.pool.proxy().iter_table(1))
+            self.assertEqual([obj[1] for obj in objs], [a] * 3)
+            with self.pool.client() as b:
+                self.assert_(a is b)
+
+class TestTableIds(RAMCloudTestCase):
+    def setUp(self):
+        RAMCloudTestCase.setUp(self)
+        self.tables = {'a': 10}
+        self.calls = []
+        def rc_getTableId(client, name, table_id):
+            self.calls.append(name)
+            if name not in self.tables:
+                return ramcloud.STATUS_TABLE_DOESNT_EXIST
+            deref(table_id).value = self.tables[name]
+            return 0
+        self.so.rc_getTableId = rc_getTableId
+        self.so.rc_createTable = lambda client, name, span: 0
+        self.so.rc_dropTable = lambda client, name: 0
+
+    def test_cached(self):
+        self.assertEqual(self.rc.get_table_id('a'), 10)
+        self.assertEqual(self.rc.get_table_id('a'), 10)
+        self.assertEqual(self.calls, ['a'])
+        self.assertEqual((self.rc.table_ids.hits, self.rc.table_ids.misses),
+                         (1, 1))
+
+    def test_unknown(self):
+        self.assertRaises(ramcloud.TableDoesntExistError,
+                          self.rc.get_table_id, 'b')
+        self.assertRaises(ramcloud.TableDoesntExistError,
+                          self.rc.get_table_id, 'b')
+        self.assertEqual(self.calls, ['b', 'b'])
+
+    def test_create_drop(self):
+        self.rc.get_table_id('a')
+        self.rc.drop_table('a')
+        self.tables['a'] = 11
+        self.rc.create_table('a')
+        self.assertEqual(self.rc.get_table_id('a'), 11)
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    def test_check(self):
+        self.rc.get_table_id('a')
+        self.rc.check()
+        self.assertEqual(self.calls, ['a', ramcloud.CHECK_TABLE])
+        # a missing table is still an answer, and the cache is kept
+        self.assertEqual(self.rc.get_table_id('a'), 10)
+        self.assertEqual(self.calls, ['a', ramcloud.CHECK_TABLE])
+        self.so.rc_getTableId = lambda client, name, table_id: 12
+        try:
+            self.rc.check()
+        except ramcloud.RCException, e:
+            self.assertEqual(e.status, 12)
+        else:
+            self.fail()
+
+    def test_stale(self):
+        self.rc.get_table_id('a')
+        # another client dropped and recreated the table
+        self.tables['a'] = 11
+        self.so.rc_write = lambda *args: ramcloud.STATUS_TABLE_DOESNT_EXIST
+        self.assertRaises(ramcloud.TableDoesntExistError,
+                          self.rc.write, 10, 'k', 'v')
+        self.assertEqual(self.rc.get_table_id('a'), 11)
+
+class TestIterTable(RAMCloudTestCase):
+    def setUp(self):
+        RAMCloudTestCase.setUp(self)
+        self.objects = [('k%d' % i, 'value\0%d' % i) for i in range(5)]
+        self.finalized = []
+        def rc_enumerateTablePrepare(client, table_id, keys_only, state):
+            self.keys_only = keys_only
+            deref(state).value = 1
+        self.next = 0
+        self.keep = []
+        def rc_enumerateTableNext(client, state, key_length, key,
+                                  data_length, data):
+            if self.next < len(self.objects):
+                k, v = self.objects[self.next]
+                kbuf = ctypes.create_string_buffer(k)
+                vbuf = ctypes.create_string_buffer(v)
+                self.keep += [kbuf, vbuf]
+                deref(key_length).value = len(k)
+                deref(key).value = ctypes.addressof(kbuf)
+                deref(data_length).value = len(v)
+                if not self.keys_only:
+                    deref(data).value = ctypes.addressof(vbuf)
+                self.next += 1
+            return 0
+        self.so.rc_enumerateTablePrepare = rc_enumerateTablePrepare
+        self.so.rc_enumerateTableNext = rc_enumerateTableNext
+        self.so.rc_enumerateTableFinalize = self.finalized.append
+
+    def test_all(self):
+        self.assertEqual(list(self.rc.iter_table(3, batch=2)), self.objects)
+        self.assertEqual(len(self.finalized), 1)
+
+    def test_keys_only(self):
+        self.assertEqual(list(self.rc.iter_table(3, keys_only=True)),
+                         [(k, '') for (k, v) in self.objects])
+        self.assertEqual(self.keys_only, 1)
+
+    def test_keys(self):
+        self.assertEqual(list(self.rc.iter_keys(3)),
+                         [k for (k, v) in self.objects])
+        self.assertEqual(self.keys_only, 1)
+
+    def test_diff_keys(self):
+        added, removed = self.rc.diff_keys(3, ['k1', 'k3', 'gone'])
+        self.assertEqual(added, set(['k0', 'k2', 'k4']))
+        self.assertEqual(removed, set(['gone']))
+        self.assertEqual(self.keys_only, 1)
+        self.assertEqual(len(self.finalized), 1)
+
+    def test_early_exit(self):
+        it = self.rc.iter_table(3, batch=2)
+        self.assertEqual(it.next(), self.objects[0])
+        self.assertEqual(self.finalized, [])
+        it.close()
+        self.assertEqual(len(self.finalized), 1)
+
+    def test_error(self):
+        self.so.rc_enumerateTableNext = lambda *args: 12
+        self.assertRaises(ramcloud.RCException, list, self.rc.iter_table(3))
+        self.assertEqual(len(self.finalized), 1)
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recent(self):
+        cache = ramcloud.LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(len(cache), 2)
+
+class TestKeyCodecs(RAMCloudTestCase):
+    def test_str(self):
+        codec = ramcloud.StrKeyCodec()
+        self.assertEqual(codec.encode(12), '12')
+        self.assertEqual(codec.encode(2**64 - 1), str(2**64 - 1))
+        self.assertEqual(codec.encode('key'), 'key')
+
+    def test_int(self):
+        codec = ramcloud.IntKeyCodec()
+        self.assertEqual(codec.encode(1), '\0' * 7 + '\1')
+        self.assertEqual(codec.encode(2**64 - 1), '\xff' * 8)
+        keys = [codec.encode(i) for i in [0, 9, 10, 255, 256, 70000]]
+        self.assertEqual(sorted(keys), keys)
+        self.assertEqual(ramcloud.IntKeyCodec(2).encode(258), '\1\2')
+
+    def test_tuple(self):
+        codec = ramcloud.TupleKeyCodec()
+        self.assertEqual(codec.encode((1, 'ab')),
+                         'i' + '\0' * 7 + '\1' + 's\0\2ab')
+        self.assertEqual(codec.encode(5), '5')
+        self.assertRaises(TypeError, codec.encode, (1.5,))
+
+    def test_encode_key(self):
+        keys = []
+        def rc_write(client, table_id, key, key_length, data, length,
+                     reject_rules, got_version):
+            keys.append(key[:key_length])
+            return 0
+        self.so.rc_write = rc_write
+        self.rc.write(1, 7, 'x')
+        self.rc.set_key_codec(ramcloud.IntKeyCodec(4))
+        self.rc.write(1, 7, 'x')
+        self.rc.write(1, 'name', 'x')
+        self.assertEqual(keys, ['7', '\0\0\0\7', 'name'])
+
+class TestStats(RAMCloudTestCase):
+    def test_histogram(self):
+        h = ramcloud.LatencyHistogram()
+        for i in range(99):
+            h.add(0.000003)
+        h.add(0.5)
+        self.assertEqual(h.counts[2], 99)
+        self.assertEqual(h.percentile(50), 0.000004)
+        self.assertEqual(h.percentile(100), 0.5)
+        h.add(10 ** 6)
+        self.assertEqual(h.counts[-1], 1)
+
+    def test_read_write(self):
+        self.so.rc_write = lambda *args: 0
+        def rc_read(client, table_id, key, key_length, reject_rules,
+                    got_version, buf, max_length, actual_length):
+            if key[:key_length] == 'missing':
+                return 2
+            deref(actual_length).value = 10
+            return 0
+        self.so.rc_read = rc_read
+        self.rc.write(1, 'k', 'x' * 5)
+        self.rc.read(1, 'k')
+        self.assertRaises(ramcloud.NoObjectError, self.rc.read, 1, 'missing')
+        stats = self.rc.stats()
+        self.assertEqual(sorted(stats.keys()), ['read', 'write'])
+        self.assertEqual(stats['write']['count'], 1)
+        self.assertEqual(stats['write']['bytes_out'], 5)
+        self.assertEqual(stats['read']['count'], 2)
+        self.assertEqual(stats['read']['bytes_in'], 10)
+        self.assertEqual(stats['read']['errors'], {2: 1})
+        self.assertEqual(sum(stats['read']['latency']['buckets']), 2)
+        self.rc.reset_stats()
+        self.assertEqual(self.rc.stats(), {})
+
+class MockFunction(object):
+    argtypes = None
+    restype = None
+
+class TestLazyLibrary(unittest.TestCase):
+    def setUp(self):
+        self.lib = MockSO()
+        self.lib.rc_connect = MockFunction()
+        self.lib.rc_testing_kill = MockFunction()
+        self.loads = []
+        def loader():
+            self.loads.append(1)
+            return self.lib
+        self.so = ramcloud.LazyLibrary(loader)
+
+    def test_loads_on_first_use(self):
+        self.assertFalse(self.so.loaded())
+        self.assertTrue(self.so.rc_connect is self.lib.rc_connect)
+        self.assertTrue(self.so.loaded())
+        self.so.rc_connect
+        self.so.rc_testing_kill
+        self.assertEqual(self.loads, [1])
+
+    def test_declares_on_demand(self):
+        self.so.rc_connect
+        self.assertEqual(self.lib.rc_connect.restype, ctypes.c_int)
+        self.assertEqual(len(self.lib.rc_connect.argtypes), 3)
+        self.assertEqual(self.lib.rc_testing_kill.restype, None)
+
+    def test_missing_function(self):
+        self.assertFalse(hasattr(self.so, 'rc_multiRead'))
+        self.assertTrue(hasattr(self.so, 'rc_connect'))
+
+    def test_own_prototypes(self):
+        so = ramcloud.LazyLibrary(lambda: self.lib,
+                                  lambda: {'rc_connect': ([ctypes.c_int],
+                                                          ctypes.c_char)})
+        so.rc_connect
+        self.assertEqual(self.lib.rc_connect.argtypes, [ctypes.c_int])
+        self.assertEqual(self.lib.rc_connect.restype, ctypes.c_char)
+
+    def test_missing_function_remembered(self):
+        self.assertFalse(hasattr(self.so, 'rc_multiRead'))
+        # the library isn't asked again
+        self.lib.rc_multiRead = MockFunction()
+        self.assertFalse(hasattr(self.so, 'rc_multiRead'))
+
+    def test_prototypes(self):
+        names = set(ramcloud.prototypes())
+        for name in ['rc_connect', 'rc_read', 'rc_write', 'rc_remove',
+                     'rc_multiRead', 'rc_enumerateTableNext']:
+            self.assertTrue(name in names)
+
+class TestConnect(RAMCloudTestCase):
+    def setUp(self):
+        RAMCloudTestCase.setUp(self)
+        self.connects = []
+        def rc_connect(locator, cluster_name, client):
+            self.connects.append(locator)
+            deref(client).value = 0x1000
+            return 0
+        self.so.rc_connect = rc_connect
+        self.so.rc_disconnect = lambda client: None
+        self.so.rc_dropTable = lambda client, name: 0
+
+    def test_eager(self):
+        self.rc.connect('loc')
+        self.assertEqual(self.connects, ['loc'])
+        self.assertTrue(self.rc.connected())
+
+    def test_lazy(self):
+        self.rc.connect('loc', lazy=True)
+        self.assertEqual(self.connects, [])
+        self.assertFalse(self.rc.connected())
+        self.rc.drop_table('t')
+        self.rc.drop_table('t')
+        self.assertEqual(self.connects, ['loc'])
+        self.assertTrue(self.rc.connected())
+
+    def test_lazy_failure_retried(self):
+        self.so.rc_connect = lambda locator, cluster_name, client: 7
+        self.rc.connect('loc', lazy=True)
+        try:
+            self.rc.drop_table('t')
+        except ramcloud.RCException, e:
+            self.assertEqual(e.status, 7)
+        else:
+            self.fail()
+        self.assertFalse(self.rc.connected())
+        self.so.rc_connect = lambda locator, cluster_name, client: 0
+        self.rc.drop_table('t')
+
+class TestReadCache(SimulatedTestCase):
+    def setUp(self):
+        SimulatedTestCase.setUp(self)
+        self.rc.read_cache = ramcloud.ReadCache()
+        self.other = ramcloud.RAMCloud()
+        self.other.connect()
+
+    def tearDown(self):
+        del self.other
+        SimulatedTestCase.tearDown(self)
+
+    def bytes_read(self):
+        return self.rc.stats()['read']['bytes_in']
+
+    def test_bounds(self):
+        cache = ramcloud.ReadCache(max_entries=2, max_bytes=10)
+        cache.put(1, 'a', 'x' * 4, 1)
+        cache.put(1, 'b', 'x' * 4, 1)
+        cache.get(1, 'a')
+        cache.put(1, 'c', 'x' * 4, 1)
+        self.assertEqual(cache.get(1, 'b'), None)
+        self.assertEqual(cache.get(1, 'a'), ('x' * 4, 1))
+        cache.put(1, 'd', 'x' * 8, 1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.bytes, 8)
+        cache.put(1, 'e', 'x' * 11, 1)
+        self.assertEqual(cache.get(1, 'e'), None)
+
+    def test_unchanged_not_transferred(self):
+        v = self.rc.write(self.table, 'k', 'x' * 1000)
+        self.assertEqual(self.rc.read_cached(self.table, 'k'), ('x' * 1000, v))
+        self.assertEqual(self.bytes_read(), 1000)
+        for i in range(3):
+            self.assertEqual(self.rc.read_cached(self.table, 'k'),
+                             ('x' * 1000, v))
+        self.assertEqual(self.bytes_read(), 1000)
+        self.assertEqual(self.rc.read_cache.fresh, 3)
+
+    def test_changed_elsewhere(self):
+        self.rc.write(self.table, 'k', 'a')
+        self.rc.read_cached(self.table, 'k')
+        v = self.other.write(self.table, 'k', 'b')
+        self.assertEqual(self.rc.read_cached(self.table, 'k'), ('b', v))
+        self.assertEqual(self.rc.read_cache.changed, 1)
+        self.other.delete(self.table, 'k')
+        self.assertRaises(ramcloud.NoObjectError, self.rc.read_cached,
+                          self.table, 'k')
+        self.assertEqual(len(self.rc.read_cache), 0)
+
+    def test_own_writes_invalidate(self):
+        self.rc.write(self.table, 'k', 'a')
+        self.rc.read_cached(self.table, 'k')
+        v = self.rc.write(self.table, 'k', 'b')
+        self.assertEqual(len(self.rc.read_cache), 0)
+        self.assertEqual(self.rc.read_cached(self.table, 'k'), ('b', v))
+        self.rc.delete(self.table, 'k')
+        self.assertEqual(len(self.rc.read_cache), 0)
+
+    def test_multi_read_cached(self):
+        self.rc.write(self.table, 'a', 'x' * 100)
+        self.rc.write(self.table, 'b', 'y' * 100)
+        self.rc.read_cached(self.table, 'a')
+        results = self.rc.multi_read_cached(self.table, ['a', 'b', 'c'])
+        self.assertEqual([r[0] for r in results[:2]], ['x' * 100, 'y' * 100])
+        self.assertTrue(isinstance(results[2], ramcloud.NoObjectError))
+        self.assertEqual(self.bytes_read(), 200)
+        self.assertEqual(self.rc.read_cache.fresh, 1)
+        self.assertEqual(self.rc.read_cache.misses, 3)
+
+    def test_no_cache(self):
+        self.rc.read_cache = None
+        self.rc.write(self.table, 'k', 'a')
+        self.rc.read_cached(self.table, 'k')
+        self.rc.read_cached(self.table, 'k')
+        self.assertEqual(self.bytes_read(), 2)
+
+class TestIncrement(SimulatedTestCase):
+    def test_native(self):
+        self.assertTrue(ramcloud.has_increment())
+        self.assertEqual(self.rc.increment(self.table, 'c', 5), 5)
+        self.assertEqual(self.rc.increment(self.table, 'c', -2), 3)
+        self.assertEqual(self.rc.read(self.table, 'c')[0],
+                         ramcloud.pack_counter(3))
+        self.assertEqual(self.cluster.rpcs['increment'], 2)
+        self.rc.write(self.table, 'x', 'not a counter')
+        self.assertRaises(ramcloud.RCException, self.rc.increment,
+                          self.table, 'x')
+
+    def test_cas(self):
+        self.assertEqual(self.rc._increment_cas(self.table, 'c', 5), 5)
+        self.assertEqual(self.rc._increment_cas(self.table, 'c', 1), 6)
+        self.assertEqual(self.rc.increment(self.table, 'c', 1), 7)
+        self.rc.write(self.table, 'x', 'not a counter')
+        self.assertRaises(ValueError, self.rc._increment_cas, self.table,
+                          'x', 1)
+
+    def test_cas_contention(self):
+        clients = [ramcloud.RAMCloud() for i in range(4)]
+        def run(rc):
+            for i in range(50):
+                rc._increment_cas(self.table, 'c', 1)
+        threads = []
+        for rc in clients:
+            rc.connect()
+            threads.append(threading.Thread(target=run, args=(rc,)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.rc.increment(self.table, 'c', 0), 200)
+
+    def test_invalidates_read_cache(self):
+        self.rc.read_cache = ramcloud.ReadCache()
+        self.rc.increment(self.table, 'c')
+        self.rc.read_cached(self.table, 'c')
+        self.rc.increment(self.table, 'c')
+        self.assertEqual(len(self.rc.read_cache), 0)
+
+class TestChunked(SimulatedTestCase):
+    def keys(self):
+        return sorted(self.cluster.tables[self.table].keys())
+
+    def test_small(self):
+        v = self.rc.write_chunked(self.table, 'k', 'abc', chunk_size=10)
+        self.assertEqual(self.rc.read(self.table, 'k'), ('abc', v))
+        self.assertEqual(self.rc.read_chunked(self.table, 'k'), ('abc', v))
+
+    def test_large(self):
+        data = ''.join(chr(i % 256) for i in range(95))
+        v = self.rc.write_chunked(self.table, 'k', data, chunk_size=10)
+        self.assertEqual(len(self.keys()), 11)
+        self.assertTrue(all(ramcloud.is_chunk_key(k)
+                            for k in self.keys() if k != 'k'))
+        self.assertEqual(self.rc.read_chunked(self.table, 'k'), (data, v))
+
+    def test_looks_like_manifest(self):
+        data = ramcloud.pack_manifest(1, 2, 3)
+        self.rc.write_chunked(self.table, 'k', data)
+        self.assertEqual(self.rc.read_chunked(self.table, 'k')[0], data)
+
+    def test_overwrite(self):
+        self.rc.write_chunked(self.table, 'k', 'x' * 50, chunk_size=10)
+        self.rc.write_chunked(self.table, 'k', 'y' * 30, chunk_size=10)
+        self.assertEqual(len(self.keys()), 4)
+        self.assertEqual(self.rc.read_chunked(self.table, 'k')[0], 'y' * 30)
+        self.rc.write_chunked(self.table, 'k', 'z', chunk_size=10)
+        self.assertEqual(self.keys(), ['k'])
+
+    def test_delete(self):
+        v = self.rc.write_chunked(self.table, 'k', 'x' * 50, chunk_size=10)
+        self.assertEqual(self.rc.delete_chunked(self.table, 'k'), v)
+        self.assertEqual(self.keys(), [])
+        self.assertRaises(ramcloud.NoObjectError, self.rc.delete_chunked,
+                          self.table, 'k')
+
+    def test_replaced_while_reading(self):
+        self.rc.write_chunked(self.table, 'k', 'x' * 50, chunk_size=10)
+        other = ramcloud.RAMCloud()
+        other.connect()
+        real_multi_read = self.rc.multi_read
+        def multi_read(table_id, keys):
+            self.rc.multi_read = real_multi_read
+            other.write_chunked(self.table, 'k', 'y' * 50, chunk_size=10)
+            return real_multi_read(table_id, keys)
+        self.rc.multi_read = multi_read
+        self.assertEqual(self.rc.read_chunked(self.table, 'k')[0], 'y' * 50)
+
+    def test_replaced_while_writing(self):
+        self.rc.write_chunked(self.table, 'k', 'x' * 50, chunk_size=10)
+        other = ramcloud.RAMCloud()
+        other.connect()
+        real_multi_write = self.rc.multi_write
+        def multi_write(table_id, requests):
+            self.rc.multi_write = real_multi_write
+            other.write_chunked(self.table, 'k', 'y' * 50, chunk_size=10)
+            return real_multi_write(table_id, requests)
+        self.rc.multi_write = multi_write
+        self.rc.write_chunked(self.table, 'k', 'z' * 50, chunk_size=10)
+        self.assertEqual(self.rc.read_chunked(self.table, 'k')[0], 'z' * 50)
+        self.assertEqual(len(self.keys()), 6)
+
+def lport_json(i):
+    return ('{"name": "port-%d", "lswitch": "neutron-8c46938d-4201-4223-abb1",'
+            ' "macs": ["fa:16:3e:e2:16:%02x"], "ips": ["10.0.0.%d"],'
+            ' "chassis": "compute-%d", "tunnel_key": %d}' %
+            (i, i % 256, i % 256, i % 8, i))
+
+class TestZlibValueCodec(unittest.TestCase):
+    def test_small(self):
+        codec = ramcloud.ZlibValueCodec(threshold=100)
+        self.assertEqual(codec.encode('{"a": 1}'), '{"a": 1}')
+        self.assertEqual(codec.decode('{"a": 1}'), '{"a": 1}')
+
+    def test_large(self):
+        codec = ramcloud.ZlibValueCodec(threshold=100)
+        data = lport_json(1) * 10
+        blob = codec.encode(data)
+        self.assertEqual(blob[0], ramcloud.VALUE_ZLIB)
+        self.assertTrue(len(blob) < len(data) / 4)
+        self.assertEqual(codec.decode(blob), data)
+
+    def test_incompressible(self):
+        codec = ramcloud.ZlibValueCodec(threshold=10)
+        data = ''.join(chr(i) for i in range(97, 123))
+        self.assertEqual(codec.encode(data), data)
+
+    def test_tag_collision(self):
+        codec = ramcloud.ZlibValueCodec()
+        for data in ['\x00', '\x01abc', '\x02' * 5]:
+            blob = codec.encode(data)
+            self.assertEqual(blob, ramcloud.VALUE_RAW + data)
+            self.assertEqual(codec.decode(blob), data)
+        self.assertEqual(codec.decode(''), '')
+        self.assertEqual(codec.encode(''), '')
+
+    def test_dictionary(self):
+        dictionary = ramcloud.train_dictionary(lport_json(i)
+                                               for i in range(100))
+        self.assertTrue(0 < len(dictionary) <= 16 * 1024)
+        plain = ramcloud.ZlibValueCodec(threshold=0)
+        codec = ramcloud.ZlibValueCodec(threshold=0, dictionary=dictionary)
+        data = lport_json(1000)
+        blob = codec.encode(data)
+        self.assertEqual(blob[0], ramcloud.VALUE_ZLIB_DICT)
+        self.assertTrue(len(blob) < len(plain.encode(data)) / 2)
+        self.assertEqual(codec.decode(blob), data)
+        # encoding doesn't disturb the primed streams
+        self.assertEqual(codec.decode(codec.encode(data)), data)
+        other = ramcloud.ZlibValueCodec(dictionary='something else')
+        self.assertRaises(ValueError, other.decode, blob)
+        self.assertRaises(ValueError, plain.decode, blob)
+
+class TestValueCodec(SimulatedTestCase):
+    def setUp(self):
+        SimulatedTestCase.setUp(self)
+        self.codec = ramcloud.ZlibValueCodec(threshold=100)
+        self.data = lport_json(1) * 10
+
+    def stored(self, key):
+        return self.cluster.tables[self.table][key][0]
+
+    def test_read_write(self):
+        self.rc.set_value_codec(self.codec)
+        v = self.rc.write(self.table, 'k', self.data)
+        self.assertTrue(len(self.stored('k')) < len(self.data) / 4)
+        self.assertEqual(self.rc.read(self.table, 'k'), (self.data, v))
+        view, version = self.rc.read_rr_view(self.table, 'k',
+                                             ramcloud.RejectRules())
+        self.assertEqual(view.tobytes(), self.data)
+        self.assertEqual(self.rc.stats()['write']['bytes_out'],
+                         len(self.stored('k')))
+
+    def test_per_table(self):
+        self.rc.create_table('u')
+        other = self.rc.get_table_id('u')
+        self.rc.set_value_codec(self.codec, self.table)
+        self.rc.write(self.table, 'k', self.data)
+        self.rc.write(other, 'k', self.data)
+        self.assertNotEqual(self.stored('k'), self.data)
+        self.assertEqual(self.cluster.tables[other]['k'][0], self.data)
+        self.rc.set_value_codec(self.codec)
+        self.rc.set_value_codec(None, other)
+        self.rc.write(other, 'k', self.data)
+        self.assertEqual(self.cluster.tables[other]['k'][0], self.data)
+
+    def test_mixed(self):
+        self.rc.write(self.table, 'old', self.data)
+        self.rc.set_value_codec(self.codec)
+        self.rc.write(self.table, 'new', self.data)
+        self.rc.write(self.table, 'small', 'x')
+        self.assertEqual(sorted(self.rc.iter_table(self.table)),
+                         [('new', self.data), ('old', self.data),
+                          ('small', 'x')])
+        self.assertEqual([r[0] for r in self.rc.multi_read(self.table,
+                                                           ['old', 'new'])],
+                         [self.data, self.data])
+
+    def test_multi_write(self):
+        self.rc.set_value_codec(self.codec)
+        rr = ramcloud.RejectRules()
+        self.rc.multi_write(self.table, [('a', self.data, rr),
+                                         ('b', '\x01', rr)])
+        self.assertEqual(self.rc.read(self.table, 'a')[0], self.data)
+        self.assertEqual(self.stored('b'), '\x00\x01')
+        self.assertEqual(self.rc.read(self.table, 'b')[0], '\x01')
+
+    def test_read_cached(self):
+        self.rc.set_value_codec(self.codec)
+        self.rc.read_cache = ramcloud.ReadCache()
+        v = self.rc.write(self.table, 'k', self.data)
+        for i in range(2):
+            self.assertEqual(self.rc.read_cached(self.table, 'k'),
+                             (self.data, v))
+        self.assertEqual(self.rc.read_cache.fresh, 1)
+
+    def test_chunked(self):
+        self.rc.set_value_codec(self.codec)
+        v = self.rc.write_chunked(self.table, 'k', self.data, chunk_size=100)
+        self.assertEqual(self.rc.read_chunked(self.table, 'k'),
+                         (self.data, v))
+
+    def test_pool(self):
+        pool = ramcloud.RAMCloudPool(value_codec=self.codec)
+        with pool.client() as rc:
+            rc.write(self.table, 'k', self.data)
+            rc.set_value_codec(None, self.table)
+        with pool.client() as rc:
+            self.assertEqual(rc.read(self.table, 'k')[0], self.stored('k'))
+
+class TestBufferWrites(SimulatedTestCase):
+    def test_data_arg(self):
+        data = bytearray('abcdef')
+        arg, length = ramcloud.data_arg(data)
+        self.assertEqual(length, 6)
+        # no copy: the argument is the bytearray's own memory
+        data[0] = 'z'
+        self.assertEqual(arg.raw, 'zbcdef')
+        arg, length = ramcloud.data_arg(memoryview(data)[2:4])
+        self.assertEqual((arg.raw, length), ('cd', 2))
+        self.assertEqual(ramcloud.data_arg(bytearray()), ('', 0))
+        self.assertRaises(TypeError, ramcloud.data_arg, u'abc')
+        self.assertRaises(TypeError, ramcloud.data_arg, 5)
+
+    def test_write(self):
+        import mmap
+        m = mmap.mmap(-1, 6)
+        m.write('mmap!!')
+        for data in [bytearray('bytes'), buffer('xbufferx', 1, 6),
+                     memoryview('memoryview')[:6], m]:
+            v = self.rc.write(self.table, 'k', data)
+            self.assertEqual(self.rc.read(self.table, 'k'),
+                             (ramcloud.data_str(data), v))
+        self.assertEqual(self.rc.stats()['write']['bytes_out'], 5 + 6 * 3)
+        self.rc.update(self.table, 'k', bytearray('u'))
+        self.assertRaises(ramcloud.ObjectExistsError, self.rc.create,
+                          self.table, 'k', bytearray('c'))
+
+    def test_codec(self):
+        self.rc.set_value_codec(ramcloud.ZlibValueCodec(threshold=10))
+        data = bytearray('abc' * 100)
+        self.rc.write(self.table, 'k', memoryview(data))
+        self.assertEqual(self.rc.read(self.table, 'k')[0], str(data))
+
+    def test_chunked(self):
+        data = bytearray(''.join(chr(i % 256) for i in range(95)))
+        v = self.rc.write_chunked(self.table, 'k', memoryview(data),
+                                  chunk_size=10)
+        self.assertEqual(self.rc.read_chunked(self.table, 'k'),
+                         (str(data), v))
+        self.rc.write_chunked(self.table, 'k', bytearray('small'),
+                              chunk_size=10)
+        self.assertEqual(self.rc.read_chunked(self.table, 'k')[0], 'small')
+
+class TestBatchScheduler(unittest.TestCase):
+    def setUp(self):
+        self.threads = set()
+        def sleep(seconds):
+            self.threads.add(threading.current_thread().name)
+            time.sleep(seconds)
+        self.sim = simramcloud.simulated(simramcloud.Cluster(
+                num_servers=4, latency=0.002, sleep=sleep))
+        self.cluster = self.sim.__enter__()
+        self.cluster.create_table('t')
+        self.table = 1
+        self.pool = ramcloud.RAMCloudPool(size=4)
+        self.scheduler = ramcloud.BatchScheduler(self.pool, workers=3)
+        self.keys = ['k%d' % i for i in range(40)]
+
+    def tearDown(self):
+        self.scheduler.close()
+        self.sim.__exit__(None, None, None)
+
+    def locate(self, keys=None):
+        # runs a batch, which leaves a helper looking up where its keys
+        # are, and waits for that to finish
+        if keys is None:
+            keys = self.keys
+        self.scheduler.multi_read(self.table, keys)
+        deadline = time.time() + 5
+        while len(self.scheduler.locations) < len(keys):
+            self.assert_(time.time() < deadline)
+            time.sleep(0.001)
+
+    def test_ops(self):
+        rr = ramcloud.RejectRules()
+        versions = self.scheduler.multi_write(
+                self.table, [(key, 'v' + key, rr) for key in self.keys])
+        results = self.scheduler.multi_read(self.table, self.keys + ['x'])
+        self.assertEqual(results[:-1], [('v' + key, version) for (key, version)
+                                        in zip(self.keys, versions)])
+        self.assertTrue(isinstance(results[-1], ramcloud.NoObjectError))
+        removed = self.scheduler.multi_remove(
+                self.table, [(key, rr) for key in self.keys])
+        self.assertEqual(removed, versions)
+        self.assertEqual(self.cluster.tables[self.table], {})
+
+    def test_concurrent(self):
+        self.locate()
+        self.threads.clear()
+        self.scheduler.multi_read(self.table, self.keys)
+        self.assertTrue(len(self.threads) > 1)
+
+    def test_unknown_keys_not_looked_up_first(self):
+        located = threading.Event()
+        release = threading.Event()
+        def locate(client, table_id, key):
+            located.set()
+            release.wait(5)
+            return client.testing_get_server_id(table_id, key)
+        self.scheduler.locate = locate
+        try:
+            results = self.scheduler.multi_read(self.table, self.keys)
+            # the batch finished while the lookups were held up
+            self.assertEqual(len(results), len(self.keys))
+            self.assert_(located.wait(5))
+            self.assertEqual(len(self.scheduler.locations), 0)
+        finally:
+            release.set()
+        self.locate()
+
+    def test_locate_unsupported(self):
+        def locate(client, table_id, key):
+            raise AttributeError('rc_testing_get_server_id')
+        self.scheduler.locate = locate
+        self.scheduler.multi_read(self.table, self.keys)
+        deadline = time.time() + 5
+        while self.scheduler.locate is not None:
+            self.assert_(time.time() < deadline)
+            time.sleep(0.001)
+        results = self.scheduler.multi_read(self.table, self.keys)
+        self.assertEqual(len(results), len(self.keys))
+        self.assertEqual(len(self.scheduler.locations), 0)
+
+    def test_forget(self):
+        with self.pool.client() as rc:
+            rc.write(self.table, 'k', 'v')
+        self.locate(['k', 'l'])
+        self.assertEqual(len(self.scheduler.locations), 2)
+        self.cluster.inject_fault(17, op='read', count=1)
+        result = self.scheduler.multi_read(self.table, ['k'])[0]
+        self.assertEqual(result.status, 17)
+        self.assertEqual(len(self.scheduler.locations), 1)
+        self.assertEqual(self.scheduler.locations.get((self.table, 'k')),
+                         None)
+
+    def test_share_raises(self):
+        self.locate()
+        def multi_read(client, share):
+            if 'k0' in share:
+                raise ramcloud.RCException(17)
+            return client.multi_read(self.table, share)
+        self.assertRaises(ramcloud.RCException, self.scheduler._run,
+                          self.table, self.keys, lambda key: key, multi_read)
+        same_server = [key for key in self.keys
+                       if (self.cluster.server_id(self.table, key) ==
+                           self.cluster.server_id(self.table, 'k0'))]
+        for key in same_server:
+            self.assertEqual(self.scheduler.locations.get((self.table, key)),
+                             None)
+        self.assertTrue(len(self.scheduler.locations) > 0)
+
+    def test_lazy_helpers(self):
+        self.assertEqual(self.scheduler._threads, [])
+        self.scheduler.multi_read(self.table, self.keys)
+        self.assertEqual(len(self.scheduler._threads), 3)
+
+    def test_fork(self):
+        self.locate()
+        pid = os.fork()
+        if pid == 0:
+            # the parent's helpers aren't running in here
+            status = 1
+            try:
+                signal.alarm(10)
+                self.threads.clear()
+                self.scheduler.multi_read(self.table, self.keys)
+                if len(self.threads) > 1:
+                    status = 0
+            finally:
+                os._exit(status)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    def test_closed(self):
+        self.locate()
+        self.scheduler.close()
+        self.threads.clear()
+        results = self.scheduler.multi_read(self.table, self.keys)
+        self.assertEqual(len(results), len(self.keys))
+        self.assertEqual(len(self.threads), 1)
+
+    def test_caller_holds_last_client(self):
+        pool = ramcloud.RAMCloudPool(size=1)
+        scheduler = ramcloud.BatchScheduler(pool)
+        try:
+            with pool.client():
+                results = scheduler.multi_read(self.table, self.keys)
+            self.assertEqual(len(results), len(self.keys))
+        finally:
+            scheduler.close()
+
+if __name__ == '__main__':
+    unittest.main()
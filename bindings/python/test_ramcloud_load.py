@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Unit tests for C{ramcloud_load.py}.
+
+These load files into the simulated cluster.
+
+@see: L{ramcloud_load}
+
+"""
+
+from __future__ import with_statement
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import ramcloud
+import ramcloud_load
+import simramcloud
+
+class TestRecords(unittest.TestCase):
+    def test_binary(self):
+        data = (ramcloud_load.pack_record('a', '1') +
+                ramcloud_load.pack_record('bb', '') +
+                ramcloud_load.pack_record('c', 'x' * 100))
+        records = [(k, str(v), end)
+                   for (k, v, end) in ramcloud_load.binary_records(data)]
+        self.assertEqual(records, [('a', '1', 10), ('bb', '', 20),
+                                   ('c', 'x' * 100, len(data))])
+        self.assertEqual([r[0] for r in
+                          ramcloud_load.binary_records(data, 10)],
+                         ['bb', 'c'])
+        self.assertRaises(ValueError, list,
+                          ramcloud_load.binary_records(data[:-1]))
+
+    def test_json(self):
+        data = ('{"key": "a", "value": "1"}\n'
+                '\n'
+                '{"key": 2, "value": {"x": [1]}}\n'
+                '{"key": "c", "value": "\\u00e9"}')
+        records = list(ramcloud_load.json_records(data))
+        self.assertEqual([r[:2] for r in records],
+                         [('a', '1'), ('2', '{"x": [1]}'), ('c', '\xc3\xa9')])
+        self.assertEqual(records[-1][2], len(data))
+        self.assertEqual([r[0] for r in
+                          ramcloud_load.json_records(data, records[0][2])],
+                         ['2', 'c'])
+        self.assertRaises(ValueError, list,
+                          ramcloud_load.json_records('{"key": "a"}\n'))
+
+    def test_key_field(self):
+        line = '{"name": "port1", "lswitch": "net1"}'
+        self.assertEqual(list(ramcloud_load.json_records(line + '\n',
+                                                          key_field='name')),
+                         [('port1', line, len(line) + 1)])
+
+class TestLoad(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.sim = simramcloud.simulated(simramcloud.Cluster(num_servers=2))
+        self.cluster = self.sim.__enter__()
+        self.cluster.create_table('t')
+        self.table = 1
+
+    def tearDown(self):
+        self.sim.__exit__(None, None, None)
+        shutil.rmtree(self.dir)
+
+    def write_file(self, records):
+        path = os.path.join(self.dir, 'records')
+        with open(path, 'wb') as f:
+            for (key, value) in records:
+                f.write(ramcloud_load.pack_record(key, value))
+        return path
+
+    def stored(self):
+        return dict((k, v[0])
+                    for (k, v) in self.cluster.tables[self.table].items())
+
+    def test_main(self):
+        records = [('k%d' % i, 'v%d' % i) for i in range(100)]
+        path = self.write_file(records)
+        self.assertEqual(ramcloud_load.main(['-q', '-t', 't', '-f', 'binary',
+                                             '-b', '7', '-p', '0', path]), 0)
+        self.assertEqual(self.stored(), dict(records))
+        self.assertFalse(os.path.exists(path + '.ckpt'))
+
+    def test_main_json(self):
+        path = os.path.join(self.dir, 'lports')
+        lports = [{'name': 'port%d' % i, 'lswitch': 'net'} for i in range(10)]
+        with open(path, 'w') as f:
+            for lport in lports:
+                f.write(json.dumps(lport) + '\n')
+        self.assertEqual(ramcloud_load.main(['-q', '-t', 'u', '--create',
+                                             '-k', 'name', '-z', path]), 0)
+        rc = ramcloud.RAMCloud()
+        rc.connect()
+        rc.set_value_codec(ramcloud.ZlibValueCodec())
+        table = rc.get_table_id('u')
+        self.assertEqual(json.loads(rc.read(table, 'port3')[0]), lports[3])
+
+    def test_empty(self):
+        path = self.write_file([])
+        self.assertEqual(ramcloud_load.main(['-q', '-t', 't', '-f', 'binary',
+                                             path]), 0)
+        self.assertEqual(self.stored(), {})
+
+    def test_resume(self):
+        records = [('k%d' % i, 'v%d' % i) for i in range(100)]
+        path = self.write_file(records)
+        argv = ['-q', '-t', 't', '-f', 'binary', '-b', '10', '-c', '1', path]
+        # the 51st write fails, in the 6th batch
+        real_write = self.cluster.write
+        writes = []
+        def write(table_id, key, data, reject_rules):
+            writes.append(key)
+            if len(writes) == 51:
+                return (17, 0)
+            return real_write(table_id, key, data, reject_rules)
+        self.cluster.write = write
+        self.assertEqual(ramcloud_load.main(argv), 1)
+        with open(path + '.ckpt') as f:
+            state = json.load(f)
+        self.assertEqual(state['records'], 50)
+        self.assertFalse('k50' in self.stored())
+        del writes[:]
+        self.assertEqual(ramcloud_load.main(['--resume'] + argv), 0)
+        self.assertEqual(self.stored(), dict(records))
+        self.assertEqual(writes, [key for (key, value) in records[50:]])
+        self.assertFalse(os.path.exists(path + '.ckpt'))
+
+    def test_checkpoint_mismatch(self):
+        path = self.write_file([('a', 'b')])
+        ckpt = ramcloud_load.Checkpoint(path + '.ckpt', path)
+        ckpt.write(5, 1)
+        with open(path, 'ab') as f:
+            f.write(ramcloud_load.pack_record('c', 'd'))
+        ckpt = ramcloud_load.Checkpoint(path + '.ckpt', path)
+        self.assertRaises(ValueError, ckpt.read)
+
+if __name__ == '__main__':
+    unittest.main()
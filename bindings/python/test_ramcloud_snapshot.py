@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Unit tests for C{ramcloud_snapshot.py}.
+
+These export and import tables of the simulated cluster.
+
+@see: L{ramcloud_snapshot}
+
+"""
+
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import ramcloud
+import ramcloud_snapshot
+import simramcloud
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'snapshot')
+        self.sim = simramcloud.simulated(simramcloud.Cluster(num_servers=2))
+        self.cluster = self.sim.__enter__()
+        self.rc = ramcloud.RAMCloud()
+        self.rc.connect()
+        self.rc.create_table('src')
+        self.src = self.rc.get_table_id('src')
+        self.objects = dict(('k%d' % i, chr(i) * i) for i in range(200))
+        for (key, value) in self.objects.items():
+            self.rc.write(self.src, key, value)
+
+    def tearDown(self):
+        del self.rc
+        self.sim.__exit__(None, None, None)
+        shutil.rmtree(self.dir)
+
+    def table(self, table_id):
+        return dict((k, v[0])
+                    for (k, v) in self.cluster.tables[table_id].items())
+
+    def export(self, compress):
+        with open(self.path, 'wb') as f:
+            count = ramcloud_snapshot.export_table(self.rc, self.src, f,
+                                                   compress, block_size=1000)
+        self.assertEqual(count, 200)
+        return ramcloud_snapshot.Snapshot.open(self.path)
+
+    def test_round_trip(self):
+        for compress in [False, True]:
+            snapshot = self.export(compress)
+            self.assertEqual(snapshot.records, 200)
+            self.assertTrue(len(snapshot.index) > 10)
+            self.assertEqual(sum(entry[3] for entry in snapshot.index), 200)
+            self.assertEqual(dict((k, str(v)) for (k, v) in snapshot),
+                             self.objects)
+            self.rc.create_table('dst')
+            dst = self.rc.get_table_id('dst')
+            pool = ramcloud.RAMCloudPool()
+            self.assertEqual(ramcloud_snapshot.import_snapshot(
+                                 pool, dst, snapshot, batch=16), 200)
+            self.assertEqual(self.table(dst), self.objects)
+            self.rc.drop_table('dst')
+
+    def test_compressed_size(self):
+        self.export(False)
+        plain = os.path.getsize(self.path)
+        self.export(True)
+        compressed = os.path.getsize(self.path)
+        self.assertTrue(compressed < plain / 4)
+
+    def test_block(self):
+        snapshot = self.export(True)
+        offset, stored, length, records = snapshot.index[0]
+        self.assertEqual(len(snapshot.block(0)), length)
+
+    def test_bad(self):
+        self.assertRaises(ValueError, ramcloud_snapshot.Snapshot, 'short')
+        self.assertRaises(ValueError, ramcloud_snapshot.Snapshot,
+                          'x' * ramcloud_snapshot.HEADER.size)
+        self.export(False)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertRaises(ValueError, ramcloud_snapshot.Snapshot,
+                          data[:-1])
+
+    def test_empty(self):
+        self.rc.create_table('empty')
+        with open(self.path, 'wb') as f:
+            ramcloud_snapshot.export_table(self.rc,
+                                           self.rc.get_table_id('empty'), f)
+        snapshot = ramcloud_snapshot.Snapshot.open(self.path)
+        self.assertEqual((snapshot.records, snapshot.index), (0, []))
+        self.assertEqual(list(snapshot), [])
+
+    def test_main(self):
+        self.assertEqual(ramcloud_snapshot.main(['export', '-q', '-z',
+                                                 '-t', 'src', self.path]), 0)
+        self.assertEqual(ramcloud_snapshot.main(['import', '-q', '--create',
+                                                 '-t', 'dst', self.path]), 0)
+        self.assertEqual(self.table(self.rc.get_table_id('dst')),
+                         self.objects)
+
+if __name__ == '__main__':
+    unittest.main()
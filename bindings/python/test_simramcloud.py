@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010 Stanford University
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR(S) DISCLAIM ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL AUTHORS BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Unit tests for C{simramcloud.py}.
+
+These run the real L{ramcloud} and L{txramcloud} clients against the
+simulated cluster.
+
+@see: L{simramcloud}
+
+"""
+
+from __future__ import with_statement
+
+import threading
+import time
+import unittest
+
+import ramcloud
+import simramcloud
+import txramcloud
+
+class SimTestCase(unittest.TestCase):
+    def cluster(self):
+        return simramcloud.Cluster()
+
+    def setUp(self):
+        self.delays = []
+        self.sim = simramcloud.simulated(self.cluster())
+        self.sim_cluster = self.sim.__enter__()
+        self.rc = ramcloud.RAMCloud()
+        self.rc.connect()
+        self.rc.create_table('t')
+        self.table = self.rc.get_table_id('t')
+
+    def tearDown(self):
+        del self.rc
+        self.sim.__exit__(None, None, None)
+
+class TestObjects(SimTestCase):
+    def test_read_write(self):
+        v1 = self.rc.write(self.table, 'k', 'a')
+        self.assertEqual(self.rc.read(self.table, 'k'), ('a', v1))
+        v2 = self.rc.write(self.table, 'k', 'b' * 3000)
+        self.assertEqual(v2, v1 + 1)
+        self.assertEqual(self.rc.read(self.table, 'k'), ('b' * 3000, v2))
+
+    def test_missing(self):
+        self.assertRaises(ramcloud.NoObjectError, self.rc.read, self.table,
+                          'k')
+        self.assertRaises(ramcloud.NoObjectError, self.rc.delete, self.table,
+                          'k')
+
+    def test_versions_survive_delete(self):
+        v1 = self.rc.write(self.table, 'k', 'a')
+        self.rc.write(self.table, 'other', 'a')
+        self.assertEqual(self.rc.delete(self.table, 'k'), v1)
+        v2 = self.rc.create(self.table, 'k', 'b')
+        self.assertTrue(v2 > v1 + 1)
+
+    def test_reject_rules(self):
+        self.rc.create(self.table, 'k', 'a')
+        self.rc.delete(self.table, 'k')
+        v = self.rc.create(self.table, 'k', 'a')
+        self.assertRaises(ramcloud.ObjectExistsError, self.rc.create,
+                          self.table, 'k', 'b')
+        try:
+            self.rc.update(self.table, 'k', 'b', want_version=v - 1)
+        except ramcloud.VersionError, e:
+            self.assertEqual(e.got_version, v)
+        else:
+            self.fail()
+        rr = ramcloud.RejectRules(version_eq_given=True, given_version=v)
+        self.assertRaises(ramcloud.VersionError, self.rc.read_rr, self.table,
+                          'k', rr)
+        self.assertRaises(ramcloud.NoObjectError, self.rc.update, self.table,
+                          'missing', 'b')
+        self.assertEqual(self.rc.read(self.table, 'k'), ('a', v))
+
+    def test_tables(self):
+        self.rc.create_table('t')
+        self.assertEqual(self.rc.get_table_id('t'), self.table)
+        self.rc.drop_table('t')
+        self.assertRaises(ramcloud.TableDoesntExistError,
+                          self.rc.get_table_id, 't')
+        self.assertRaises(ramcloud.TableDoesntExistError, self.rc.write,
+                          self.table, 'k', 'a')
+
+    def test_enumerate(self):
+        for i in range(5):
+            self.rc.write(self.table, 'k%d' % i, 'v%d' % i)
+        self.assertEqual(sorted(self.rc.iter_table(self.table, batch=2)),
+                         [('k%d' % i, 'v%d' % i) for i in range(5)])
+        self.assertEqual(sorted(self.rc.iter_keys(self.table)),
+                         ['k%d' % i for i in range(5)])
+
+    def test_multi_ops(self):
+        rr = ramcloud.RejectRules()
+        self.rc.multi_write(self.table, [('a', '1', rr), ('b', '2', rr)])
+        results = self.rc.multi_read(self.table, ['a', 'b', 'c'])
+        self.assertEqual([r[0] for r in results[:2]], ['1', '2'])
+        self.assertTrue(isinstance(results[2], ramcloud.NoObjectError))
+
+    def test_server_id(self):
+        self.assertEqual(self.rc.testing_get_server_id(self.table, 'k'), 0)
+        self.assertEqual(self.rc.testing_get_service_locator(self.table, 'k'),
+                         'sim:server=0')
+
+class TestFaults(SimTestCase):
+    def test_count(self):
+        self.sim_cluster.inject_fault(17, op='read', count=2)
+        self.rc.write(self.table, 'k', 'a')
+        for i in range(2):
+            try:
+                self.rc.read(self.table, 'k')
+            except ramcloud.RCException, e:
+                self.assertEqual(e.status, 17)
+            else:
+                self.fail()
+        self.assertEqual(self.rc.read(self.table, 'k')[0], 'a')
+
+    def test_probability(self):
+        self.sim_cluster.inject_fault(17, op='write', probability=0.5)
+        failures = 0
+        for i in range(200):
+            try:
+                self.rc.write(self.table, 'k', 'a')
+            except ramcloud.RCException:
+                failures += 1
+        self.assertTrue(50 < failures < 150)
+        self.sim_cluster.clear_faults()
+        self.rc.write(self.table, 'k', 'a')
+
+class TestDelays(SimTestCase):
+    def cluster(self):
+        return simramcloud.Cluster(latency=0.001, op_latency={'read': 0.002},
+                                   bandwidth=1000, sleep=self.delays.append)
+
+    def test_delays(self):
+        del self.delays[:]
+        self.rc.write(self.table, 'k', 'x' * 500)
+        self.rc.read(self.table, 'k')
+        self.assertEqual(self.delays, [0.001 + 0.5, 0.002 + 0.5])
+        self.assertEqual(self.sim_cluster.rpcs['read'], 1)
+
+    def test_distributions(self):
+        import random
+        rng = random.Random(1)
+        for d in [simramcloud.uniform(1, 2), simramcloud.exponential(1),
+                  simramcloud.lognormal(1, 1)]:
+            self.assertTrue(d(rng) > 0)
+
+class TestContention(unittest.TestCase):
+    def test_server_threads(self):
+        # with one RPC at a time, the second write waits out the first's delay
+        sleeping = threading.Event()
+        release = threading.Event()
+        def sleep(seconds):
+            sleeping.set()
+            release.wait()
+        cluster = simramcloud.Cluster(server_threads=1, latency=1, sleep=sleep)
+        cluster.create_table('t')
+        with simramcloud.simulated(cluster):
+            release.set()
+            clients = [ramcloud.RAMCloud() for i in range(2)]
+            for rc in clients:
+                rc.connect()
+            release.clear()
+            sleeping.clear()
+            threads = [threading.Thread(target=rc.write, args=(1, 'k', 'a'))
+                       for rc in clients]
+            for t in threads:
+                t.daemon = True
+                t.start()
+            try:
+                sleeping.wait()
+                time.sleep(0.05)
+                self.assertEqual(cluster.tables[1]['k'][1], 1)
+            finally:
+                release.set()
+            for t in threads:
+                t.join()
+            self.assertEqual(cluster.tables[1]['k'][1], 2)
+
+class TestTxRAMCloud(unittest.TestCase):
+    def test_mt_commit(self):
+        with simramcloud.simulated():
+            rc = ramcloud.RAMCloud()
+            rc.connect()
+            rc.create_table('tx')
+            rc.create_table('data')
+            table = rc.get_table_id('data')
+            txrc = txramcloud.TxRAMCloud(rc.get_table_id('tx'))
+            txrc.connect()
+            v = txrc.create(table, 1, 'a')
+            exactly = ramcloud.RejectRules.exactly(v)
+            mt = txramcloud.MiniTransaction()
+            mt[(table, 1)] = txramcloud.MTWrite('b', exactly)
+            mt[(table, 2)] = txramcloud.MTWrite('c', ramcloud.RejectRules())
+            versions = txrc.mt_commit(mt)
+            self.assertEqual(txrc.read(table, 1), ('b', versions[(table, 1)]))
+            self.assertEqual(txrc.read(table, 2), ('c', versions[(table, 2)]))
+            mt = txramcloud.MiniTransaction()
+            mt[(table, 1)] = txramcloud.MTWrite('d', exactly)
+            self.assertRaises(txrc.TransactionRejected, txrc.mt_commit, mt)
+            self.assertEqual(txrc.read(table, 1)[0], 'b')
+
+    def test_mt_commit_reads(self):
+        # masking reads each object once; the intent's masked versions let
+        # the writes be applied without reading them again
+        cluster = simramcloud.Cluster(num_servers=2)
+        with simramcloud.simulated(cluster):
+            rc = ramcloud.RAMCloud()
+            rc.connect()
+            rc.create_table('tx')
+            rc.create_table('data')
+            table = rc.get_table_id('data')
+            txrc = txramcloud.TxRAMCloud(rc.get_table_id('tx'))
+            txrc.connect()
+            mt = txramcloud.MiniTransaction()
+            for key in range(10):
+                mt[(table, key)] = txramcloud.MTWrite(str(key),
+                                                      ramcloud.RejectRules())
+            # the first transaction ID reservation reads its object
+            txrc.txid_res.next()
+            reads = cluster.rpcs.get('read', 0)
+            versions = txrc.mt_commit(mt)
+            self.assertEqual(cluster.rpcs['read'] - reads, 10)
+            for key in range(10):
+                self.assertEqual(txrc.read(table, key),
+                                 (str(key), versions[(table, key)]))
+
+    def test_mt_commit_one(self):
+        # a minitransaction of one clean object is one read and one
+        # conditional write or remove, without touching the transaction table
+        cluster = simramcloud.Cluster()
+        with simramcloud.simulated(cluster):
+            rc = ramcloud.RAMCloud()
+            rc.connect()
+            rc.create_table('tx')
+            rc.create_table('data')
+            tx_table = rc.get_table_id('tx')
+            table = rc.get_table_id('data')
+            txrc = txramcloud.TxRAMCloud(tx_table)
+            txrc.connect()
+            v = txrc.create(table, 1, 'a')
+
+            def commit(op):
+                mt = txramcloud.MiniTransaction()
+                mt[(table, 1)] = op
+                rpcs = dict(cluster.rpcs)
+                versions = txrc.mt_commit(mt)
+                used = dict((name, n - rpcs.get(name, 0))
+                            for (name, n) in cluster.rpcs.items()
+                            if n != rpcs.get(name, 0))
+                return (versions[(table, 1)], used)
+
+            exactly = ramcloud.RejectRules.exactly
+            self.assertEqual(commit(txramcloud.MTOperation(exactly(v))),
+                             (v, {'read': 1}))
+            self.assertEqual(commit(txramcloud.MTWrite('b', exactly(v))),
+                             (v + 1, {'read': 1, 'write': 1}))
+            self.assertEqual(txrc.read(table, 1), ('b', v + 1))
+            self.assertRaises(txrc.TransactionRejected, commit,
+                              txramcloud.MTWrite('c', exactly(v)))
+            self.assertEqual(commit(txramcloud.MTDelete(exactly(v + 1))),
+                             (None, {'read': 1, 'remove': 1}))
+            self.assertEqual(commit(txramcloud.MTDelete(
+                                 ramcloud.RejectRules())),
+                             (None, {'read': 1}))
+            version, used = commit(txramcloud.MTWrite(
+                                'd', ramcloud.RejectRules(object_exists=True)))
+            self.assertEqual(used, {'read': 1, 'write': 1})
+            self.assertEqual(txrc.read(table, 1), ('d', version))
+            self.assertEqual(cluster.tables[tx_table], {})
+
+    def test_mt_commit_one_masked(self):
+        # an object masked by an abandoned transaction is cleaned up by the
+        # full protocol
+        with simramcloud.simulated() as cluster:
+            rc = ramcloud.RAMCloud()
+            rc.connect()
+            rc.create_table('tx')
+            rc.create_table('data')
+            table = rc.get_table_id('data')
+            txrc = txramcloud.TxRAMCloud(rc.get_table_id('tx'))
+            txrc.connect()
+            rc.write(table, 1, txramcloud.pack(12345, time.time() - 1, 'a'))
+            mt = txramcloud.MiniTransaction()
+            mt[(table, 1)] = txramcloud.MTWrite('b', ramcloud.RejectRules())
+            versions = txrc.mt_commit(mt)
+            self.assertEqual(txrc.read(table, 1), ('b', versions[(table, 1)]))
+
+    def test_plain_table(self):
+        cluster = simramcloud.Cluster()
+        with simramcloud.simulated(cluster):
+            rc = ramcloud.RAMCloud()
+            rc.connect()
+            rc.create_table('tx')
+            rc.create_table('plain')
+            table = rc.get_table_id('plain')
+            txrc = txramcloud.TxRAMCloud(rc.get_table_id('tx'))
+            txrc.connect()
+            txrc.set_plain_table(table)
+            rpcs = dict(cluster.rpcs)
+            v = txrc.write(table, 'k', 'a')
+            self.assertEqual(cluster.rpcs['write'] - rpcs.get('write', 0), 1)
+            self.assertEqual(cluster.rpcs.get('read', 0), rpcs.get('read', 0))
+            self.assertEqual(cluster.tables[table]['k'], ('a', v))
+            self.assertEqual(txrc.read(table, 'k'), ('a', v))
+            self.assertEqual(txrc.increment(table, 'n', 3), 3)
+            txrc.delete(table, 'k')
+            self.assertRaises(ramcloud.NoObjectError, txrc.read, table, 'k')
+            mt = txramcloud.MiniTransaction()
+            mt[(table, 'k')] = txramcloud.MTWrite('b', ramcloud.RejectRules())
+            self.assertRaises(ValueError, txrc.mt_commit, mt)
+
+    def setup_faults(self, cluster):
+        rc = ramcloud.RAMCloud()
+        rc.connect()
+        rc.create_table('tx')
+        rc.create_table('data')
+        self.tx_table = rc.get_table_id('tx')
+        self.data = rc.get_table_id('data')
+        txrc = txramcloud.TxRAMCloud(self.tx_table)
+        txrc.connect()
+        for key in ['a', 'b']:
+            txrc.create(self.data, key, 'old-' + key)
+        mt = txramcloud.MiniTransaction()
+        for key in ['a', 'b']:
+            mt[(self.data, key)] = txramcloud.MTWrite('new-' + key,
+                                                      ramcloud.RejectRules())
+        return (txrc, mt)
+
+    def fail_apply(self, cluster, txrc, count):
+        # the first writes to the data table after the intent fail
+        write_mt = txrc._write_mt
+        def mock_write_mt(mt, txid):
+            version = write_mt(mt, txid)
+            cluster.inject_fault(12, op='write', table_id=self.data,
+                                 count=count)
+            return version
+        txrc._write_mt = mock_write_mt
+
+    def test_mt_commit_apply_fault(self):
+        # a failed write in the batched apply is retried on its own
+        cluster = simramcloud.Cluster()
+        with simramcloud.simulated(cluster):
+            txrc, mt = self.setup_faults(cluster)
+            self.fail_apply(cluster, txrc, 1)
+            txrc.mt_commit(mt)
+            cluster.clear_faults()
+            for key in ['a', 'b']:
+                self.assertEqual(txrc.read(self.data, key)[0], 'new-' + key)
+            self.assertEqual(len(cluster.tables[self.tx_table]), 1)
+
+    def test_mt_commit_apply_fault_raises(self):
+        # if the retry fails too, the error is raised and the intent is kept,
+        # so another client finishes the transaction
+        cluster = simramcloud.Cluster()
+        with simramcloud.simulated(cluster):
+            txrc, mt = self.setup_faults(cluster)
+            # both batched writes fail, and so does the first retry
+            self.fail_apply(cluster, txrc, 3)
+            self.assertRaises(ramcloud.RCException, txrc.mt_commit, mt)
+            cluster.clear_faults()
+            self.assertEqual(len(cluster.tables[self.tx_table]), 2)
+            other = txramcloud.TxRAMCloud(self.tx_table)
+            other.connect()
+            for key in ['a', 'b']:
+                self.assertEqual(other.read(self.data, key)[0], 'new-' + key)
+            self.assertEqual(len(cluster.tables[self.tx_table]), 1)
+
+    def test_mt_commit_read_fault(self):
+        cluster = simramcloud.Cluster()
+        with simramcloud.simulated(cluster):
+            txrc, mt = self.setup_faults(cluster)
+            txrc.txid_res.next()
+            cluster.inject_fault(12, op='read', table_id=self.data, count=1)
+            try:
+                txrc.mt_commit(mt)
+            except ramcloud.RCException, e:
+                self.assertEqual(e.status, 12)
+            else:
+                self.fail()
+            for key in ['a', 'b']:
+                self.assertEqual(txrc.read(self.data, key)[0], 'old-' + key)
+
+    def test_mt_commit_concurrent(self):
+        # overlapping transactions from several clients mask in batches and
+        # fall back to masking in order, so they all commit
+        cluster = simramcloud.Cluster(num_servers=3)
+        with simramcloud.simulated(cluster):
+            rc = ramcloud.RAMCloud()
+            rc.connect()
+            rc.create_table('tx')
+            rc.create_table('data')
+            tx_table = rc.get_table_id('tx')
+            table = rc.get_table_id('data')
+            errors = []
+            def run(n):
+                try:
+                    txrc = txramcloud.TxRAMCloud(tx_table)
+                    txrc.connect()
+                    for i in range(10):
+                        mt = txramcloud.MiniTransaction()
+                        for key in range(n, n + 10):
+                            mt[(table, key)] = txramcloud.MTWrite(
+                                    '%d.%d' % (n, i), ramcloud.RejectRules())
+                        txrc.mt_commit(mt)
+                except Exception, e:
+                    errors.append(e)
+            threads = [threading.Thread(target=run, args=(n,))
+                       for n in range(0, 20, 5)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(errors, [])
+            for (key, (blob, version)) in cluster.tables[table].items():
+                self.assertEqual(txramcloud.unpack(blob)[0], 0)
+            self.assertEqual(txramcloud.unpack(cluster.tables[table]['24'][0]),
+                             (0, 0, '15.9'))
+            # only the transaction ID reservation is left
+            self.assertEqual(len(cluster.tables[tx_table]), 1)
+
+if __name__ == '__main__':
+    unittest.main()
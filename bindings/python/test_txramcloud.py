@@ -72,6 +72,12 @@ class TestPackUnpack(unittest.TestCase):
                                          99, 0, 0, 0)
         self.assertRaises(TxRAMCloud.OutdatedClient, txramcloud.unpack, blob)
 
+    def test_version_1(self):
+        """Test unpack with a header written by version 1."""
+        blob = txramcloud.HeaderFmt.pack(txramcloud.TXRAMCLOUD_HEADER,
+                                         1, 0, 0, 0) + 'foo'
+        self.assertEqual(txramcloud.unpack(blob), (0, 0, 'foo'))
+
 class Opaques(object):
     table = Opaque()
     data = Opaque()
@@ -90,6 +96,45 @@ class Opaques(object):
 MUST_EXIST = ramcloud.RejectRules(object_doesnt_exist=True)
 now = time.time()
 
+class MockMultiRAMCloud(object):
+    """Mock L{ramcloud.RAMCloud} with just the multi-ops, over a dict.
+
+    @ivar objects: a mapping from (table_id, key) to (blob, version)
+    @ivar calls: the (op, table_id, requests) of each multi-op call
+    @ivar fail: the (table_id, key) pairs whose next write or remove returns
+                a L{ramcloud.VersionError}
+    """
+
+    def __init__(self, objects):
+        self.objects = dict(objects)
+        self.calls = []
+        self.fail = set()
+
+    def multi_read_rr(self, txrc, table_id, requests):
+        self.calls.append(('read', table_id, requests))
+        return [self.objects.get((table_id, key), ramcloud.NoObjectError())
+                for (key, rr) in requests]
+
+    def _change(self, table_id, key, blob):
+        if (table_id, key) in self.fail:
+            self.fail.remove((table_id, key))
+            return ramcloud.VersionError(0, 0)
+        if blob is None:
+            del self.objects[(table_id, key)]
+            return 0
+        version = self.objects.get((table_id, key), (None, 0))[1] + 1
+        self.objects[(table_id, key)] = (blob, version)
+        return version
+
+    def multi_write(self, txrc, table_id, requests):
+        self.calls.append(('write', table_id, requests))
+        return [self._change(table_id, key, blob)
+                for (key, blob, rr) in requests]
+
+    def multi_remove(self, txrc, table_id, requests):
+        self.calls.append(('remove', table_id, requests))
+        return [self._change(table_id, key, None) for (key, rr) in requests]
+
 def txrc_setup(tc, rc=None, retries=None):
     """Set up a L{txramcloud.TxRAMCloud} instance for testing.
 
@@ -154,6 +199,53 @@ class TestTxRAMCloud(unittest.TestCase):
                 r = txrc.insert(Opaques.table, Opaques.datas)
                 self.assertEqual(r, Opaques.oid)
 
+    def test_increment(self):
+        with Counter(self, 1) as counter:
+            class MockRAMCloud(object):
+                def increment(mockrc, txrc, table_id, key, delta):
+                    counter.bump()
+                    self.assertEqual(table_id, Opaques.table)
+                    return 5
+            with txrc_setup(self, rc=MockRAMCloud()) as txrc:
+                txrc.tx_table = Opaques.table
+                self.assertEqual(txrc.increment(Opaques.table, 'c', 5), 5)
+                self.assertRaises(ValueError, txrc.increment,
+                                  Opaque(), 'c', 5)
+
+    def test_plain_table(self):
+        log = []
+        class MockRAMCloud(object):
+            def __getattr__(mockrc, name):
+                def op(txrc, *args):
+                    log.append((name,) + args)
+                    return Opaques.version
+                return op
+        rr = ramcloud.RejectRules()
+        table = 5
+        with txrc_setup(self, rc=MockRAMCloud()) as txrc:
+            txrc.set_plain_table(table)
+            txrc.insert(table, 'a')
+            txrc.increment(table, 'c', 5)
+            txrc.read_rr(table, 'k', rr)
+            txrc.multi_read_rr(table, [('k', rr)])
+            txrc.write_rr(table, 'k', 'b', rr)
+            txrc.multi_write(table, [('k', 'b', rr)])
+            txrc.delete_rr(table, 'k', rr)
+            txrc.multi_remove(table, [('k', rr)])
+            # blind operations don't read first, and data isn't packed
+            self.assertEqual(log,
+                    [('insert', table, 'a'),
+                     ('increment', table, 'c', 5),
+                     ('read_rr', table, 'k', rr),
+                     ('multi_read_rr', table, [('k', rr)]),
+                     ('write_rr', table, 'k', 'b', rr),
+                     ('multi_write', table, [('k', 'b', rr)]),
+                     ('delete_rr', table, 'k', rr),
+                     ('multi_remove', table, [('k', rr)])])
+            txrc.set_plain_table(table, False)
+            self.assertRaises(ValueError, txrc.increment,
+                              table, 'c', 5)
+
     """Testing strategy for _write_tombstone:
     - test_write_tombstone_noobject tests the normal case of no object existing
     at txid and checks arguments to RAMCloud.write_rr.
@@ -203,6 +295,7 @@ class TestTxRAMCloud(unittest.TestCase):
     def test_clean(self):
         tx_table_id = 2340
         my_mt = txramcloud.MiniTransaction()
+        my_mt[(1, 2)] = txramcloud.MTDelete(ramcloud.RejectRules())
         with Counter(self, 2) as counter:
             class MockRAMCloud(object):
                 def read_rr(mockrc, txrc, table_id, key, reject_rules):
@@ -213,7 +306,7 @@ class TestTxRAMCloud(unittest.TestCase):
                     return (txramcloud.serialize(my_mt), Opaques.version)
             def mock_finish_mt(mt, txid, version):
                 counter.bump(1)
-                self.assertEquals(mt, my_mt)
+                self.assertEquals(mt.keys(), my_mt.keys())
                 self.assertEquals(txid, Opaques.txid)
                 self.assertEquals(version, Opaques.version)
             with txrc_setup(self, rc=MockRAMCloud()) as txrc:
@@ -272,7 +365,7 @@ class TestTxRAMCloud(unittest.TestCase):
     def test_clean_pickled_garbage(self):
         class MockRAMCloud(object):
             def read_rr(mockrc, txrc, table_id, key, reject_rules):
-                return (txramcloud.serialize("garbage"), Opaques.version)
+                return (pickle.dumps("garbage", 2), Opaques.version)
         with txrc_setup(self, rc=MockRAMCloud()) as txrc:
             self.assertRaises(TxRAMCloud.InconsistencyError, txrc._clean,
                               Opaques.table, Opaques.oid, Opaques.txid,
@@ -323,6 +416,79 @@ class TestTxRAMCloud(unittest.TestCase):
                 self.assertRaises(BreakException, txrc.read_rr,
                                   Opaques.table, Opaques.oid, MUST_EXIST)
 
+    """Testing strategy for multi_read_rr:
+    - test_multi_read tests a batch with an unmasked object, a masked object,
+    a missing object, and an object the user rejects with object_exists. It
+    tests the arguments to RAMCloud.multi_read_rr and _read_rr.
+    """
+
+    def test_multi_read(self):
+        user_rr = [MUST_EXIST, MUST_EXIST, MUST_EXIST,
+                   ramcloud.RejectRules(object_exists=True)]
+        with Counter(self, 2) as counter:
+            class MockRAMCloud(object):
+                def multi_read_rr(mockrc, txrc, table_id, requests):
+                    counter.bump(0)
+                    self.assertEqual(table_id, Opaques.table)
+                    self.assertEqual([k for (k, rr) in requests],
+                                     [10, 11, 12, 13])
+                    for (k, rr) in requests:
+                        self.assertEqual(rr, MUST_EXIST)
+                    return [(txramcloud.pack(0, 0, 'ten'), 100),
+                            (txramcloud.pack(7, now + 10, 'eleven'), 110),
+                            ramcloud.NoObjectError(),
+                            (txramcloud.pack(0, 0, 'thirteen'), 130)]
+            def mock_read_rr(table_id, key, reject_rules):
+                counter.bump(1)
+                self.assertEqual(table_id, Opaques.table)
+                self.assertEqual(key, 11)
+                self.assertEqual(reject_rules, MUST_EXIST)
+                return ('eleven', 111)
+            with txrc_setup(self, rc=MockRAMCloud()) as txrc:
+                txrc._read_rr = mock_read_rr
+                r = txrc.multi_read_rr(Opaques.table,
+                                       zip([10, 11, 12, 13], user_rr))
+                self.assertEqual(r[0], ('ten', 100))
+                self.assertEqual(r[1], ('eleven', 111))
+                self.assert_(isinstance(r[2], ramcloud.NoObjectError))
+                self.assert_(isinstance(r[3], ramcloud.ObjectExistsError))
+
+    """Testing strategy for multi_write:
+    - test_multi_write tests a batch mixing safe reject rules, which must go
+    to RAMCloud.multi_write packed, with an unsafe one, which must go through
+    _write_packed and have its exception returned in place.
+    """
+
+    def test_multi_write(self):
+        safe_rr = ramcloud.RejectRules(object_exists=True)
+        unsafe_rr = ramcloud.RejectRules(object_doesnt_exist=True)
+        with Counter(self, 2) as counter:
+            class MockRAMCloud(object):
+                def multi_write(mockrc, txrc, table_id, requests):
+                    counter.bump(1)
+                    self.assertEqual(table_id, Opaques.table)
+                    self.assertEqual(requests,
+                                     [(10, txramcloud.pack(0, 0, 'ten'),
+                                       safe_rr),
+                                      (12, txramcloud.pack(0, 0, 'twelve'),
+                                       safe_rr)])
+                    return [100, ramcloud.ObjectExistsError()]
+            def mock_write_packed(table_id, key, blob, reject_rules):
+                counter.bump(0)
+                self.assertEqual(key, 11)
+                self.assertEqual(blob, txramcloud.pack(0, 0, 'eleven'))
+                self.assertEqual(reject_rules, unsafe_rr)
+                raise ramcloud.NoObjectError()
+            with txrc_setup(self, rc=MockRAMCloud()) as txrc:
+                txrc._write_packed = mock_write_packed
+                r = txrc.multi_write(Opaques.table,
+                                     [(10, 'ten', safe_rr),
+                                      (11, 'eleven', unsafe_rr),
+                                      (12, 'twelve', safe_rr)])
+                self.assertEqual(r[0], 100)
+                self.assert_(isinstance(r[1], ramcloud.NoObjectError))
+                self.assert_(isinstance(r[2], ramcloud.ObjectExistsError))
+
     """Testing strategy for _delete_unsafe:
     Because the loop iterations do not introduce new states, it suffices to
     check only one iteration of the loop.
@@ -750,20 +916,34 @@ class TestCoordinator(unittest.TestCase):
                                   Opaques.table, Opaques.oid, 30)
 
     def test_unmask_objects(self):
-        txrc = TxRAMCloud(0)
+        rc = MockMultiRAMCloud({
+                (1, 10): (txramcloud.pack(30, now, 'ten'), 100),
+                (1, 11): (txramcloud.pack(30, now, None), 110),
+                (1, 12): (txramcloud.pack(31, now, 'twelve'), 120),
+                (2, 20): (txramcloud.pack(30, now, 'twenty'), 200)})
+        rc.fail.add((2, 20))
         log = []
-        txrc._unmask_object = lambda t, k, tx: log.append((t, k, tx))
-
-        txrc._unmask_objects([], Opaques.txid)
-        self.assertEqual(log[0:], [])
-
-        txrc._unmask_objects([(Opaques.table, Opaques.oid)], Opaques.txid)
-        self.assertEqual(log[0:], [(Opaques.table, Opaques.oid, Opaques.txid)])
-
-        txrc._unmask_objects([(Opaques.table, Opaques.oid), (4, 7)],
-                             Opaques.txid)
-        self.assertEqual(log[1:], [(Opaques.table, Opaques.oid, Opaques.txid),
-                                   (4, 7, Opaques.txid)])
+        with txrc_setup(self, rc=rc) as txrc:
+            txrc._unmask_object = lambda t, k, tx: log.append((t, k, tx))
+            txrc._unmask_objects([], 30)
+            self.assertEqual(rc.calls, [])
+            txrc._unmask_objects([(1, 10), (1, 11), (1, 12), (1, 13), (2, 20)],
+                                 30)
+        self.assertEqual(sorted((op, t) for (op, t, r) in rc.calls),
+                         [('read', 1), ('read', 2), ('remove', 1),
+                          ('write', 1), ('write', 2)])
+        self.assertEqual(rc.objects[(1, 10)],
+                         (txramcloud.pack(0, 0, 'ten'), 101))
+        self.assertFalse((1, 11) in rc.objects)
+        self.assertEqual(rc.objects[(1, 12)][1], 120)
+        for (op, t, requests) in rc.calls:
+            if op == 'remove':
+                self.assertEqual(requests,
+                                 [(11, ramcloud.RejectRules(
+                                           version_gt_given=True,
+                                           given_version=110))])
+        # the rejected write is retried on its own
+        self.assertEqual(log, [(2, 20, 30)])
 
     """Testing strategy for _mask_object:
     Because the loop iterations do not introduce new states, it suffices to
@@ -914,6 +1094,7 @@ class TestCoordinator(unittest.TestCase):
                                   (table_id, key, reject_rules.given_version))
                 return expected[counter.count][2] + 1
             txrc._mask_object = mock_mask_object
+            txrc._mask_batch = lambda objects, mt, txid, timeout, mv: objects
             r = txrc._mask_objects([(t,o) for (t,o,v) in expected],
                                    mt, txid, timeout)
             for (t, o, v) in expected:
@@ -931,11 +1112,98 @@ class TestCoordinator(unittest.TestCase):
                                   set([(t,o) for (t,o,v) in expected[:10]]))
                 self.assertEquals(txid, Opaques.txid)
             txrc._mask_object = mock_mask_object
+            txrc._mask_batch = lambda objects, mt, txid, timeout, mv: objects
             txrc._unmask_objects = mock_unmask_objects
             self.assertRaises(BreakException, txrc._mask_objects,
                               [(t,o) for (t,o,v) in expected],
                               mt, txid, timeout)
 
+    def test_mask_objects_batch(self):
+        mt = txramcloud.MiniTransaction()
+        mt[(1, 10)] = txramcloud.MTOperation(ramcloud.RejectRules())
+        mt[(1, 11)] = txramcloud.MTOperation(ramcloud.RejectRules())
+        mt[(2, 20)] = txramcloud.MTOperation(ramcloud.RejectRules())
+        rc = MockMultiRAMCloud({
+                (1, 10): (txramcloud.pack(0, 0, 'ten'), 100),
+                (1, 11): (txramcloud.pack(7, now, 'eleven'), 110),
+                (2, 20): (txramcloud.pack(0, 0, 'twenty'), 200)})
+        with txrc_setup(self, rc=rc) as txrc:
+            def mock_mask_object(table_id, key, txid, timeout, reject_rules):
+                self.assertEqual(rc.objects[(2, 20)][0],
+                                 txramcloud.pack(0, 0, 'twenty'))
+                return {(1, 11): 111, (2, 20): 203}[(table_id, key)]
+            txrc._mask_object = mock_mask_object
+            r = txrc._mask_objects(sorted(mt.keys()), mt, 30, now)
+        self.assertEqual(r, {(1, 10): 101, (1, 11): 111, (2, 20): 203})
+        self.assertEqual(rc.objects[(1, 10)],
+                         (txramcloud.pack(30, now, 'ten'), 101))
+        # (2, 20) comes after the masked (1, 11), so it isn't batched
+        self.assertEqual([(op, t) for (op, t, requests) in rc.calls],
+                         [('read', 1), ('read', 2), ('write', 1)])
+
+    """Testing strategy for _mask_batch:
+    - test_mask_batch_clean tests the case where every object, including a
+    seed, is masked by the batch. It tests the requests of the batches.
+    - test_mask_batch_changed tests the case where an object changes between
+    the batched read and write, so the objects after it are unmasked again.
+    - test_mask_batch_reject tests the case where an object doesn't meet its
+    reject rules, so nothing is masked.
+    """
+
+    def setup_test_mask_batch(self):
+        mt = txramcloud.MiniTransaction()
+        mt[(1, 10)] = txramcloud.MTOperation(ramcloud.RejectRules())
+        mt[(1, 11)] = txramcloud.MTWrite('b', ramcloud.RejectRules())
+        mt[(2, 20)] = txramcloud.MTOperation(
+                          ramcloud.RejectRules.exactly(200))
+        rc = MockMultiRAMCloud({
+                (1, 10): (txramcloud.pack(0, 0, 'ten'), 100),
+                (2, 20): (txramcloud.pack(0, 0, 'twenty'), 200)})
+        return mt, rc
+
+    def test_mask_batch_clean(self):
+        mt, rc = self.setup_test_mask_batch()
+        masked = {}
+        with txrc_setup(self, rc=rc) as txrc:
+            rest = txrc._mask_batch(sorted(mt.keys()), mt, 30, now, masked)
+        self.assertEqual(rest, [])
+        self.assertEqual(masked, {(1, 10): 101, (1, 11): 1, (2, 20): 201})
+        self.assertEqual(rc.objects[(1, 11)][0], txramcloud.pack(30, now, None))
+        writes = {}
+        for (op, t, requests) in rc.calls:
+            if op == 'write':
+                for (key, blob, rr) in requests:
+                    writes[(t, key)] = rr
+        self.assertEqual(writes,
+                         {(1, 10): ramcloud.RejectRules.exactly(100),
+                          (1, 11): ramcloud.RejectRules(object_exists=True),
+                          (2, 20): ramcloud.RejectRules.exactly(200)})
+
+    def test_mask_batch_changed(self):
+        mt, rc = self.setup_test_mask_batch()
+        rc.fail.add((1, 11))
+        masked = {}
+        unmasked = []
+        with txrc_setup(self, rc=rc) as txrc:
+            txrc._unmask_objects = lambda objs, txid: unmasked.extend(objs)
+            rest = txrc._mask_batch(sorted(mt.keys()), mt, 30, now, masked)
+        self.assertEqual(rest, [(1, 11), (2, 20)])
+        self.assertEqual(masked, {(1, 10): 101})
+        self.assertEqual(unmasked, [(2, 20)])
+
+    def test_mask_batch_reject(self):
+        mt, rc = self.setup_test_mask_batch()
+        rc.objects[(2, 20)] = (txramcloud.pack(0, 0, 'twenty'), 201)
+        with txrc_setup(self, rc=rc) as txrc:
+            try:
+                txrc._mask_batch(sorted(mt.keys()), mt, 30, now, {})
+            except ramcloud.VersionError, e:
+                self.assertEqual((e.table, e.oid), (2, 20))
+            else:
+                self.fail()
+        self.assertEqual([op for (op, t, requests) in rc.calls],
+                         ['read', 'read'])
+
     """Testing strategy for _write_mt:
     - test_write_mt tests the case where the object does not exist. It tests the
     arguments to RAMCloud.write_rr.
@@ -1117,22 +1385,68 @@ class TestCoordinator(unittest.TestCase):
                 txrc._apply_op(Opaques.table, Opaques.oid, -1, Opaques.op)
 
     def test_apply_mt(self):
-        observed = set()
-        expected = set()
         mt = txramcloud.MiniTransaction()
-        for i in range(5):
-            op = Opaque()
-            mt[(500 + i, 700 + i)] = op
-            expected.add((500 + i, 700 + i, op))
-        with Counter(self, 5) as counter:
-            def mock_apply_op(table_id, key, txid, op):
-                counter.bump()
-                observed.add((table_id, key, op))
-                self.assertEquals(txid, Opaques.txid)
-            with txrc_setup(self) as txrc:
-                txrc._apply_op = mock_apply_op
-                txrc._apply_mt(mt, Opaques.txid)
-                self.assertEquals(observed, expected)
+        mt[(1, 10)] = txramcloud.MTOperation(ramcloud.RejectRules())
+        mt[(1, 11)] = txramcloud.MTWrite('b', ramcloud.RejectRules())
+        mt[(2, 20)] = txramcloud.MTDelete(ramcloud.RejectRules())
+        mt[(2, 21)] = txramcloud.MTWrite('c', ramcloud.RejectRules())
+        mt[(2, 22)] = txramcloud.MTWrite('d', ramcloud.RejectRules())
+        rc = MockMultiRAMCloud({
+                (1, 10): (txramcloud.pack(30, now, 'ten'), 100),
+                (1, 11): (txramcloud.pack(30, now, None), 110),
+                (2, 20): (txramcloud.pack(30, now, 'twenty'), 200),
+                (2, 21): (txramcloud.pack(0, 0, 'c'), 210),
+                (2, 22): (txramcloud.pack(30, now, 'x'), 220)})
+        rc.fail.add((2, 22))
+        with txrc_setup(self, rc=rc) as txrc:
+            txrc._apply_mt(mt, 30)
+        self.assertEqual(sorted((op, t) for (op, t, r) in rc.calls),
+                         [('read', 1), ('read', 2), ('remove', 2),
+                          ('write', 1), ('write', 2)])
+        # the rejected write to (2, 22) is left alone
+        self.assertEqual(rc.objects,
+                         {(1, 10): (txramcloud.pack(0, 0, 'ten'), 101),
+                          (1, 11): (txramcloud.pack(0, 0, 'b'), 111),
+                          (2, 21): (txramcloud.pack(0, 0, 'c'), 210),
+                          (2, 22): (txramcloud.pack(30, now, 'x'), 220)})
+        for (op, t, requests) in rc.calls:
+            if op == 'remove':
+                self.assertEqual(requests,
+                                 [(20, ramcloud.RejectRules.exactly(200))])
+
+    def test_apply_mt_masked_versions(self):
+        mt = txramcloud.MiniTransaction()
+        mt[(1, 10)] = txramcloud.MTOperation(ramcloud.RejectRules())
+        mt[(1, 11)] = txramcloud.MTWrite('b', ramcloud.RejectRules())
+        mt[(2, 20)] = txramcloud.MTDelete(ramcloud.RejectRules())
+        mt[(2, 21)] = txramcloud.MTWrite('c', ramcloud.RejectRules())
+        mt.masked_versions = {(1, 10): 100, (1, 11): 110, (2, 20): 200,
+                              (2, 21): 210}
+        rc = MockMultiRAMCloud({
+                (1, 10): (txramcloud.pack(30, now, 'ten'), 100),
+                (1, 11): (txramcloud.pack(30, now, 'x'), 110),
+                (2, 20): (txramcloud.pack(30, now, 'twenty'), 200),
+                # already applied by another client
+                (2, 21): (txramcloud.pack(0, 0, 'c'), 211)})
+        rc.fail.add((2, 21))
+        with txrc_setup(self, rc=rc) as txrc:
+            txrc._apply_mt(mt, 30)
+        # only the no-op is read back
+        self.assertEqual([(op, t, [r[0] for r in requests])
+                          for (op, t, requests) in rc.calls if op == 'read'],
+                         [('read', 1, [10])])
+        self.assertEqual(rc.objects,
+                         {(1, 10): (txramcloud.pack(0, 0, 'ten'), 101),
+                          (1, 11): (txramcloud.pack(0, 0, 'b'), 111),
+                          (2, 21): (txramcloud.pack(0, 0, 'c'), 211)})
+        for (op, t, requests) in rc.calls:
+            if op == 'remove':
+                self.assertEqual(requests,
+                                 [(20, ramcloud.RejectRules.exactly(200))])
+            elif op == 'write' and t == 2:
+                self.assertEqual(requests,
+                                 [(21, txramcloud.pack(0, 0, 'c'),
+                                   ramcloud.RejectRules.exactly(210))])
 
     def test_finish_mt(self):
         with Counter(self, 2) as counter:
@@ -1158,6 +1472,12 @@ class TestCoordinator(unittest.TestCase):
     - test_mt_commit_write_mt_fail tests the case where the minitransaction
     intent is blocked by a tombstone. It tests the arguments to _unmask_objects
     and _delete_tombstone.
+    - test_mt_commit_plain tests that a minitransaction including a plain
+    table is refused.
+    - test_mt_commit_one tests that a minitransaction of one object is
+    committed by _commit_one alone.
+    - test_mt_commit_one_masked tests that it goes through the full protocol
+    when _commit_one finds the object masked.
     """
 
     def setup_test_mt_commit(self):
@@ -1181,11 +1501,15 @@ class TestCoordinator(unittest.TestCase):
             def mock_write_mt(_mt, txid):
                 counter.bump(1)
                 self.assertEquals(_mt, mt)
+                self.assertEquals(_mt.masked_versions,
+                                  {(38, 2): 11, (38, 3): 21, (73, 4): 31})
                 self.assertEquals(txid, 48484)
                 return Opaques.version
             def mock_finish_mt(_mt, txid, version):
                 counter.bump(2)
                 self.assertEquals(_mt, mt)
+                self.assertEquals(_mt.masked_versions,
+                                  {(38, 2): 11, (38, 3): 21, (73, 4): 31})
                 self.assertEquals(txid, 48484)
                 self.assertEquals(version, Opaques.version)
             with txrc_setup(self) as txrc:
@@ -1239,6 +1563,48 @@ class TestCoordinator(unittest.TestCase):
                 txrc._delete_tombstone = mock_delete_tombstone
                 self.assertRaises(BreakException, txrc.mt_commit, mt)
 
+    def test_mt_commit_plain(self):
+        mt = self.setup_test_mt_commit()
+        with txrc_setup(self) as txrc:
+            txrc.set_plain_table(73)
+            self.assertRaises(ValueError, txrc.mt_commit, mt)
+
+    def test_mt_commit_one(self):
+        mt = txramcloud.MiniTransaction()
+        mt[(38, 2)] = txramcloud.MTWrite(Opaque(), Opaque())
+        with Counter(self, 1) as counter:
+            def mock_commit_one(_mt):
+                counter.bump(0)
+                self.assertEquals(_mt, mt)
+                return {(38, 2): 12}
+            with txrc_setup(self) as txrc:
+                txrc._commit_one = mock_commit_one
+                self.assertEquals(txrc.mt_commit(mt), {(38, 2): 12})
+
+    def test_mt_commit_one_masked(self):
+        mt = txramcloud.MiniTransaction()
+        mt[(38, 2)] = txramcloud.MTWrite(Opaque(), Opaque())
+        with Counter(self, 4) as counter:
+            def mock_commit_one(_mt):
+                counter.bump(0)
+                return None
+            def mock_mask_objects(objects, _mt, txid, timeout):
+                counter.bump(1)
+                self.assertEquals(objects, [(38, 2)])
+                return {(38, 2): 11}
+            def mock_write_mt(_mt, txid):
+                counter.bump(2)
+                return Opaques.version
+            def mock_finish_mt(_mt, txid, version):
+                counter.bump(3)
+            with txrc_setup(self) as txrc:
+                txrc.txid_res = iter([48484])
+                txrc._commit_one = mock_commit_one
+                txrc._mask_objects = mock_mask_objects
+                txrc._write_mt = mock_write_mt
+                txrc._finish_mt = mock_finish_mt
+                self.assertEquals(txrc.mt_commit(mt), {(38, 2): 12})
+
 class TestMiniTransaction(unittest.TestCase):
     def assertSerializable(self, mt):
         mt_out = txramcloud.unserialize(txramcloud.serialize(mt))
@@ -1247,12 +1613,94 @@ class TestMiniTransaction(unittest.TestCase):
             self.assertEquals(type(mt_out[key]), type(mt[key]))
             # TODO: we'd like to test operation equality, not type equality
 
+    def test_legacy_pickle(self):
+        mt = txramcloud.MiniTransaction()
+        mt[(38, 2)] = txramcloud.MTWrite('data', ramcloud.RejectRules())
+        mt_out = txramcloud.unserialize(pickle.dumps(mt, protocol=2))
+        self.assertEquals(mt_out.keys(), mt.keys())
+        self.assertEquals(mt_out[(38, 2)].data, 'data')
+        self.assert_(type(txramcloud.unserialize(
+                pickle.dumps(txramcloud.Tombstone(), protocol=2))) ==
+            txramcloud.Tombstone)
+
+    def test_legacy_pickle_unsafe(self):
+        class Evil(object):
+            def __reduce__(self):
+                return (time.sleep, (100,))
+        self.assertRaises(ValueError, txramcloud.unserialize,
+                          pickle.dumps(Evil(), protocol=2))
+
     def test_mt_serializable(self):
         mt = txramcloud.MiniTransaction()
         mt[(38, 2)] = txramcloud.MTOperation(ramcloud.RejectRules())
         mt[(38, 3)] = txramcloud.MTWrite(Opaques.datas, ramcloud.RejectRules())
         mt[(73, 4)] = txramcloud.MTDelete(ramcloud.RejectRules())
         self.assertSerializable(mt)
+        mt_out = txramcloud.unserialize(txramcloud.serialize(mt))
+        self.assertEquals(mt_out.masked_versions, None)
+        mt.masked_versions = {(38, 2): 11, (38, 3): 21, (73, 4): 31}
+        mt_out = txramcloud.unserialize(txramcloud.serialize(mt))
+        self.assertEquals(mt_out.masked_versions, mt.masked_versions)
+
+class TestIntentView(unittest.TestCase):
+    def setUp(self):
+        self.mt = txramcloud.MiniTransaction()
+        self.mt[(38, 'b')] = txramcloud.MTOperation(
+                                 ramcloud.RejectRules.exactly(7))
+        self.mt[(38, 10)] = txramcloud.MTWrite('ten', ramcloud.RejectRules(
+                                                   object_exists=True))
+        self.mt[(38, 9)] = txramcloud.MTWrite('', ramcloud.RejectRules())
+        self.mt[(2, 'a')] = txramcloud.MTDelete(ramcloud.RejectRules(
+                                version_eq_given=True, given_version=3))
+        self.mt.masked_versions = {(38, 'b'): 8, (38, 10): 11, (2, 'a'): 4}
+        self.blob = txramcloud.serialize(self.mt)
+
+    def test_round_trip(self):
+        mt_out = txramcloud.unserialize(self.blob)
+        self.assert_(type(mt_out) == txramcloud.MiniTransaction)
+        self.assertEquals(sorted(mt_out.keys()), sorted(self.mt.keys()))
+        for (obj, op) in self.mt.items():
+            self.assert_(type(mt_out[obj]) == type(op))
+            self.assertEquals(mt_out[obj].reject_rules, op.reject_rules)
+            self.assertEquals(getattr(mt_out[obj], 'data', None),
+                              getattr(op, 'data', None))
+        self.assertEquals(mt_out.masked_versions, self.mt.masked_versions)
+
+    def test_lookup(self):
+        view = txramcloud.load_intent(self.blob)
+        self.assert_(type(view) == txramcloud.IntentView)
+        self.assertEquals(len(view), 4)
+        self.assertEquals(view[(38, 10)].data, 'ten')
+        self.assertEquals(view[(38, 'b')].reject_rules,
+                          ramcloud.RejectRules.exactly(7))
+        self.assert_((2, 'a') in view)
+        self.assertFalse((38, '10') in view)
+        self.assertFalse((3, 'a') in view)
+        self.assertRaises(KeyError, view.__getitem__, (38, 11))
+
+    def test_no_masked_versions(self):
+        self.mt.masked_versions = None
+        view = txramcloud.load_intent(txramcloud.serialize(self.mt))
+        self.assertEquals(view.masked_versions, None)
+
+    def test_tombstone(self):
+        blob = txramcloud.serialize(txramcloud.Tombstone())
+        self.assert_(type(txramcloud.load_intent(blob)) ==
+                     txramcloud.Tombstone)
+        self.assertRaises(ValueError, txramcloud.IntentView, blob)
+
+    def test_bad(self):
+        self.assertRaises(ValueError, txramcloud.load_intent, self.blob[:10])
+        view = txramcloud.load_intent(self.blob[:-3])
+        self.assertRaises(ValueError, view.items)
+        self.assertRaises(TypeError, txramcloud.serialize, 'garbage')
+        newer = self.blob[:4] + chr(txramcloud.INTENT_FORMAT + 1) + \
+                self.blob[5:]
+        self.assertRaises(TxRAMCloud.OutdatedClient, txramcloud.load_intent,
+                          newer)
+
+    def test_smaller_than_pickle(self):
+        self.assert_(len(self.blob) < len(pickle.dumps(self.mt, protocol=2)))
 
 if __name__ == '__main__':
     unittest.main()
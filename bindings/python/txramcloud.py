@@ -18,7 +18,9 @@ This module buys you fully ACID transactions, but you'll pay for it:
 
 In non-transactional operations:
  - Blind (unconditional) operations are now about twice as slow as operations
-   that depend on a specific version number.
+   that depend on a specific version number. Tables that never take part in
+   transactions can be registered with L{TxRAMCloud.set_plain_table} to get
+   the speed of L{ramcloud.RAMCloud} back.
 
 In transactional operations:
  - Client clocks must be roughly synchronized for good performance, though clock
@@ -85,8 +87,11 @@ Consequences
 """
 
 import struct
+import sys
 import time
+import _ctypes
 import cPickle as pickle
+from cStringIO import StringIO
 
 import retries
 import ramcloud
@@ -95,18 +100,183 @@ from oidres import OIDRes
 RAMCloud = ramcloud.RAMCloud
 RetryStrategy = retries.FuzzyExponentialBackoff
 
-TXRAMCLOUD_VERSION = 1
+# Version 2 records masked versions in transaction intents, and version 3
+# writes intents and tombstones with serialize instead of pickling them.
+# Objects are the same in all versions.
+TXRAMCLOUD_VERSION = 3
+TXRAMCLOUD_MIN_VERSION = 1
 TXRAMCLOUD_HEADER = "txramcloud"
 
 TXID_RES_OID = 2**64 - 1
 
+INTENT_MAGIC = "txin"
+INTENT_FORMAT = 1
+
+# kinds of objects at a transaction ID
+INTENT_TOMBSTONE = 0
+INTENT_MINITRANSACTION = 1
+
+# flag: the intent records masked versions
+INTENT_MASKED_VERSIONS = 1
+
+# magic, format, kind, flags, number of operations
+IntentHeaderFmt = struct.Struct("<4sBBBxI")
+
+# One index entry per operation, sorted by table_id, key type and key:
+# table_id, masked version (0 if not recorded), record offset, record
+# length, key length, operation type, key type. A record holds the key, the
+# reject rules and, for a write, the data.
+IntentEntryFmt = struct.Struct("<QQIIHBB")
+
+# given_version, object_doesnt_exist, object_exists, version_eq_given,
+# version_gt_given
+RejectRulesFmt = struct.Struct("<QBBBB")
+
+# operation types
+OP_NONE = 0
+OP_WRITE = 1
+OP_DELETE = 2
+
+# key types
+KEY_STR = 0
+KEY_INT = 1
+
+def _encode_key(key):
+    """Return the key type and bytes a key is stored with in an intent."""
+    if isinstance(key, (int, long)):
+        return (KEY_INT, str(key))
+    if isinstance(key, str):
+        return (KEY_STR, key)
+    raise TypeError("Can't serialize key %r" % (key,))
+
 def serialize(data):
-    """Pickle some Python object."""
-    return pickle.dumps(data, protocol=2)
+    """Encode a L{MiniTransaction} or a L{Tombstone}.
+
+    L{unserialize} is the inverse of L{serialize}. L{IntentView} decodes an
+    encoded L{MiniTransaction} lazily.
+
+    @param data: the intent or tombstone
+    @type  data: L{MiniTransaction} or L{Tombstone}
+
+    @return: binary blob
+    @rtype: C{str}
+    """
+    if type(data) == Tombstone:
+        return IntentHeaderFmt.pack(INTENT_MAGIC, INTENT_FORMAT,
+                                    INTENT_TOMBSTONE, 0, 0)
+    if type(data) != MiniTransaction:
+        raise TypeError("Can't serialize %s" % type(data))
+
+    masked_versions = data.masked_versions
+    entries = sorted((table_id,) + _encode_key(key) + ((table_id, key), op)
+                     for ((table_id, key), op) in data.items())
+    offset = IntentHeaderFmt.size + len(entries) * IntentEntryFmt.size
+    index = []
+    records = []
+    for (table_id, key_type, key, obj, op) in entries:
+        if type(op) == MTOperation:
+            op_type, op_data = OP_NONE, ''
+        elif type(op) == MTWrite:
+            op_type, op_data = OP_WRITE, op.data
+        elif type(op) == MTDelete:
+            op_type, op_data = OP_DELETE, ''
+        else:
+            raise TxRAMCloud.InconsistencyError("Unknown type in MT: %s" %
+                                                type(op))
+        rr = op.reject_rules
+        record = ''.join([key,
+                          RejectRulesFmt.pack(rr.given_version,
+                                              rr.object_doesnt_exist,
+                                              rr.object_exists,
+                                              rr.version_eq_given,
+                                              rr.version_gt_given),
+                          op_data])
+        version = 0
+        if masked_versions is not None:
+            version = masked_versions.get(obj) or 0
+        index.append(IntentEntryFmt.pack(table_id, version, offset,
+                                         len(record), len(key), op_type,
+                                         key_type))
+        records.append(record)
+        offset += len(record)
+
+    flags = 0
+    if masked_versions is not None:
+        flags |= INTENT_MASKED_VERSIONS
+    header = IntentHeaderFmt.pack(INTENT_MAGIC, INTENT_FORMAT,
+                                  INTENT_MINITRANSACTION, flags, len(entries))
+    return ''.join([header] + index + records)
+
+def _intent_header(blob):
+    # Returns the kind, flags and operation count of an encoded intent.
+    if len(blob) < IntentHeaderFmt.size:
+        raise ValueError("Intent too small")
+    magic, fmt, kind, flags, count = IntentHeaderFmt.unpack_from(blob)
+    if magic != INTENT_MAGIC:
+        raise ValueError("Intent header not set to INTENT_MAGIC")
+    if fmt > INTENT_FORMAT:
+        raise TxRAMCloud.OutdatedClient("Encountered intent with format %d" %
+                                        fmt)
+    if kind not in (INTENT_TOMBSTONE, INTENT_MINITRANSACTION):
+        raise ValueError("Unknown kind of intent: %d" % kind)
+    return (kind, flags, count)
+
+# The classes that intents and tombstones pickled by older clients refer to.
+_PICKLED_GLOBALS = set([('txramcloud', 'Tombstone'),
+                        ('txramcloud', 'MiniTransaction'),
+                        ('txramcloud', 'MTOperation'),
+                        ('txramcloud', 'MTWrite'),
+                        ('txramcloud', 'MTDelete'),
+                        ('ramcloud', 'RejectRules'),
+                        ('_ctypes', '_unpickle')])
+
+def _pickled_global(module, name):
+    if (module, name) not in _PICKLED_GLOBALS:
+        raise pickle.UnpicklingError("%s.%s is not allowed in an intent" %
+                                     (module, name))
+    return getattr({'txramcloud': sys.modules[__name__],
+                    'ramcloud': ramcloud,
+                    '_ctypes': _ctypes}[module], name)
+
+def load_intent(blob):
+    """Decode what is stored at a transaction ID.
+
+    Intents and tombstones pickled by clients older than
+    C{TXRAMCLOUD_VERSION} 3 are still read, but may only refer to the classes
+    of intents and tombstones.
+
+    @param blob: binary blob as produced by L{serialize}
+    @type  blob: C{str}
+
+    @return: a L{Tombstone}, or the intent as an L{IntentView} (a
+             L{MiniTransaction} if it was pickled)
+
+    @raise ValueError: C{blob} isn't an intent or a tombstone.
+    """
+    if blob[:len(INTENT_MAGIC)] == INTENT_MAGIC:
+        kind, flags, count = _intent_header(blob)
+        if kind == INTENT_TOMBSTONE:
+            return Tombstone()
+        return IntentView(blob)
+    unpickler = pickle.Unpickler(StringIO(blob))
+    unpickler.find_global = _pickled_global
+    try:
+        intent = unpickler.load()
+    except Exception, e:
+        raise ValueError("Not an intent: %s" % e)
+    if type(intent) not in (Tombstone, MiniTransaction):
+        raise ValueError("Not an intent: %s" % type(intent))
+    return intent
 
 def unserialize(serialized):
-    """Unpickle some serialized Python object."""
-    return pickle.loads(serialized)
+    """Decode a L{MiniTransaction} or a L{Tombstone} in full.
+
+    @raise ValueError: See L{load_intent}.
+    """
+    intent = load_intent(serialized)
+    if type(intent) == IntentView:
+        return intent.decode()
+    return intent
 
 HeaderFmt = struct.Struct("14sBBQd")
 
@@ -129,7 +299,7 @@ def unpack(blob):
     if header.rstrip('\0') != TXRAMCLOUD_HEADER:
         raise TxRAMCloud.InconsistencyError("Object header not set to " +
                                             "TXRAMCLOUD_HEADER")
-    if version != TXRAMCLOUD_VERSION:
+    if not TXRAMCLOUD_MIN_VERSION <= version <= TXRAMCLOUD_VERSION:
         raise TxRAMCloud.OutdatedClient("Encountered object with version %d" %
                                         version)
     if seed:
@@ -182,7 +352,8 @@ class TxRAMCloud(RAMCloud):
     - L{write_rr} will never overwrite an object that's in a transaction.
     - L{delete_rr} will never delete an object that's in a transaction.
     - L{ramcloud.RAMCloud} will never handle raw user data; it will always be
-      packed with L{pack}.
+      packed with L{pack}. Plain tables (see L{set_plain_table}) are the
+      exception.
     """
 
     class InconsistencyError(Exception):
@@ -238,6 +409,7 @@ class TxRAMCloud(RAMCloud):
             pass
         self.txid_res = OIDRes(rc=self, table=tx_table, oid=TXID_RES_OID)
         self.tx_table = tx_table
+        self.plain_tables = set()
 
     def __del__(self):
         if RAMCloud == ramcloud.RAMCloud:
@@ -246,10 +418,50 @@ class TxRAMCloud(RAMCloud):
             # unit tests are messing around in here!
             pass
 
+    def set_plain_table(self, table_id, plain=True):
+        """Choose whether a table takes part in transactions.
+
+        Objects in a plain table are stored as they are, without the header
+        added by L{pack}, and every operation on them is passed straight to
+        L{ramcloud.RAMCloud}. Blind writes and deletes don't have to read the
+        object first to check for a mask. A plain table can't be used in a
+        L{MiniTransaction}.
+
+        Every client that shares a table must agree on whether it's plain,
+        and a table holding objects mustn't change between the two.
+
+        @param table_id: the table
+        @type  table_id: C{int}
+
+        @param plain: whether the table is plain
+        @type  plain: C{bool}
+        """
+        if plain:
+            self.plain_tables.add(table_id)
+        else:
+            self.plain_tables.discard(table_id)
+
     def insert(self, table_id, data):
+        if table_id in self.plain_tables:
+            return RAMCloud.insert(self, table_id, data)
         blob = pack(0, 0, data)
         return RAMCloud.insert(self, table_id, blob)
 
+    def increment(self, table_id, key, delta=1):
+        """Atomically add C{delta} to a counter in C{tx_table} or a plain table.
+
+        Counters live outside of transactions, such as the one behind
+        L{txid_res}. Objects in other tables are packed and may be masked, so
+        they can't be incremented in place.
+
+        @raise ValueError: C{table_id} is neither C{tx_table} nor a plain
+                           table.
+        """
+        if table_id != self.tx_table and table_id not in self.plain_tables:
+            raise ValueError("TxRAMCloud can only increment counters in its "
+                             "tx_table and in plain tables")
+        return RAMCloud.increment(self, table_id, key, delta)
+
     def _write_tombstone(self, txid):
         """Force a transaction to abort.
 
@@ -301,24 +513,25 @@ class TxRAMCloud(RAMCloud):
             # caller will retry if the object still needs cleaning
         else:
             try:
-                mt = unserialize(mtdata)
-            except pickle.BadPickleGet:
-                raise self.InconsistencyError("Not a pickled object")
+                mt = load_intent(mtdata)
+            except ValueError:
+                raise self.InconsistencyError("Not a MiniTransaction or " +
+                                              "Tombstone")
             if type(mt) == Tombstone:
                 self._unmask_object(table_id, key, txid)
-            elif type(mt) == MiniTransaction:
-                self._finish_mt(mt, txid, mtversion)
             else:
-                raise self.InconsistencyError("Not a MiniTransaction or " +
-                                              "Tombstone")
+                self._finish_mt(mt, txid, mtversion)
 
-    def _read_rr(self, table_id, key, user_reject_rules):
+    def _raw_read_rules(self, user_reject_rules):
         # We can't reject for object_exists in RAMCloud.read_rr because of seed
         # objects, so we handle it later.
-        reject_rules = ramcloud.RejectRules(object_doesnt_exist=True,
+        return ramcloud.RejectRules(object_doesnt_exist=True,
                             version_eq_given=user_reject_rules.version_eq_given,
                             version_gt_given=user_reject_rules.version_gt_given,
                             given_version=user_reject_rules.given_version)
+
+    def _read_rr(self, table_id, key, user_reject_rules):
+        reject_rules = self._raw_read_rules(user_reject_rules)
         start = time.time()
         for retry in RetryStrategy():
             blob, version = RAMCloud.read_rr(self, table_id, key, reject_rules)
@@ -339,8 +552,38 @@ class TxRAMCloud(RAMCloud):
         # Yep, this appears to be redundant. The names of the arguments are
         # part of the API inherited from ramcloud.RAMCloud, so we relay to a
         # private method that can name its arguments as it pleases.
+        if table_id in self.plain_tables:
+            return RAMCloud.read_rr(self, table_id, key, reject_rules)
         return self._read_rr(table_id, key, reject_rules)
 
+    def multi_read_rr(self, table_id, requests):
+        if table_id in self.plain_tables:
+            return RAMCloud.multi_read_rr(self, table_id, requests)
+        # Masks are rare, so read everything in one batch and only go through
+        # _read_rr (which waits for or cleans up masks) for masked objects.
+        raw_requests = [(key, self._raw_read_rules(rr))
+                        for (key, rr) in requests]
+        results = []
+        for ((key, user_reject_rules), r) in zip(requests,
+                RAMCloud.multi_read_rr(self, table_id, raw_requests)):
+            if isinstance(r, Exception):
+                results.append(r)
+                continue
+            blob, version = r
+            txid, timeout, data = unpack(blob)
+            if txid:
+                try:
+                    results.append(self._read_rr(table_id, key,
+                                                 user_reject_rules))
+                except (ramcloud.NoObjectError, ramcloud.ObjectExistsError,
+                        ramcloud.VersionError), e:
+                    results.append(e)
+            elif user_reject_rules.object_exists:
+                results.append(ramcloud.ObjectExistsError())
+            else:
+                results.append((data, version))
+        return results
+
     def _delete_unsafe(self, table_id, key, user_reject_rules):
         # - Throws L{ramcloud.NoObjectError} if user_reject_rules specifies
         # object_doesnt_exist and there is no object to be deleted.
@@ -391,6 +634,8 @@ class TxRAMCloud(RAMCloud):
                 retry.later()
 
     def delete_rr(self, table_id, key, reject_rules):
+        if table_id in self.plain_tables:
+            return RAMCloud.delete_rr(self, table_id, key, reject_rules)
         if reject_rules.object_exists or reject_rules.version_gt_given:
             # these cases are safe
             return RAMCloud.delete_rr(self, table_id, key, reject_rules)
@@ -452,7 +697,12 @@ class TxRAMCloud(RAMCloud):
                 retry.later()
 
     def write_rr(self, table_id, key, data, reject_rules):
-        blob = pack(0, 0, data)
+        if table_id in self.plain_tables:
+            return RAMCloud.write_rr(self, table_id, key, data, reject_rules)
+        return self._write_packed(table_id, key, pack(0, 0, data),
+                                  reject_rules)
+
+    def _write_packed(self, table_id, key, blob, reject_rules):
         if reject_rules.object_exists or reject_rules.version_gt_given:
             # these cases are safe
             return RAMCloud.write_rr(self, table_id, key, blob, reject_rules)
@@ -462,8 +712,126 @@ class TxRAMCloud(RAMCloud):
             else:
                 return self._write_unsafe(table_id, key, blob, reject_rules)
 
+    def _multi_safe(self, requests, raw_op, op):
+        # Requests whose reject rules are safe to pass straight through (see
+        # write_rr and delete_rr) go out in one raw batch. The rest need a
+        # read first and go through op one at a time.
+        results = [None] * len(requests)
+        safe = []
+        for (i, request) in enumerate(requests):
+            reject_rules = request[-1]
+            if reject_rules.object_exists or reject_rules.version_gt_given:
+                safe.append(i)
+                continue
+            try:
+                results[i] = op(*request)
+            except ramcloud.OBJECT_ERRORS, e:
+                results[i] = e
+        if safe:
+            for (i, r) in zip(safe, raw_op([requests[i] for i in safe])):
+                results[i] = r
+        return results
+
+    def multi_remove(self, table_id, requests):
+        if table_id in self.plain_tables:
+            return RAMCloud.multi_remove(self, table_id, requests)
+        return self._multi_safe(requests,
+                lambda rs: RAMCloud.multi_remove(self, table_id, rs),
+                lambda key, rr: self.delete_rr(table_id, key, rr))
+
+    def multi_write(self, table_id, requests):
+        if table_id in self.plain_tables:
+            return RAMCloud.multi_write(self, table_id, requests)
+        requests = [(key, pack(0, 0, data), rr)
+                    for (key, data, rr) in requests]
+        return self._multi_safe(requests,
+                lambda rs: RAMCloud.multi_write(self, table_id, rs),
+                lambda key, blob, rr: self._write_packed(table_id, key,
+                                                         blob, rr))
+
     # begin coordinator:
 
+    def _multi_raw(self, op, requests):
+        # Issues (table_id, key, ...) requests through one of the base
+        # client's multi-ops, one batch per table, and returns a result for
+        # each request in order. A batch goes out to all of the masters
+        # holding its objects at once.
+        by_table = {}
+        for (i, request) in enumerate(requests):
+            by_table.setdefault(request[0], []).append(i)
+        results = [None] * len(requests)
+        for (table_id, indexes) in by_table.items():
+            batch = [requests[i][1:] for i in indexes]
+            for (i, r) in zip(indexes, op(self, table_id, batch)):
+                results[i] = r
+        return results
+
+    def _replace_masked(self, objects, txid, replace):
+        """Rewrite the objects masked by a transaction, batched per table.
+
+        @param objects: A list of (table_id, key) tuples of possibly masked
+                        objects.
+        @type  objects: C{list}
+
+        @param txid: The transaction which may be masking the objects.
+        @type  txid: C{int}
+
+        @param replace: called as C{replace(table_id, key, version, data)}
+                        for each object masked by C{txid}, where C{data} is
+                        C{None} for a seed; returns the new contents (or
+                        C{None} to delete the object) and the reject rules to
+                        change it with
+        @type  replace: callable
+
+        @return: the (table_id, key) tuples of the objects whose change was
+                 rejected, and those of the objects whose change failed for
+                 any other reason; see L{_change_batch}
+        @rtype: (C{list}, C{list})
+        """
+        rr_read = ramcloud.RejectRules(object_doesnt_exist=True)
+        reads = self._multi_raw(RAMCloud.multi_read_rr,
+                                [(table_id, key, rr_read)
+                                 for (table_id, key) in objects])
+        writes = []
+        removes = []
+        for ((table_id, key), r) in zip(objects, reads):
+            if isinstance(r, ramcloud.NoObjectError):
+                # the object doesn't exist, so it's most certainly not masked
+                continue
+            if isinstance(r, Exception):
+                raise r
+            blob, version = r
+            otxid, otimeout, odata = unpack(blob)
+            if otxid == 0 or otxid != txid:
+                continue
+            data, reject_rules = replace(table_id, key, version, odata)
+            if data is None:
+                removes.append((table_id, key, reject_rules))
+            else:
+                writes.append((table_id, key, pack(0, 0, data), reject_rules))
+        return self._change_batch(writes, removes)
+
+    def _change_batch(self, writes, removes):
+        # Issues (table_id, key, blob, reject_rules) writes and (table_id,
+        # key, reject_rules) removes, batched per table, and returns the
+        # (table_id, key) tuples of those that were rejected by their reject
+        # rules and of those that failed with any other error. The caller
+        # must retry the failed ones one at a time, which raises the error.
+        rejected = []
+        failed = []
+        for (op, requests) in [(RAMCloud.multi_write, writes),
+                               (RAMCloud.multi_remove, removes)]:
+            if not requests:
+                continue
+            for (request, r) in zip(requests, self._multi_raw(op, requests)):
+                if isinstance(r, (ramcloud.NoObjectError,
+                                  ramcloud.ObjectExistsError,
+                                  ramcloud.VersionError)):
+                    rejected.append(request[:2])
+                elif isinstance(r, Exception):
+                    failed.append(request[:2])
+        return (rejected, failed)
+
     def _unmask_object(self, table_id, key, txid):
         """Ensure an object is not masked by a particular transaction.
 
@@ -522,7 +890,13 @@ class TxRAMCloud(RAMCloud):
         @type  txid: C{int}
 
         """
-        for (table_id, key) in objects:
+        def unmask(table_id, key, version, data):
+            return (data, ramcloud.RejectRules(version_gt_given=True,
+                                               given_version=version))
+        # Objects that changed under the batch, or whose change failed, are
+        # retried one at a time.
+        rejected, failed = self._replace_masked(objects, txid, unmask)
+        for (table_id, key) in rejected + failed:
             self._unmask_object(table_id, key, txid)
 
     def _mask_object(self, table_id, key, txid, timeout, user_reject_rules):
@@ -611,6 +985,9 @@ class TxRAMCloud(RAMCloud):
         If any exceptions are raised, this method will try unmask all the
         objects that it has masked before raising it to the caller.
 
+        Objects that aren't masked are masked together with one batch per
+        table (see L{_mask_batch}). The rest are masked one at a time.
+
         @warning: This method masks the objects in the order given in
                   C{objects}. If the object is already masked, this method will
                   wait for it to become unmasked. The caller is in charge of
@@ -640,6 +1017,8 @@ class TxRAMCloud(RAMCloud):
         """
         masked_versions = {}
         try:
+            objects = self._mask_batch(objects, mt, txid, timeout,
+                                       masked_versions)
             for (table_id, key) in objects:
                 op = mt[(table_id, key)]
                 masked_version = self._mask_object(table_id, key, txid, timeout,
@@ -651,6 +1030,88 @@ class TxRAMCloud(RAMCloud):
             raise
         return masked_versions
 
+    def _mask_batch(self, objects, mt, txid, timeout, masked_versions):
+        """Mask the objects in a transaction with one batch per table.
+
+        Objects that are masked by another transaction, or that change
+        before the batch masks them, are left for the caller to mask one at a
+        time. So is every object that comes after the first of them in
+        C{objects}, so that nothing is masked out of order.
+
+        @param objects: a list of (table, key) pairs of objects to mask
+        @type  objects: list
+
+        @param masked_versions: filled in with the version number of each
+                                object that the batch masks
+        @type  masked_versions: C{dict}
+
+        @raise Exception: If some object could not be masked because of
+                          C{user_reject_rules}. See L{_mask_object}. Nothing
+                          is masked in this case.
+
+        @return: the objects still to be masked, in order
+        @rtype:  C{list}
+
+        See L{_mask_objects} for the other parameters.
+        """
+        rr_read = ramcloud.RejectRules(object_doesnt_exist=True)
+        reads = self._multi_raw(RAMCloud.multi_read_rr,
+                                [(table_id, key, rr_read)
+                                 for (table_id, key) in objects])
+        # objects[wait] is the first one the batch can't mask
+        wait = len(objects)
+        writes = []
+        for (i, ((table_id, key), r)) in enumerate(zip(objects, reads)):
+            user_reject_rules = mt[(table_id, key)].reject_rules
+            if isinstance(r, ramcloud.NoObjectError):
+                if user_reject_rules.object_doesnt_exist:
+                    e = r
+                else:
+                    rr_write = ramcloud.RejectRules(object_exists=True)
+                    writes.append((i, pack(txid, timeout, None), rr_write))
+                    continue
+            elif isinstance(r, Exception):
+                raise r
+            else:
+                blob, version = r
+                otxid, otimeout, data = unpack(blob)
+                if otxid:
+                    wait = min(wait, i)
+                    continue
+                e = ramcloud.reject_error(user_reject_rules, version)
+                if e is None:
+                    rr_write = ramcloud.RejectRules.exactly(version)
+                    writes.append((i, pack(txid, timeout, data), rr_write))
+                    continue
+            # The user asked for a reject
+            e.table = table_id
+            e.oid = key
+            raise e
+
+        writes = [w for w in writes if w[0] < wait]
+        requests = [objects[i] + (blob, rr_write)
+                    for (i, blob, rr_write) in writes]
+        try:
+            results = self._multi_raw(RAMCloud.multi_write, requests)
+        except:
+            self._unmask_objects([objects[i] for (i, b, r) in writes], txid)
+            raise
+        masked = []
+        for ((i, blob, rr_write), r) in zip(writes, results):
+            if isinstance(r, Exception):
+                # the object changed since it was read
+                wait = min(wait, i)
+            else:
+                masked.append((i, r))
+        late = []
+        for (i, version) in masked:
+            if i < wait:
+                masked_versions[objects[i]] = version
+            else:
+                late.append(objects[i])
+        self._unmask_objects(late, txid)
+        return objects[wait:]
+
     def _write_mt(self, mt, txid):
         """Write out the minitransaction intent to RAMCloud.
 
@@ -733,18 +1194,7 @@ class TxRAMCloud(RAMCloud):
             return
 
         # So, txid is indeed masking the object we read.
-
-        if type(op) == MTOperation:
-            # no op
-            # remove mask / delete seed
-            data = odata
-        elif type(op) == MTWrite:
-            data = op.data
-        elif type(op) == MTDelete:
-            data = None
-        else:
-            raise TxRAMCloud.InconsistencyError("Unknown type in MT: %s" %
-                                                type(op))
+        data = self._applied_data(op, odata)
 
         # Now, (data is None) determines whether we need to delete or update the
         # object at version.
@@ -766,17 +1216,78 @@ class TxRAMCloud(RAMCloud):
                 # we must be racing another client to clean this up
                 return
 
+    @staticmethod
+    def _applied_data(op, odata):
+        """Return an object's contents once an operation is applied to it.
+
+        @param op: the operation to apply
+        @type  op: L{MTOperation}
+
+        @param odata: the object's contents under the mask, or C{None} for a
+                      seed
+        @type  odata: C{str} or C{None}
+
+        @return: the new contents, or C{None} if the object is to be deleted
+        @rtype: C{str} or C{None}
+        """
+        if type(op) == MTOperation:
+            # no op
+            # remove mask / delete seed
+            return odata
+        elif type(op) == MTWrite:
+            return op.data
+        elif type(op) == MTDelete:
+            return None
+        else:
+            raise TxRAMCloud.InconsistencyError("Unknown type in MT: %s" %
+                                                type(op))
+
     def _apply_mt(self, mt, txid):
         """Apply the minitransaction's operations to its masked objects.
 
+        A write or delete whose masked version is recorded in the intent
+        (see L{MiniTransaction.masked_versions}) is applied with a single
+        conditional write or delete: an object is masked by C{txid} exactly
+        when it is still at that version. The other objects are read and
+        rewritten with one batch per table.
+
         @param mt: the minitransaction to apply
         @type  mt: L{MiniTransaction}
 
         @param txid: the transaction ID which masks the objects in the transaction
         @type  txid: C{int}
         """
+        masked_versions = mt.masked_versions or {}
+        writes = []
+        removes = []
+        unknown = []
         for ((table_id, key), op) in mt.items():
-            self._apply_op(table_id, key, txid, op)
+            version = masked_versions.get((table_id, key))
+            if version is None or type(op) == MTOperation:
+                # A no-op puts back what's under the mask, so it needs a read
+                unknown.append((table_id, key))
+                continue
+            update_rr = ramcloud.RejectRules.exactly(version)
+            data = self._applied_data(op, None)
+            if data is None:
+                removes.append((table_id, key, update_rr))
+            else:
+                writes.append((table_id, key, pack(0, 0, data), update_rr))
+
+        def apply(table_id, key, version, odata):
+            return (self._applied_data(mt[(table_id, key)], odata),
+                    ramcloud.RejectRules.exactly(version))
+        # An object whose change is rejected was already applied by a client
+        # racing us to clean it up, just as in _apply_op. One whose change
+        # failed is applied again on its own, so that the error is raised
+        # before the intent can be deleted.
+        rejected, failed = self._change_batch(writes, removes)
+        if unknown:
+            more_rejected, more_failed = self._replace_masked(unknown, txid,
+                                                              apply)
+            failed.extend(more_failed)
+        for (table_id, key) in failed:
+            self._apply_op(table_id, key, txid, mt[(table_id, key)])
 
     def _finish_mt(self, mt, txid, version):
         """Complete/clean up a minitransaction after the point of no return.
@@ -785,7 +1296,7 @@ class TxRAMCloud(RAMCloud):
         mt will not exist in the system.
 
         @param mt: the minitransaction to clean up
-        @type  mt: L{MiniTransaction}
+        @type  mt: L{MiniTransaction} or L{IntentView}
 
         @param txid: the transaction ID which masks the objects
         @type  txid: C{int}
@@ -797,6 +1308,72 @@ class TxRAMCloud(RAMCloud):
         self._apply_mt(mt, txid)
         self._delete_mt(txid, version)
 
+    def _commit_one(self, mt):
+        """Commit a minitransaction of one object without masking it.
+
+        The operation is done with a single conditional write or delete over
+        the version just read, which fails if the object has been masked
+        since.
+
+        @param mt: the prepared minitransaction, with one entry
+        @type  mt: L{MiniTransaction}
+
+        @raise TransactionRejected: See L{mt_commit}.
+
+        @return: See L{mt_commit}. An object with no operation keeps its
+                 version. C{None} if the object is masked, or if it doesn't
+                 exist and has no operation, and the minitransaction must go
+                 through the full protocol.
+        @rtype: C{dict} or C{None}
+        """
+        ((table_id, key), op), = mt.items()
+        user_reject_rules = op.reject_rules
+        rr_read = ramcloud.RejectRules(object_doesnt_exist=True)
+        for retry in RetryStrategy():
+            try:
+                blob, version = RAMCloud.read_rr(self, table_id, key, rr_read)
+            except ramcloud.NoObjectError, e:
+                if user_reject_rules.object_doesnt_exist:
+                    reject = e
+                elif type(op) == MTOperation:
+                    return None
+                else:
+                    reject = None
+                    version = None
+            else:
+                otxid, otimeout, data = unpack(blob)
+                if otxid:
+                    return None
+                reject = ramcloud.reject_error(user_reject_rules, version)
+            if reject is not None:
+                a = self.TransactionRejected()
+                a.reasons[(table_id, key)] = reject
+                raise a
+
+            if version is None:
+                rr_change = ramcloud.RejectRules(object_exists=True)
+            else:
+                rr_change = ramcloud.RejectRules.exactly(version)
+            try:
+                if type(op) == MTOperation:
+                    return {(table_id, key): version}
+                elif type(op) == MTWrite:
+                    blob = pack(0, 0, op.data)
+                    return {(table_id, key): RAMCloud.write_rr(self, table_id,
+                                                               key, blob,
+                                                               rr_change)}
+                elif type(op) == MTDelete:
+                    if version is not None:
+                        RAMCloud.delete_rr(self, table_id, key, rr_change)
+                    return {(table_id, key): None}
+                else:
+                    raise TxRAMCloud.InconsistencyError(
+                            "Unknown type in MT: %s" % type(op))
+            except (ramcloud.ObjectExistsError, ramcloud.NoObjectError,
+                    ramcloud.VersionError):
+                # the object changed since it was read
+                retry.later()
+
     def mt_commit(self, mt):
         """Execute and commit a prepared minitransaction.
 
@@ -808,15 +1385,30 @@ class TxRAMCloud(RAMCloud):
         @raise TransactionExpired: The minitransaction was aborted by another
         client.
 
+        @raise ValueError: The minitransaction includes an object in a plain
+        table (see L{set_plain_table}).
+
         @return: A mapping from (table_id, oid) to version numbers. There will
         be one entry for each object in the minitransaction:
          - Those objects that were deleted will have None as the verison number.
          - Those objects that were written will have their new version number.
          - Those objects that had no operation applied (unfortunately) also
            changed version numbers, and their new version is returned here.
+           The exception is a minitransaction of one object, which is usually
+           committed without masking it (see L{_commit_one}).
         @rtype: C{dict}
         """
 
+        for (table_id, key) in mt:
+            if table_id in self.plain_tables:
+                raise ValueError("Table %s is plain and can't take part in "
+                                 "a minitransaction" % table_id)
+
+        if len(mt) == 1:
+            versions = self._commit_one(mt)
+            if versions is not None:
+                return versions
+
         # reserve a new transaction ID. 0 is not valid.
         txid = 0
         while txid == 0:
@@ -834,20 +1426,19 @@ class TxRAMCloud(RAMCloud):
             raise a
         assert len(masked_versions) == len(objects)
 
-        # TODO: optimization: add masked_versions to mt intent, then use them in
-        # _unmask_objects and _finish_mt to save the RAMCloud.read_rr call in
-        # _unmask_object.
-
-        # write out minitransaction intent
+        # write out minitransaction intent, with the masked versions so that
+        # whoever finishes it can apply it without reading the objects back
+        intent = MiniTransaction(mt)
+        intent.masked_versions = masked_versions
         try:
-            version = self._write_mt(mt, txid)
+            version = self._write_mt(intent, txid)
         except:
             self._unmask_objects(objects, txid)
             self._delete_tombstone(txid)
             raise
 
         # no turning back now
-        self._finish_mt(mt, txid, version)
+        self._finish_mt(intent, txid, version)
 
         # Assume unmasked version is 1 greater than masked version,
         # unless the operation was a delete.
@@ -866,7 +1457,10 @@ class Tombstone(object):
 
 # struct
 class MiniTransaction(dict):
-    pass
+    # A mapping from (table_id, key) to the version number of the object with
+    # the mask added, set on intents written by TXRAMCLOUD_VERSION 2 and
+    # later. Older intents don't have it.
+    masked_versions = None
 
 # struct
 class MTOperation(object):
@@ -883,6 +1477,128 @@ class MTWrite(MTOperation):
 class MTDelete(MTOperation):
     pass
 
+class IntentView(object):
+    """A L{MiniTransaction} decoded lazily from the encoding of L{serialize}.
+
+    Only the header is read up front. Looking up an object's operation
+    binary searches the index and decodes just that operation, so
+    L{TxRAMCloud._apply_op} can be given one operation of a large intent
+    cheaply. The view supports the parts of the C{dict} interface that
+    L{TxRAMCloud._finish_mt} uses.
+    """
+
+    def __init__(self, blob):
+        """
+        @param blob: an encoded L{MiniTransaction}
+        @type  blob: C{str}
+
+        @raise ValueError: C{blob} isn't an encoded L{MiniTransaction}.
+        """
+        kind, self.flags, self.count = _intent_header(blob)
+        if kind != INTENT_MINITRANSACTION:
+            raise ValueError("Not a MiniTransaction")
+        if (IntentHeaderFmt.size + self.count * IntentEntryFmt.size >
+            len(blob)):
+            raise ValueError("Intent is truncated")
+        self.blob = blob
+
+    def _entry(self, i):
+        entry = IntentEntryFmt.unpack_from(self.blob, IntentHeaderFmt.size +
+                                                      i * IntentEntryFmt.size)
+        offset, length, key_length = entry[2:5]
+        if (offset + length > len(self.blob) or
+            key_length + RejectRulesFmt.size > length):
+            raise ValueError("Intent is corrupt")
+        return entry
+
+    def _sort_key(self, entry):
+        table_id, version, offset, length, key_length, op_type, key_type = entry
+        return (table_id, key_type, self.blob[offset:offset + key_length])
+
+    def _object(self, entry):
+        table_id, key_type, key = self._sort_key(entry)
+        if key_type == KEY_INT:
+            key = int(key)
+        return (table_id, key)
+
+    def _op(self, entry):
+        table_id, version, offset, length, key_length, op_type, key_type = entry
+        start = offset + key_length
+        (given_version, object_doesnt_exist, object_exists, version_eq_given,
+         version_gt_given) = RejectRulesFmt.unpack_from(self.blob, start)
+        rr = ramcloud.RejectRules(given_version=given_version,
+                                  object_doesnt_exist=object_doesnt_exist,
+                                  object_exists=object_exists,
+                                  version_eq_given=version_eq_given,
+                                  version_gt_given=version_gt_given)
+        if op_type == OP_NONE:
+            return MTOperation(rr)
+        elif op_type == OP_WRITE:
+            return MTWrite(self.blob[start + RejectRulesFmt.size:
+                                     offset + length], rr)
+        elif op_type == OP_DELETE:
+            return MTDelete(rr)
+        raise ValueError("Unknown operation type: %d" % op_type)
+
+    def _find(self, obj):
+        table_id, key = obj
+        target = (table_id,) + _encode_key(key)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._sort_key(self._entry(mid)) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            entry = self._entry(lo)
+            if self._sort_key(entry) == target:
+                return entry
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, obj):
+        return self._find(obj) is not None
+
+    def __getitem__(self, obj):
+        entry = self._find(obj)
+        if entry is None:
+            raise KeyError(obj)
+        return self._op(entry)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [self._object(self._entry(i)) for i in xrange(self.count)]
+
+    def items(self):
+        return [(self._object(entry), self._op(entry))
+                for entry in (self._entry(i) for i in xrange(self.count))]
+
+    @property
+    def masked_versions(self):
+        """See L{MiniTransaction.masked_versions}."""
+        if not self.flags & INTENT_MASKED_VERSIONS:
+            return None
+        masked_versions = {}
+        for i in xrange(self.count):
+            entry = self._entry(i)
+            if entry[1]:
+                masked_versions[self._object(entry)] = entry[1]
+        return masked_versions
+
+    def decode(self):
+        """Decode the whole intent.
+
+        @rtype: L{MiniTransaction}
+        """
+        mt = MiniTransaction(self.items())
+        mt.masked_versions = self.masked_versions
+        return mt
+
 def main():
     global r
     r = TxRAMCloud(7)
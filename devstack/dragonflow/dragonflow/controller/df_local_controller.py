@@ -43,7 +43,7 @@ eventlet.monkey_patch()
 
 class DfLocalController(object):
 
-    def __init__(self, chassis_name, ip, remote_db_ip):
+    def __init__(self, chassis_name, ip, remote_db_ip, compressed_tables=()):
         self.l3_app = None
         self.l2_app = None
         self.open_flow_app = None
@@ -54,10 +54,13 @@ class DfLocalController(object):
         self.chassis_name = chassis_name
         self.ip = ip
         self.remote_db_ip = remote_db_ip
+        self.compressed_tables = compressed_tables
 
     def run(self):
         #self.nb_api = ovsdb_nb_impl.OvsdbNbApi(self.remote_db_ip)
-        self.nb_api = ramcloud_nb_impl.RamcloudNbApi(db_ip=self.remote_db_ip)
+        self.nb_api = ramcloud_nb_impl.RamcloudNbApi(
+            db_ip=self.remote_db_ip,
+            compressed_tables=self.compressed_tables)
         self.nb_api.initialize()
         self.vswitch_api = ovsdb_vswitch_impl.OvsdbSwitchApi(self.ip)
         self.vswitch_api.initialize()
@@ -198,11 +201,12 @@ class DfLocalController(object):
             self.vswitch_api.delete_port(port)
 
     def port_mappings(self):
-        ports_to_remove = self.db_store.get_port_keys()
-        for lport in self.nb_api.get_all_logical_ports():
+        # Updating known ports isn't supported yet, so only the ports added
+        # since the last poll are fetched.
+        new_ports, ports_to_remove = self.nb_api.diff_logical_ports(
+            self.db_store.get_port_keys())
+        for lport in self.nb_api.get_logical_ports(new_ports):
             self.logical_port_updated(lport)
-            if lport.get_id() in ports_to_remove:
-                ports_to_remove.remove(lport.get_id())
 
         # TODO(gsagie) use port dictionary in all methods in l2 app
         # and here instead of always moving all arguments
@@ -262,12 +266,15 @@ class DfLocalController(object):
 
 # Run this application like this:
 # python df_local_controller.py <chassis_unique_name>
-# <local ip address> <southbound_db_ip_address>
+# <local ip address> <southbound_db_ip_address> [<compressed,tables>]
 def main():
     chassis_name = socket.gethostname()
     ip = sys.argv[1]  # local ip '10.100.100.4'
     remote_db_ip = sys.argv[2]  # remote SB DB IP '10.100.100.4'
-    controller = DfLocalController(chassis_name, ip, remote_db_ip)
+    # the NB tables the plugin's db_compressed_tables names, e.g. 'lrouter'
+    compressed_tables = sys.argv[3].split(',') if len(sys.argv) > 3 else ()
+    controller = DfLocalController(chassis_name, ip, remote_db_ip,
+                                   compressed_tables)
     controller.run()
 
 if __name__ == "__main__":
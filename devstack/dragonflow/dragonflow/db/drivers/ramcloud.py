@@ -16,10 +16,19 @@
 # somewhere in a system library path and have run /sbin/ldconfig since
 # installing it
 
+from __future__ import with_statement
+
+import collections
+import contextlib
 import ctypes
-from ctypes.util import find_library
 import itertools
 import os
+import Queue
+import random
+import struct
+import threading
+import time
+import zlib
 
 class RejectRules(ctypes.Structure):
     _fields_ = [("given_version", ctypes.c_uint64),
@@ -46,7 +55,11 @@ class RejectRules(ctypes.Structure):
                            given_version=want_version)
 
 
-def load_so():
+def find_so():
+    """Load libramcloud.so without declaring any of its prototypes.
+
+    Looks in C{LD_LIBRARY_PATH} first, then asks C{find_library}.
+    """
     not_found = ImportError("Couldn't find libramcloud.so, ensure it is " +
                             "installed and that you have registered it with " +
                             "/sbin/ldconfig")
@@ -65,22 +78,25 @@ def load_so():
 
     # couldn't find the so in LD_LIBRARY_PATH, so try the usual approach
     if not path:
+        # ctypes.util is slow to import, and usually isn't needed
+        from ctypes.util import find_library
         path = find_library('ramcloud')
 
     if not path:
         raise not_found
     try:
-        so = ctypes.cdll.LoadLibrary(path)
+        return ctypes.cdll.LoadLibrary(path)
     except OSError, e:
         if 'No such file or directory' in str(e):
             raise not_found
         else:
             raise
 
-    def malloc_errcheck(result, func, arguments):
-        if result == 0:
-            raise MemoryError()
-        return result
+def prototypes():
+    """Return the C{(argtypes, restype)} of each libramcloud function.
+
+    @rtype: C{dict}
+    """
 
     # ctypes.c_bool was introduced in Python 2.6
     if not hasattr(ctypes, 'c_bool'):
@@ -125,74 +141,146 @@ def load_so():
     version             = ctypes.c_uint64
     serverId            = ctypes.c_uint64
 
-    so.rc_connect.argtypes = [address, address, POINTER(client)]
-    so.rc_connect.restype  = status
-
-    so.rc_disconnect.argtypes = [client]
-    so.rc_disconnect.restype  = None
-
-    so.rc_createTable.argtypes = [client, name]
-    so.rc_createTable.restype  = status
-
-    so.rc_dropTable.argtypes = [client, name]
-    so.rc_dropTable.restype  = status
-
-    so.rc_getStatus.argtypes = []
-    so.rc_getStatus.restype  = status
-
-    so.rc_getTableId.argtypes = [client, name, POINTER(table)]
-    so.rc_getTableId.restype  = status
-
-    so.rc_enumerateTablePrepare.argtypes = [client, table, keysOnly, POINTER(enumerationState)]
-    so.rc_enumerateTablePrepare.restype = None
-
-    so.rc_enumerateTableNext.argtypes = [client, enumerationState, POINTER(keyLen),
-                                         POINTER(enum_key), POINTER(dataLength), POINTER(data)]
-    so.rc_enumerateTableNextrestype  = status
-
-    so.rc_enumerateTableFinalize.argtypes = [enumerationState]
-    so.rc_enumerateTableFinalize.restype = None
-
-    so.rc_read.argtypes = [client, table, key, keyLength, rejectRules, POINTER(version),
-                           buf, len, POINTER(len)]
-    so.rc_read.restype  = status
 
-    so.rc_remove.argtypes = [client, table, key, keyLength, rejectRules,
-                             POINTER(version)]
-    so.rc_remove.restype  = status
-
-    so.rc_write.argtypes = [client, table, key, keyLength, buf, len, rejectRules,
-                            POINTER(version)]
-    so.rc_write.restype  = status
-
-    so.rc_testing_kill.argtypes = [client, table, key, keyLength]
-    so.rc_testing_kill.restype  = status
-
-    so.rc_testing_fill.argtypes = [client, table, key, keyLength,
-                                   ctypes.c_uint32, ctypes.c_uint32]
-    so.rc_testing_fill.restype  = status
-
-    so.rc_testing_get_server_id.argtypes = [client, table, key, keyLength,
-                                            POINTER(serverId)]
-    so.rc_testing_get_server_id.restype  = status
-
-    so.rc_testing_get_service_locator.argtypes = [client, table, key, keyLength,
-                                                  serviceLocator, ctypes.c_size_t]
-    so.rc_testing_get_service_locator.restype  = status
-
-    so.rc_set_runtime_option.argtypes = [client,
-                                                 ctypes.c_char_p,
-                                                 ctypes.c_char_p]
-    so.rc_set_runtime_option.restype = status
-
-    so.rc_testing_wait_for_all_tablets_normal.argtypes = [client, nanoseconds]
-    so.rc_testing_wait_for_all_tablets_normal.restype = None
-
-    so.rc_set_log_file.argtypes = [ctypes.c_char_p]
-    so.rc_set_log_file.restype = None
+    multiOpType         = ctypes.c_int
+    multiOpObject       = ctypes.c_void_p
+
+    return {
+        'rc_connect': ([address, address, POINTER(client)], status),
+        'rc_disconnect': ([client], None),
+        'rc_createTable': ([client, name], status),
+        'rc_dropTable': ([client, name], status),
+        'rc_getStatus': ([], status),
+        'rc_getTableId': ([client, name, POINTER(table)], status),
+
+        'rc_enumerateTablePrepare': ([client, table, keysOnly,
+                                      POINTER(enumerationState)], None),
+        'rc_enumerateTableNext': ([client, enumerationState, POINTER(keyLen),
+                                   POINTER(enum_key), POINTER(dataLength),
+                                   POINTER(data)], status),
+        'rc_enumerateTableFinalize': ([enumerationState], None),
+
+        'rc_read': ([client, table, key, keyLength, rejectRules,
+                     POINTER(version), buf, len, POINTER(len)], status),
+        'rc_remove': ([client, table, key, keyLength, rejectRules,
+                       POINTER(version)], status),
+        'rc_write': ([client, table, key, keyLength, buf, len, rejectRules,
+                      POINTER(version)], status),
+
+        'rc_testing_kill': ([client, table, key, keyLength], status),
+        'rc_testing_fill': ([client, table, key, keyLength,
+                             ctypes.c_uint32, ctypes.c_uint32], status),
+        'rc_testing_get_server_id': ([client, table, key, keyLength,
+                                      POINTER(serverId)], status),
+        'rc_testing_get_service_locator': ([client, table, key, keyLength,
+                                            serviceLocator, ctypes.c_size_t],
+                                           status),
+        'rc_set_runtime_option': ([client, ctypes.c_char_p, ctypes.c_char_p],
+                                  status),
+        'rc_testing_wait_for_all_tablets_normal': ([client, nanoseconds],
+                                                   None),
+        'rc_set_log_file': ([ctypes.c_char_p], None),
+
+        # only exported by newer builds of the library
+        'rc_incrementInt64': ([client, table, key, keyLength, ctypes.c_int64,
+                               rejectRules, POINTER(version),
+                               POINTER(ctypes.c_int64)], status),
+
+        # Batched operations are only exported by newer builds of the
+        # library. The multi-op objects are opaque C++ objects that the
+        # library constructs in memory we allocate, rc_multiOpSizeOf bytes
+        # apiece.
+        'rc_multiOpSizeOf': ([multiOpType], ctypes.c_uint32),
+        'rc_multiReadCreate': ([table, key, keyLength, buf, len, POINTER(len),
+                                multiOpObject], None),
+        'rc_multiRemoveCreate': ([table, key, keyLength, rejectRules,
+                                  multiOpObject], None),
+        'rc_multiWriteCreate': ([table, key, keyLength, buf, len, rejectRules,
+                                 multiOpObject], None),
+        'rc_multiOpStatus': ([multiOpObject, multiOpType], status),
+        'rc_multiOpVersion': ([multiOpObject, multiOpType], version),
+        'rc_multiOpDestroy': ([multiOpObject, multiOpType], None),
+        'rc_multiRead': ([client, POINTER(multiOpObject), ctypes.c_uint32],
+                         None),
+        'rc_multiRemove': ([client, POINTER(multiOpObject), ctypes.c_uint32],
+                           None),
+        'rc_multiWrite': ([client, POINTER(multiOpObject), ctypes.c_uint32],
+                          None),
+    }
 
+def load_so():
+    """Load libramcloud.so and declare all of its prototypes up front.
+
+    The module itself binds the library lazily, see L{LazyLibrary}.
+    """
+    so = find_so()
+    for name, (argtypes, restype) in prototypes().iteritems():
+        try:
+            function = getattr(so, name)
+        except AttributeError:
+            # e.g. the multi-ops, which older builds don't export
+            continue
+        function.argtypes = argtypes
+        function.restype = restype
     return so
 
+class LazyLibrary(object):
+    """Stands in for a library, libramcloud.so by default, until one of its
+    functions is needed.
+
+    Importing this module used to search for and load the library and declare
+    every prototype, which costs more than most short-lived users of the
+    module (command line tools, plugins that never issue an RPC) ever save.
+    Instead, the library is loaded on the first attribute lookup, and each
+    function's prototype is declared the first time that function is looked
+    up. A missing function raises C{AttributeError}, so C{hasattr} works as it
+    does on the library itself, and is remembered so that probing for it again
+    is cheap.
+    """
+
+    def __init__(self, loader=find_so, prototypes=prototypes):
+        """
+        @param loader: loads the library, without declaring prototypes
+        @type  loader: callable
+
+        @param prototypes: returns the prototypes to declare, like
+                           L{prototypes} does for libramcloud.so
+        @type  prototypes: callable
+        """
+        self._loader = loader
+        self._declare = prototypes
+        self._lib = None
+        self._prototypes = None
+        self._missing = frozenset()
+        self._lock = threading.Lock()
+
+    def loaded(self):
+        """Return whether the library has been loaded yet."""
+        return self._lib is not None
+
+    def __getattr__(self, name):
+        # only called for functions we haven't bound yet
+        if name.startswith('_') or name in self._missing:
+            raise AttributeError(name)
+        with self._lock:
+            if self._lib is None:
+                self._lib = self._loader()
+                self._prototypes = self._declare()
+            try:
+                function = getattr(self._lib, name)
+            except AttributeError:
+                self._missing = self._missing | frozenset([name])
+                raise
+            if name in self._prototypes:
+                function.argtypes, function.restype = self._prototypes[name]
+            self.__dict__[name] = function
+            return function
+
+# multi-op object types, see rc_multiOpSizeOf
+MULTI_OP_READ = 0
+MULTI_OP_REMOVE = 1
+MULTI_OP_WRITE = 2
+
 def _ctype_copy(addr, var, width):
     ctypes.memmove(addr, ctypes.addressof(var), width)
     return addr + width
@@ -209,12 +297,156 @@ def get_keyLength(id):
 #    else:
 #        return len(id)
 
+class _Py_buffer(ctypes.Structure):
+    # Python 2.7's Py_buffer, for getting at the bytes of a memoryview
+    _fields_ = [('buf', ctypes.c_void_p),
+                ('obj', ctypes.c_void_p),
+                ('len', ctypes.c_ssize_t),
+                ('itemsize', ctypes.c_ssize_t),
+                ('readonly', ctypes.c_int),
+                ('ndim', ctypes.c_int),
+                ('format', ctypes.c_char_p),
+                ('shape', ctypes.c_void_p),
+                ('strides', ctypes.c_void_p),
+                ('suboffsets', ctypes.c_void_p),
+                ('smalltable', ctypes.c_ssize_t * 2),
+                ('internal', ctypes.c_void_p)]
+
+def _python_prototypes():
+    # the parts of the Python C API that data_arg uses
+    return {
+        'PyObject_AsReadBuffer': ([ctypes.py_object,
+                                   ctypes.POINTER(ctypes.c_void_p),
+                                   ctypes.POINTER(ctypes.c_ssize_t)],
+                                  ctypes.c_int),
+        'PyObject_GetBuffer': ([ctypes.py_object, ctypes.POINTER(_Py_buffer),
+                                ctypes.c_int], ctypes.c_int),
+        'PyBuffer_Release': ([ctypes.POINTER(_Py_buffer)], None),
+    }
+
+# A handle of our own rather than ctypes.pythonapi, whose functions other
+# modules may declare differently. Like so, it is bound on first use.
+_pythonapi = LazyLibrary(lambda: ctypes.PyDLL(None), _python_prototypes)
+
+def data_arg(data):
+    """Return the bytes of a value as an argument for the library, and how
+    many there are, without copying them.
+
+    C{data} may be a C{str} or any object that exposes its bytes through
+    the buffer protocol, such as a C{bytearray}, C{buffer}, C{mmap} or
+    contiguous C{memoryview}. The argument points into C{data}, so keep
+    C{data} alive and unchanged until the library is done with it.
+
+    @rtype: (C{str} or C{ctypes} array, C{int})
+    """
+    if type(data) is str:
+        return (data, len(data))
+    if isinstance(data, unicode):
+        raise TypeError("values must be bytes, not unicode")
+    address = ctypes.c_void_p()
+    length = ctypes.c_ssize_t()
+    if isinstance(data, memoryview):
+        view = _Py_buffer()
+        # PyBUF_SIMPLE: fails unless the view is contiguous
+        _pythonapi.PyObject_GetBuffer(data, ctypes.byref(view), 0)
+        # the memoryview keeps the memory pinned once this is released
+        address.value, length.value = view.buf, view.len
+        _pythonapi.PyBuffer_Release(ctypes.byref(view))
+    else:
+        _pythonapi.PyObject_AsReadBuffer(data, ctypes.byref(address),
+                                         ctypes.byref(length))
+    if length.value == 0:
+        return ('', 0)
+    return ((ctypes.c_char * length.value).from_address(address.value),
+            length.value)
+
+def data_str(data):
+    """Return the bytes of a value as a C{str}, copying them unless C{data}
+    already is one. See L{data_arg}."""
+    if type(data) is str:
+        return data
+    arg, length = data_arg(data)
+    return ctypes.string_at(arg, length)
+
+def data_slice(data, offset, size):
+    """Return part of a value without copying it. See L{data_arg}."""
+    if isinstance(data, memoryview):
+        return data[offset:offset + size]
+    return buffer(data, offset, size)
+
+def has_multi_ops():
+    """Return whether the library implements batched operations natively."""
+    return hasattr(so, 'rc_multiRead')
+
+def has_increment():
+    """Return whether the library can increment counters on the server."""
+    return hasattr(so, 'rc_incrementInt64')
+
+def pack_counter(value):
+    """Serialize a counter for L{RAMCloud.increment}: a little-endian, signed
+    64-bit integer, the format the server increments."""
+    return struct.pack('<q', value)
+
+def unpack_counter(blob):
+    """Unserialize a counter written by L{pack_counter}."""
+    if len(blob) != 8:
+        raise ValueError("not a 64-bit counter: %r" % blob[:16])
+    return struct.unpack('<q', blob)[0]
+
+# Values larger than this are split into chunks by RAMCloud.write_chunked.
+# The server won't store objects much over 1 MiB.
+CHUNK_SIZE = 512 * 1024
+
+CHUNK_MANIFEST_HEADER = 'rcchunk\0'
+_CHUNK_MANIFEST = struct.Struct('<QIQ')
+
+def pack_manifest(generation, count, length):
+    """Serialize the manifest of a value split by L{RAMCloud.write_chunked}."""
+    return CHUNK_MANIFEST_HEADER + _CHUNK_MANIFEST.pack(generation, count,
+                                                        length)
+
+def unpack_manifest(blob):
+    """Return the (generation, count, length) of a manifest, or C{None} if
+    C{blob} is an ordinary value."""
+    if (len(blob) != len(CHUNK_MANIFEST_HEADER) + _CHUNK_MANIFEST.size or
+        not blob.startswith(CHUNK_MANIFEST_HEADER)):
+        return None
+    return _CHUNK_MANIFEST.unpack_from(blob, len(CHUNK_MANIFEST_HEADER))
+
+def chunk_key(key, generation, i):
+    """Return the key of chunk C{i} of a chunked value."""
+    return '%s\0chunk\0%x\0%d' % (key, generation, i)
+
+def is_chunk_key(key):
+    """Return whether an enumerated key belongs to a chunk, rather than to a
+    value of its own."""
+    return '\0chunk\0' in key
+
+def reject_error(reject_rules, version):
+    """Apply reject rules to an object that exists at C{version}.
+
+    The native multi-read doesn't take reject rules, so they are checked here
+    the same way the server would.
+
+    @return: the exception the server would have returned, or C{None}
+    """
+    if reject_rules.object_exists:
+        return ObjectExistsError()
+    if reject_rules.version_eq_given and version == reject_rules.given_version:
+        return VersionError(reject_rules.given_version, version)
+    if reject_rules.version_gt_given and version > reject_rules.given_version:
+        return VersionError(reject_rules.given_version, version)
+    return None
+
 class RCException(Exception):
     def __init__(self, status):
         Exception.__init__(self, 'RAMCloud error ' + str(status))
         self.status = status
     pass
 
+class TableDoesntExistError(RCException):
+    pass
+
 class NoObjectError(Exception):
     pass
 
@@ -228,67 +460,719 @@ class VersionError(Exception):
         self.want_version = want_version
         self.got_version = got_version
 
+# the status code for an unknown table
+STATUS_TABLE_DOESNT_EXIST = 1
+
+# the cluster that clients connect to by default
+DEFAULT_LOCATOR = 'fast+udp:host=127.0.0.1,port=12246'
+
+# the table that RAMCloud.check looks up; it needn't exist
+CHECK_TABLE = '__ramcloud_check'
+
+# errors that concern a single object of a batched operation
+OBJECT_ERRORS = (RCException, NoObjectError, ObjectExistsError, VersionError)
+
+class LRUCache(object):
+    """A mapping that holds on to its C{size} most recently used items."""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def put(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def discard(self, key):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+class StrKeyCodec(object):
+    """Encodes integer ids as decimal strings. This is the default codec.
+
+    A key codec turns the ids passed to L{RAMCloud} methods into the key
+    strings sent to the server. String ids are always used as they are, by
+    every codec.
+    """
+
+    def encode(self, id):
+        if isinstance(id, (int, long)):
+            return str(id)
+        return id
+
+class IntKeyCodec(object):
+    """Encodes integer ids as fixed-width big-endian unsigned integers.
+
+    The keys sort in the same order as the ids, and are shorter than decimal
+    strings for large ids.
+    """
+
+    formats = {1: '>B', 2: '>H', 4: '>I', 8: '>Q'}
+
+    def __init__(self, width=8):
+        """
+        @param width: the key length in bytes: 1, 2, 4 or 8
+        @type  width: C{int}
+        """
+        self._struct = struct.Struct(self.formats[width])
+
+    def encode(self, id):
+        if isinstance(id, (int, long)):
+            return self._struct.pack(id)
+        return id
+
+class TupleKeyCodec(object):
+    """Encodes tuples of integers and strings, for composite keys.
+
+    Each integer becomes C{'i'} and 8 big-endian bytes, and each string
+    becomes C{'s'}, a 2-byte big-endian length, and the string. Ids that
+    aren't tuples are left to C{base}.
+    """
+
+    def __init__(self, base=None):
+        """
+        @param base: the codec for ids that aren't tuples, L{StrKeyCodec}
+                     by default
+        """
+        if base is None:
+            base = StrKeyCodec()
+        self.base = base
+
+    def encode(self, id):
+        if not isinstance(id, tuple):
+            return self.base.encode(id)
+        parts = []
+        for part in id:
+            if isinstance(part, (int, long)):
+                parts.append('i' + struct.pack('>Q', part))
+            elif isinstance(part, str):
+                parts.append('s' + struct.pack('>H', len(part)) + part)
+            else:
+                raise TypeError("can't encode %r in a key" % (part,))
+        return ''.join(parts)
+
+# The first byte of a value stored by ZlibValueCodec says how it was stored.
+VALUE_RAW = '\x00'
+VALUE_ZLIB = '\x01'
+VALUE_ZLIB_DICT = '\x02'
+_VALUE_TAGS = (VALUE_RAW, VALUE_ZLIB, VALUE_ZLIB_DICT)
+
+# The most history a deflate stream can refer back to.
+_ZLIB_WINDOW = 32 * 1024
+
+class ZlibValueCodec(object):
+    """Compresses values with zlib, for tables of verbose, repetitive data
+    such as JSON.
+
+    Values of at least C{threshold} bytes are compressed, unless that
+    doesn't make them any smaller, and then start with a one-byte tag:
+    L{VALUE_ZLIB}, or L{VALUE_ZLIB_DICT} and the Adler-32 of the preset
+    dictionary. Other values are stored as they are, except that one that
+    happens to start with a tag byte gets a L{VALUE_RAW} tag in front. So
+    compressed and uncompressed values can share a table, and a table of
+    values written without the codec stays readable through it, as long as
+    none of them start with a tag byte.
+
+    A preset dictionary, such as one from L{train_dictionary}, holds
+    strings that are common across values, so that even short values
+    compress well. Decoding a value with a different dictionary than it was
+    compressed with raises C{ValueError}.
+    """
+
+    def __init__(self, threshold=128, level=6, dictionary=None):
+        """
+        @param threshold: the size in bytes from which values are compressed
+        @type  threshold: C{int}
+
+        @param level: the zlib compression level, from 1 (fastest) to 9
+        @type  level: C{int}
+
+        @param dictionary: a preset dictionary, of which only the last 32 KiB
+                           count, or C{None}
+        @type  dictionary: C{str}
+        """
+        self.threshold = threshold
+        self.level = level
+        self.dictionary = dictionary
+        self._dict_tag = None
+        self._compressor = None
+        self._decompressor = None
+        if dictionary:
+            dictionary = dictionary[-_ZLIB_WINDOW:]
+            self._dict_tag = VALUE_ZLIB_DICT + struct.pack(
+                '>I', zlib.adler32(dictionary) & 0xffffffff)
+            # Python 2's zlib can't set a preset dictionary, so prime raw
+            # deflate streams with it instead: both ends then see it as
+            # earlier data to refer back to. Each value is coded with a copy
+            # of the primed stream.
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                                -zlib.MAX_WBITS)
+            primer = (self._compressor.compress(dictionary) +
+                      self._compressor.flush(zlib.Z_SYNC_FLUSH))
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            self._decompressor.decompress(primer)
+
+    def encode(self, data):
+        if len(data) >= self.threshold:
+            if self._compressor is None:
+                packed = VALUE_ZLIB + zlib.compress(data, self.level)
+            else:
+                compressor = self._compressor.copy()
+                packed = (self._dict_tag + compressor.compress(data) +
+                          compressor.flush())
+            if len(packed) < len(data):
+                return packed
+        if data[:1] in _VALUE_TAGS:
+            return VALUE_RAW + data
+        return data
+
+    def decode(self, blob):
+        tag = blob[:1]
+        if tag == VALUE_ZLIB:
+            return zlib.decompress(blob[1:])
+        if tag == VALUE_ZLIB_DICT:
+            if blob[:5] != self._dict_tag:
+                raise ValueError("value was compressed with another "
+                                 "dictionary")
+            decompressor = self._decompressor.copy()
+            return decompressor.decompress(blob[5:]) + decompressor.flush()
+        if tag == VALUE_RAW:
+            return blob[1:]
+        return blob
+
+def train_dictionary(samples, size=16 * 1024, segment=64, n=8):
+    """Build a preset dictionary for L{ZlibValueCodec} from sample values.
+
+    The samples are cut into segments, and each segment is scored by how
+    many samples share its C{n}-byte substrings. The best segments, skipping
+    substrings already covered, make up the dictionary, with the best last,
+    where they are cheapest to refer back to.
+
+    @param samples: values typical of what will be stored
+    @type  samples: iterable of C{str}
+
+    @param size: the most bytes the dictionary may have
+    @type  size: C{int}
+
+    @rtype: C{str}
+    """
+    samples = list(samples)
+    counts = collections.defaultdict(int)
+    for sample in samples:
+        for gram in set(sample[i:i + n]
+                        for i in xrange(max(len(sample) - n + 1, 0))):
+            counts[gram] += 1
+    def grams(s):
+        return [s[i:i + n] for i in xrange(max(len(s) - n + 1, 0))]
+    def score(s, covered=()):
+        return sum(counts[g] for g in grams(s)
+                   if counts[g] > 1 and g not in covered)
+    candidates = []
+    for sample in samples:
+        for i in xrange(0, len(sample), segment):
+            s = sample[i:i + segment]
+            candidates.append((score(s), s))
+    candidates.sort(reverse=True)
+    chosen = []
+    covered = set()
+    total = 0
+    for (best, s) in candidates:
+        if best == 0 or total + len(s) > size:
+            break
+        if score(s, covered) * 2 < best:
+            continue
+        chosen.append(s)
+        covered.update(grams(s))
+        total += len(s)
+    chosen.reverse()
+    return ''.join(chosen)
+
+class LatencyHistogram(object):
+    """Counts latencies in power-of-two buckets, using fixed memory.
+
+    Bucket 0 counts latencies under 1 microsecond and bucket i counts those
+    from 2**(i-1) up to 2**i microseconds. The last bucket also counts
+    everything slower.
+    """
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        micros = int(seconds * 1000000)
+        self.counts[min(micros.bit_length(), self.BUCKETS - 1)] += 1
+        self.total += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Return an upper bound in seconds on the C{p}th percentile."""
+        if self.total == 0:
+            return 0.0
+        rank = p / 100.0 * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(2 ** i / 1000000.0, self.max)
+        return self.max
+
+    def snapshot(self):
+        if self.total:
+            mean = self.sum / self.total
+        else:
+            mean = 0.0
+        return {'buckets': list(self.counts),
+                'mean': mean,
+                'max': self.max,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99)}
+
+class OpStats(object):
+    """Counters for one kind of operation. See L{Stats}."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = LatencyHistogram()
+
+    def snapshot(self):
+        return {'count': self.count,
+                'errors': dict(self.errors),
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'latency': self.latency.snapshot()}
+
+class Stats(object):
+    """Per-operation call counts, errors, bytes and latencies of a client.
+
+    Operations are named C{'read'}, C{'write'}, C{'remove'},
+    C{'enumerate'}, C{'get_table_id'} and C{'multi_read'},
+    C{'multi_write'}, C{'multi_remove'}; the last three count one call per
+    batch. Errors are counted by status code.
+    Bytes in are object data received, bytes out object data sent, and
+    latencies are in seconds.
+
+    One instance may be shared by several clients, as L{RAMCloudPool} does,
+    so every method is thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    def record(self, op, seconds, status=0, bytes_in=0, bytes_out=0):
+        with self._lock:
+            stats = self._ops.get(op)
+            if stats is None:
+                stats = self._ops[op] = OpStats()
+            stats.count += 1
+            if status != 0:
+                stats.errors[status] = stats.errors.get(status, 0) + 1
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            stats.latency.add(seconds)
+
+    def snapshot(self):
+        """Return a copy of the counters, as a dict keyed by operation."""
+        with self._lock:
+            return dict((op, stats.snapshot())
+                        for (op, stats) in self._ops.items())
+
+    def reset(self):
+        with self._lock:
+            self._ops.clear()
+
+class TableIdCache(object):
+    """Maps table names to table ids, counting hits and misses.
+
+    One cache may be shared by several clients, as L{RAMCloudPool} does, so
+    every method is thread-safe.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name):
+        """Return the cached id of table C{name}, or C{None}."""
+        with self._lock:
+            table_id = self._ids.get(name)
+            if table_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return table_id
+
+    def put(self, name, table_id):
+        with self._lock:
+            self._ids[name] = table_id
+
+    def discard(self, name):
+        with self._lock:
+            self._ids.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+class ReadCache(object):
+    """Remembers the values and versions of objects read through
+    L{RAMCloud.read_cached}.
+
+    Holds at most C{max_entries} objects and C{max_bytes} bytes of values,
+    dropping the least recently used first. Like L{TableIdCache}, one cache may
+    be shared by several clients, so every method is thread-safe.
+
+    @ivar fresh: reads answered from the cache after the server confirmed the
+                 version, with no value transferred
+    @ivar changed: reads of cached objects whose version had moved on
+    @ivar misses: reads of objects that weren't cached
+    """
+
+    def __init__(self, max_entries=4096, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.fresh = 0
+        self.changed = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, table_id, key):
+        """Return the cached (value, version) of an object, or C{None}."""
+        with self._lock:
+            try:
+                entry = self._items.pop((table_id, key))
+            except KeyError:
+                return None
+            self._items[(table_id, key)] = entry
+            return entry
+
+    def put(self, table_id, key, value, version):
+        with self._lock:
+            self._discard((table_id, key))
+            if len(value) > self.max_bytes:
+                return
+            self._items[(table_id, key)] = (value, version)
+            self.bytes += len(value)
+            while (len(self._items) > self.max_entries or
+                   self.bytes > self.max_bytes):
+                (k, (v, version)) = self._items.popitem(last=False)
+                self.bytes -= len(v)
+
+    def count(self, outcome):
+        """Add one to C{fresh}, C{changed} or C{misses}."""
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def _discard(self, k):
+        entry = self._items.pop(k, None)
+        if entry is not None:
+            self.bytes -= len(entry[0])
+
+    def discard(self, table_id, key):
+        with self._lock:
+            self._discard((table_id, key))
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+class BufferPool(object):
+    """Reusable read buffers for a single L{RAMCloud} client.
+
+    Buffers start out at C{initial_size} bytes and are replaced by larger ones
+    whenever an object doesn't fit, so a client that only reads small objects
+    never allocates more than a few KiB. Buffers larger than C{max_size} are
+    used for the read that needed them but are not kept around afterwards.
+    """
+
+    def __init__(self, initial_size=4096, max_size=1024 * 1024 * 2,
+                 max_free=4):
+        self.initial_size = initial_size
+        self.max_size = max_size
+        self.max_free = max_free
+        self._free = []
+
+    def get(self):
+        """Return a free buffer, allocating one if necessary."""
+        try:
+            return self._free.pop()
+        except IndexError:
+            return ctypes.create_string_buffer(self.initial_size)
+
+    def grow(self, buf, length):
+        """Return a buffer of at least C{length} bytes in place of C{buf}."""
+        size = len(buf)
+        while size < length:
+            size *= 2
+        return ctypes.create_string_buffer(size)
+
+    def put(self, buf):
+        """Return C{buf} to the pool."""
+        if len(buf) <= self.max_size and len(self._free) < self.max_free:
+            self._free.append(buf)
+
 class RAMCloud(object):
     def __init__(self):
-        self.client = ctypes.c_void_p()
+        self._client = ctypes.c_void_p()
+        self._pending_connect = None
         self.hook = lambda: None
+        self.buffers = BufferPool()
+        self.table_ids = TableIdCache()
+        self.key_codec = StrKeyCodec()
+        self.op_stats = Stats()
+        self.read_cache = None
+        self.value_codec = None
+        self.value_codecs = {}
 
     def __del__(self):
-        if self.client.value != None:
-            so.rc_disconnect(self.client)
+        if self._client.value != None:
+            so.rc_disconnect(self._client)
+
+    @property
+    def client(self):
+        """The native client handle, connecting first if that was deferred."""
+        if self._pending_connect is not None:
+            self._connect_now()
+        return self._client
+
+    def _connect_now(self):
+        serverLocator, clusterName = self._pending_connect
+        s = so.rc_connect(serverLocator, clusterName,
+                          ctypes.byref(self._client))
+        self.handle_error(s)
+        # only once it worked, so a failed connect is retried by the next RPC
+        self._pending_connect = None
+
+    def connected(self):
+        """Return whether this client has connected to the cluster."""
+        return self._client.value is not None
 
-    def handle_error(self, status, actual_version=0,given_version=0):
+    def status_error(self, status, actual_version=0, given_version=0):
+        """Return the exception for a status code, or C{None} for success."""
         if status == 0:
-            return
+            return None
+        if status == STATUS_TABLE_DOESNT_EXIST:
+            # Some cached id is stale. We don't know which one, and tables
+            # are rarely dropped, so start over.
+            self.table_ids.clear()
+            return TableDoesntExistError(status)
         if status == 2:
-            raise NoObjectError()
+            return NoObjectError()
         if status == 3:
-            raise ObjectExistsError()
+            return ObjectExistsError()
         if status == 5:
-            raise VersionError(given_version, actual_version)
-        raise RCException(status)
+            return VersionError(given_version, actual_version)
+        return RCException(status)
 
-    def connect(self, serverLocator='fast+udp:host=127.0.0.1,port=12246',
-                clusterName='main'):
-        s = so.rc_connect(serverLocator, clusterName,
-                          ctypes.byref(self.client))
-        self.handle_error(s)
+    def handle_error(self, status, actual_version=0, given_version=0):
+        e = self.status_error(status, actual_version, given_version)
+        if e is not None:
+            raise e
+
+
+    def stats(self):
+        """Return a snapshot of this client's counters. See L{Stats}."""
+        return self.op_stats.snapshot()
+
+    def reset_stats(self):
+        self.op_stats.reset()
+
+    def set_key_codec(self, codec):
+        """Choose how ids are turned into keys, such as L{IntKeyCodec}.
 
-    def enumerate_table_prepare(self, table_id):
+        Every client that shares a table must use the same codec.
+        """
+        self.key_codec = codec
+
+    def encode_key(self, id):
+        """Return the key string for an id, using C{self.key_codec}."""
+        if type(id) is str:
+            return id
+        return self.key_codec.encode(id)
+
+    def set_value_codec(self, codec, table_id=None):
+        """Choose how values are stored, such as with L{ZlibValueCodec}.
+
+        Values are encoded on every write path and decoded on every read
+        path, except for L{increment}, which the server applies to the
+        stored bytes; keep counters in tables without a codec.
+
+        Every client that shares a table must use the same codec for it.
+
+        @param codec: the codec, or C{None} to store values as they are
+        @param table_id: the table to use C{codec} for, or C{None} for every
+                         table that hasn't been given one of its own
+        @type  table_id: C{int}
+        """
+        if table_id is None:
+            self.value_codec = codec
+        else:
+            self.value_codecs[table_id] = codec
+
+    def encode_value(self, table_id, data):
+        """Return the bytes to store for a value, using the table's codec."""
+        codec = self.value_codecs.get(table_id, self.value_codec)
+        if codec is None:
+            return data
+        return codec.encode(data_str(data))
+
+    def decode_value(self, table_id, blob):
+        """Return the value stored as C{blob}, using the table's codec."""
+        codec = self.value_codecs.get(table_id, self.value_codec)
+        if codec is None:
+            return blob
+        return codec.decode(blob)
+
+    def connect(self, serverLocator=DEFAULT_LOCATOR,
+                clusterName='main', lazy=False):
+        """Connect to a cluster.
+
+        @param lazy: whether to put off connecting until the first RPC, so
+                     that clients which never issue one don't pay for it.
+                     Connection errors then surface from that RPC.
+        @type  lazy: C{bool}
+        """
+        self._pending_connect = (serverLocator, clusterName)
+        if not lazy:
+            self._connect_now()
+
+    def enumerate_table_prepare(self, table_id, keys_only=False):
         enumeration_state = ctypes.c_void_p()
-        s= so.rc_enumerateTablePrepare(self.client, table_id, 0,
-                                       ctypes.byref(enumeration_state))
+        so.rc_enumerateTablePrepare(self.client, table_id, int(keys_only),
+                                    ctypes.byref(enumeration_state))
         return enumeration_state
 
     def enumerate_table_next(self, enumeration_state):
+        """Return the next (key, value) pair, or ('', '') at the end."""
         key_length = ctypes.c_uint32()
         data_length = ctypes.c_uint32()
         data = ctypes.c_void_p()
         key = ctypes.c_void_p()
-        s= so.rc_enumerateTableNext(self.client, enumeration_state, ctypes.byref(key_length),
-                                    ctypes.byref(key), ctypes.byref(data_length), ctypes.byref(data))
-        key_l = key_length.value
-        data_l = data_length.value
-        dataPtr = ctypes.cast(data, ctypes.POINTER(ctypes.c_char))
-        keyPtr = ctypes.cast(key, ctypes.POINTER(ctypes.c_char))
-        data_s = ''
-        key_s = ''
-        if (key_l != 0):
-            for i in range(0,data_l):
-                data_s = data_s + dataPtr[i]
-            for i in range(0,key_l):
-                key_s = key_s + keyPtr[i]
+        start = time.time()
+        s = so.rc_enumerateTableNext(self.client, enumeration_state,
+                                     ctypes.byref(key_length),
+                                     ctypes.byref(key),
+                                     ctypes.byref(data_length),
+                                     ctypes.byref(data))
+        self.op_stats.record('enumerate', time.time() - start, s,
+                             bytes_in=data_length.value if data.value else 0)
         self.handle_error(s)
-        return (key_s, data_s)
+        if key_length.value == 0:
+            return ('', '')
+        # data is NULL when only keys were asked for
+        return (ctypes.string_at(key, key_length.value),
+                ctypes.string_at(data, data_length.value)
+                if data.value else '')
 
     def enumerate_table_finalize(self, enumeration_state):
-        s= so.rc_enumerateTableFinalize(enumeration_state)
+        so.rc_enumerateTableFinalize(enumeration_state)
+
+    def iter_table(self, table_id, keys_only=False, batch=64):
+        """Iterate over the objects in a table.
+
+        The enumeration state is finalized when the iteration ends, whether
+        it runs to the end, raises, or is abandoned (the generator is closed
+        or garbage collected).
+
+        @param keys_only: don't fetch the values; they are yielded as C{''}
+        @type  keys_only: C{bool}
+
+        @param batch: how many objects to copy out of the enumeration before
+                      yielding them, which keeps the C calls in a tight loop
+        @type  batch: C{int}
+
+        @return: a generator of (key, value) tuples
+        """
+        codec = self.value_codecs.get(table_id, self.value_codec)
+        if keys_only:
+            codec = None
+        state = self.enumerate_table_prepare(table_id, keys_only)
+        try:
+            while True:
+                objects = []
+                for i in xrange(batch):
+                    obj = self.enumerate_table_next(state)
+                    if obj[0] == '':
+                        break
+                    if codec is not None:
+                        obj = (obj[0], codec.decode(obj[1]))
+                    objects.append(obj)
+                for obj in objects:
+                    yield obj
+                if len(objects) < batch:
+                    return
+        finally:
+            self.enumerate_table_finalize(state)
+
+    def iter_keys(self, table_id, batch=64):
+        """Iterate over the keys in a table without fetching any values.
+
+        See L{iter_table}.
+        """
+        for key, value in self.iter_table(table_id, True, batch):
+            yield key
+
+    def diff_keys(self, table_id, known_keys):
+        """Compare the keys in a table with a set of keys seen earlier.
+
+        Only keys go over the wire, so this is a cheap way to poll a table
+        for objects that were added or removed.
+
+        @param known_keys: the keys the caller already knows about
+        @type  known_keys: iterable
+
+        @return: the keys that are in the table but not in C{known_keys},
+                 and the keys in C{known_keys} that are no longer in the table
+        @rtype: (C{set}, C{set})
+        """
+        removed = set(known_keys)
+        added = set()
+        for key in self.iter_keys(table_id):
+            if key in removed:
+                removed.remove(key)
+            else:
+                added.add(key)
+        return (added, removed)
 
     def create(self, table_id, id, data):
         reject_rules = RejectRules(object_exists=True)
         return self.write_rr(table_id, id, data, reject_rules)
 
     def create_table(self, name, serverSpan = 1):
+        self.table_ids.discard(name)
         s = so.rc_createTable(self.client, name, serverSpan)
         self.handle_error(s)
 
@@ -300,23 +1184,496 @@ class RAMCloud(object):
         return self.delete_rr(table_id, id, reject_rules)
 
     def delete_rr(self, table_id, id, reject_rules):
+        key = self.encode_key(id)
         got_version = ctypes.c_uint64()
         self.hook()
-        s = so.rc_remove(self.client, table_id, get_key(id), get_keyLength(id),
+        start = time.time()
+        s = so.rc_remove(self.client, table_id, key, len(key),
                          ctypes.byref(reject_rules), ctypes.byref(got_version))
+        self.op_stats.record('remove', time.time() - start, s)
+        self._invalidate(table_id, [key])
         self.handle_error(s, got_version.value)
         return got_version.value
 
     def drop_table(self, name):
+        self.table_ids.discard(name)
         s = so.rc_dropTable(self.client, name)
         self.handle_error(s)
 
     def get_table_id(self, name):
+        """Return the id of a table, asking the coordinator only the first
+        time.
+
+        The cache in C{self.table_ids} forgets a name when this client
+        creates or drops that table, and forgets everything when an operation
+        fails with L{TableDoesntExistError}.
+        """
+        table_id = self.table_ids.get(name)
+        if table_id is not None:
+            return table_id
         handle = ctypes.c_uint64()
+        start = time.time()
         s = so.rc_getTableId(self.client, name, ctypes.byref(handle))
+        self.op_stats.record('get_table_id', time.time() - start, s)
         self.handle_error(s)
+        self.table_ids.put(name, handle.value)
         return handle.value
 
+    def check(self):
+        """Make one cheap RPC to the coordinator, to tell whether this client
+        still works.
+
+        This looks up the id of L{CHECK_TABLE} without going through
+        C{self.table_ids}, and the table not existing counts as an answer.
+
+        @raise RCException: The RPC failed.
+        """
+        handle = ctypes.c_uint64()
+        start = time.time()
+        s = so.rc_getTableId(self.client, CHECK_TABLE, ctypes.byref(handle))
+        self.op_stats.record('check', time.time() - start, s)
+        if s not in (0, STATUS_TABLE_DOESNT_EXIST):
+            raise RCException(s)
+
+    def increment(self, table_id, id, delta=1):
+        """Atomically add C{delta} to a counter and return the new value.
+
+        A counter is an object written by L{pack_counter}, and a missing one
+        counts as 0. With a library that can increment on the server, this is
+        a single RPC however many clients share the counter. Otherwise it is a
+        read and a conditional write, retried with a randomized backoff while
+        other clients get in the way.
+
+        @raise ValueError: The object isn't a counter. The server reports
+                           this as an L{RCException} instead.
+
+        @rtype: C{int}
+        """
+        if not has_increment():
+            return self._increment_cas(table_id, id, delta)
+        key = self.encode_key(id)
+        got_version = ctypes.c_uint64()
+        new_value = ctypes.c_int64()
+        self.hook()
+        start = time.time()
+        s = so.rc_incrementInt64(self.client, table_id, key, len(key), delta,
+                                 ctypes.byref(RejectRules()),
+                                 ctypes.byref(got_version),
+                                 ctypes.byref(new_value))
+        self.op_stats.record('increment', time.time() - start, s)
+        self._invalidate(table_id, [key])
+        self.handle_error(s, got_version.value)
+        return new_value.value
+
+    def _increment_cas(self, table_id, id, delta):
+        # Works on the raw object even in subclasses that pack their data,
+        # like the multi-op fallbacks.
+        key = self.encode_key(id)
+        backoff = 0.0001
+        while True:
+            try:
+                blob, version = RAMCloud.read_rr(
+                        self, table_id, key,
+                        RejectRules(object_doesnt_exist=True))
+            except NoObjectError:
+                value = delta
+                reject_rules = RejectRules(object_exists=True)
+            else:
+                value = unpack_counter(blob) + delta
+                reject_rules = RejectRules.exactly(version)
+            try:
+                RAMCloud.write_rr(self, table_id, key, pack_counter(value),
+                                  reject_rules)
+                return value
+            except (NoObjectError, ObjectExistsError, VersionError):
+                time.sleep(random.uniform(0, backoff))
+                backoff = min(backoff * 2, 0.01)
+
+    def _multi_op_native(self, op_type, multi_op, construct, count):
+        # Builds count multi-op objects with construct(i, where), issues them
+        # with multi_op, and returns a (status, version) tuple for each.
+        size = so.rc_multiOpSizeOf(op_type)
+        storage = ctypes.create_string_buffer(size * count)
+        objects = (ctypes.c_void_p * count)()
+        constructed = 0
+        try:
+            for i in range(count):
+                objects[i] = ctypes.addressof(storage) + i * size
+                construct(i, objects[i])
+                constructed += 1
+            self.hook()
+            multi_op(self.client, objects, count)
+            return [(so.rc_multiOpStatus(objects[i], op_type),
+                     so.rc_multiOpVersion(objects[i], op_type))
+                    for i in range(count)]
+        finally:
+            for i in range(constructed):
+                so.rc_multiOpDestroy(objects[i], op_type)
+
+    def multi_read(self, table_id, keys):
+        """Read several objects from one table in a single call.
+
+        @param keys: the keys of the objects to read
+        @type  keys: C{list}
+
+        @return: one entry per key, in order: either a (value, version) tuple
+                 or the exception that reading that key alone would have
+                 raised, such as L{NoObjectError}.
+        @rtype: C{list}
+        """
+        rr = RejectRules(object_doesnt_exist=True)
+        return self.multi_read_rr(table_id, [(key, rr) for key in keys])
+
+    def multi_read_rr(self, table_id, requests):
+        """Like L{multi_read}, but with reject rules for each object.
+
+        @param requests: (key, reject_rules) tuples
+        @type  requests: C{list}
+        """
+        if has_multi_ops():
+            return self._multi_read_native(table_id, requests)
+        # The C API has no asynchronous reads, so without native support
+        # this is one read after another, sharing the pooled buffer.
+        results = []
+        for (key, reject_rules) in requests:
+            try:
+                results.append(RAMCloud.read_rr(self, table_id, key,
+                                                reject_rules))
+            except OBJECT_ERRORS, e:
+                results.append(e)
+        return results
+
+    def _multi_read_native(self, table_id, requests):
+        bufs = [self.buffers.get() for r in requests]
+        lengths = [ctypes.c_uint32() for r in requests]
+        def construct(i, where):
+            key = self.encode_key(requests[i][0])
+            so.rc_multiReadCreate(table_id, key, len(key),
+                                  ctypes.byref(bufs[i]), len(bufs[i]),
+                                  ctypes.byref(lengths[i]), where)
+        try:
+            start = time.time()
+            outcomes = self._multi_op_native(MULTI_OP_READ, so.rc_multiRead,
+                                             construct, len(requests))
+            self.op_stats.record('multi_read', time.time() - start,
+                                 bytes_in=sum(min(l.value, len(b)) for (l, b)
+                                              in zip(lengths, bufs)))
+            results = []
+            for (i, (key, reject_rules)) in enumerate(requests):
+                status, version = outcomes[i]
+                e = (self.status_error(status, version) or
+                     reject_error(reject_rules, version))
+                if e is not None:
+                    results.append(e)
+                elif lengths[i].value > len(bufs[i]):
+                    # didn't fit in a pooled buffer; fetch it on its own
+                    try:
+                        results.append(RAMCloud.read_rr(self, table_id, key,
+                                                        reject_rules))
+                    except OBJECT_ERRORS, e:
+                        results.append(e)
+                else:
+                    results.append((self.decode_value(
+                                        table_id,
+                                        ctypes.string_at(bufs[i],
+                                                         lengths[i].value)),
+                                    version))
+            return results
+        finally:
+            for buf in bufs:
+                self.buffers.put(buf)
+
+    def multi_remove(self, table_id, requests):
+        """Remove several objects from one table in a single call.
+
+        Unlike L{delete_rr}, a rejected object doesn't stop the others from
+        being removed.
+
+        @param requests: (key, reject_rules) tuples
+        @type  requests: C{list}
+
+        @return: one entry per request, in order: either the version of the
+                 removed object or the exception that removing it alone
+                 would have raised.
+        @rtype: C{list}
+        """
+        if has_multi_ops():
+            def construct(i, where):
+                id, reject_rules = requests[i]
+                key = self.encode_key(id)
+                so.rc_multiRemoveCreate(table_id, key, len(key),
+                                        ctypes.byref(reject_rules), where)
+            start = time.time()
+            outcomes = self._multi_op_native(MULTI_OP_REMOVE,
+                                             so.rc_multiRemove, construct,
+                                             len(requests))
+            self.op_stats.record('multi_remove', time.time() - start)
+            self._invalidate(table_id, [self.encode_key(r[0])
+                                        for r in requests])
+            return self._multi_op_results(requests, outcomes)
+        results = []
+        for (key, reject_rules) in requests:
+            try:
+                results.append(RAMCloud.delete_rr(self, table_id, key,
+                                                  reject_rules))
+            except OBJECT_ERRORS, e:
+                results.append(e)
+        return results
+
+    def multi_write(self, table_id, requests):
+        """Write several objects to one table in a single call.
+
+        Unlike L{write_rr}, a rejected object doesn't stop the others from
+        being written.
+
+        @param requests: (key, data, reject_rules) tuples
+        @type  requests: C{list}
+
+        @return: one entry per request, in order: either the new version of
+                 the object or the exception that writing it alone would have
+                 raised.
+        @rtype: C{list}
+        """
+        if has_multi_ops():
+            # the blobs must outlive the call, since the args point into them
+            blobs = [self.encode_value(table_id, r[1]) for r in requests]
+            args = [data_arg(blob) for blob in blobs]
+            def construct(i, where):
+                id, data, reject_rules = requests[i]
+                key = self.encode_key(id)
+                so.rc_multiWriteCreate(table_id, key, len(key), args[i][0],
+                                       args[i][1],
+                                       ctypes.byref(reject_rules), where)
+            start = time.time()
+            outcomes = self._multi_op_native(MULTI_OP_WRITE, so.rc_multiWrite,
+                                             construct, len(requests))
+            self.op_stats.record('multi_write', time.time() - start,
+                                 bytes_out=sum(arg[1] for arg in args))
+            self._invalidate(table_id, [self.encode_key(r[0])
+                                        for r in requests])
+            return self._multi_op_results([(r[0], r[2]) for r in requests],
+                                          outcomes)
+        results = []
+        for (key, data, reject_rules) in requests:
+            try:
+                results.append(RAMCloud.write_rr(self, table_id, key, data,
+                                                 reject_rules))
+            except OBJECT_ERRORS, e:
+                results.append(e)
+        return results
+
+    def _multi_op_results(self, requests, outcomes):
+        results = []
+        for ((key, reject_rules), (status, version)) in zip(requests,
+                                                            outcomes):
+            e = self.status_error(status, version, reject_rules.given_version)
+            if e is None:
+                results.append(version)
+            else:
+                results.append(e)
+        return results
+
+    def _invalidate(self, table_id, keys):
+        # Not needed for correctness, since every cached read checks the
+        # version with the server, but saves a wasted revalidation and frees
+        # the memory early.
+        if self.read_cache is not None:
+            for key in keys:
+                self.read_cache.discard(table_id, key)
+
+    def read_cached(self, table_id, id):
+        """Like L{read}, but only transfer the object if it has changed since
+        this client last read it.
+
+        Set C{self.read_cache} to a L{ReadCache} first; without one, this is
+        the same as L{read}. An object that is cached is read with a reject
+        rule for its cached version, and the server answers with a
+        L{VersionError} rather than the value if that version is still
+        current. This still costs a round trip, but unchanged objects are
+        never transferred again.
+
+        Writes and deletes through this client drop the objects they touch
+        from the cache. Changes by other clients are caught by the version
+        check.
+
+        @return: (value, version)
+        """
+        cache = self.read_cache
+        if cache is None:
+            return self.read(table_id, id)
+        key = self.encode_key(id)
+        entry = cache.get(table_id, key)
+        if entry is None:
+            cache.count('misses')
+            value, version = self.read(table_id, key)
+            cache.put(table_id, key, value, version)
+            return (value, version)
+        reject_rules = RejectRules(object_doesnt_exist=True,
+                                   version_eq_given=True,
+                                   given_version=entry[1])
+        try:
+            value, version = self.read_rr(table_id, key, reject_rules)
+        except VersionError, e:
+            if e.got_version == entry[1]:
+                cache.count('fresh')
+                return entry
+            raise
+        except NoObjectError:
+            cache.discard(table_id, key)
+            raise
+        cache.count('changed')
+        cache.put(table_id, key, value, version)
+        return (value, version)
+
+    def multi_read_cached(self, table_id, ids):
+        """Like L{multi_read}, but through L{read_cached}.
+
+        Objects that aren't cached yet are read in one batch. Cached ones are
+        revalidated one by one, since the batched read can't apply reject
+        rules on the server.
+        """
+        cache = self.read_cache
+        if cache is None:
+            return self.multi_read(table_id, ids)
+        keys = [self.encode_key(id) for id in ids]
+        results = [None] * len(keys)
+        misses = []
+        for (i, key) in enumerate(keys):
+            if cache.get(table_id, key) is None:
+                misses.append(i)
+            else:
+                try:
+                    results[i] = self.read_cached(table_id, key)
+                except OBJECT_ERRORS, e:
+                    results[i] = e
+        if misses:
+            batch = self.multi_read(table_id, [keys[i] for i in misses])
+            for (i, result) in zip(misses, batch):
+                cache.count('misses')
+                results[i] = result
+                if isinstance(result, tuple):
+                    cache.put(table_id, keys[i], result[0], result[1])
+        return results
+
+    def _read_manifest(self, table_id, key):
+        # Return ((generation, count, length) or None, version), or
+        # (None, None) if there's no object.
+        try:
+            value, version = self.read(table_id, key)
+        except NoObjectError:
+            return (None, None)
+        return (unpack_manifest(value), version)
+
+    def _remove_chunks(self, table_id, key, generation, count):
+        self.multi_remove(table_id, [(chunk_key(key, generation, i),
+                                      RejectRules())
+                                     for i in range(count)])
+
+    def write_chunked(self, table_id, id, data, chunk_size=CHUNK_SIZE):
+        """Write a value of any size, splitting it into chunks if necessary.
+
+        A value over C{chunk_size} bytes is written in chunks, under keys
+        derived from C{id} (see L{chunk_key}), and then a small manifest is
+        written at C{id} that names them. Each write uses chunk keys of its
+        own, which are never modified, so a reader that finds every chunk a
+        manifest names has the value of that manifest version. The chunks of
+        the value replaced are removed once the new manifest is in place. The
+        manifest is only written if nobody replaced the old value in the
+        meantime, and the whole write is tried again otherwise.
+
+        Smaller values are written as they are. Read either with
+        L{read_chunked}, and enumerate such tables with L{is_chunk_key} in
+        mind. C{data} may be anything L{write_rr} takes, and the chunks are
+        written straight out of it.
+
+        @return: the version of the value or manifest
+        """
+        key = self.encode_key(id)
+        length = data_arg(data)[1]
+        while True:
+            old, old_version = self._read_manifest(table_id, key)
+            if old_version is None:
+                reject_rules = RejectRules(object_exists=True)
+            else:
+                reject_rules = RejectRules.exactly(old_version)
+            generation = None
+            header = data_str(data_slice(data, 0, len(CHUNK_MANIFEST_HEADER)))
+            if length <= chunk_size and header != CHUNK_MANIFEST_HEADER:
+                value = data
+            else:
+                generation = random.getrandbits(63)
+                chunks = [data_slice(data, i, chunk_size)
+                          for i in range(0, length, chunk_size)]
+                results = self.multi_write(
+                        table_id, [(chunk_key(key, generation, i), chunk,
+                                    RejectRules())
+                                   for (i, chunk) in enumerate(chunks)])
+                for result in results:
+                    if isinstance(result, Exception):
+                        self._remove_chunks(table_id, key, generation,
+                                            len(chunks))
+                        raise result
+                value = pack_manifest(generation, len(chunks), length)
+            try:
+                version = self.write_rr(table_id, key, value, reject_rules)
+            except (NoObjectError, ObjectExistsError, VersionError):
+                # someone else replaced the value first; start over
+                if generation is not None:
+                    self._remove_chunks(table_id, key, generation,
+                                        len(chunks))
+                continue
+            if old is not None:
+                self._remove_chunks(table_id, key, old[0], old[1])
+            return version
+
+    def read_chunked(self, table_id, id):
+        """Read a value written by L{write_chunked}.
+
+        The chunks are read in one batch. If one has gone missing, the value
+        was replaced while we were reading it, and the read starts over.
+
+        @return: (value, version), where version is that of the manifest for
+                 a chunked value
+        """
+        key = self.encode_key(id)
+        while True:
+            value, version = self.read(table_id, key)
+            manifest = unpack_manifest(value)
+            if manifest is None:
+                return (value, version)
+            generation, count, length = manifest
+            results = self.multi_read(table_id,
+                                      [chunk_key(key, generation, i)
+                                       for i in range(count)])
+            if any(isinstance(r, NoObjectError) for r in results):
+                continue
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            value = ''.join(r[0] for r in results)
+            if len(value) != length:
+                raise ValueError("chunked value %r should be %d bytes but "
+                                 "is %d" % (key, length, len(value)))
+            return (value, version)
+
+    def delete_chunked(self, table_id, id):
+        """Delete a value written by L{write_chunked}, chunks and all.
+
+        @return: the version of the deleted value or manifest
+        """
+        key = self.encode_key(id)
+        while True:
+            manifest, version = self._read_manifest(table_id, key)
+            if version is None:
+                raise NoObjectError()
+            try:
+                self.delete_rr(table_id, key, RejectRules.exactly(version))
+            except (NoObjectError, VersionError):
+                continue
+            if manifest is not None:
+                self._remove_chunks(table_id, key, manifest[0], manifest[1])
+            return version
+
     def ping(self, serviceLocator, nonce, nanoseconds):
         result = ctypes.c_uint64();
         s = so.rc_ping(self.client, serviceLocator, nonce, nanoseconds,
@@ -332,19 +1689,57 @@ class RAMCloud(object):
         return self.read_rr(table_id, id, reject_rules)
 
 
-    def read_rr(self, table_id, id, reject_rules):
-        max_length = 1024 * 1024 * 2
-        buf = ctypes.create_string_buffer(max_length)
+    def _read_into(self, table_id, id, reject_rules):
+        # Reads into a pooled buffer, growing it and reading again if the
+        # object didn't fit. The caller must return the buffer to the pool.
+        key = self.encode_key(id)
         actual_length = ctypes.c_uint32()
         got_version = ctypes.c_uint64()
-        reject_rules.object_doesnt_exist = False 
-        self.hook()
-        s = so.rc_read(self.client, table_id, get_key(id), get_keyLength(id),
-                       ctypes.byref(reject_rules),
-                       ctypes.byref(got_version), ctypes.byref(buf), max_length,
-                       ctypes.byref(actual_length))
-        self.handle_error(s, got_version.value)
-        return (buf.raw[0:actual_length.value], got_version.value)
+        reject_rules.object_doesnt_exist = False
+        buf = self.buffers.get()
+        try:
+            while True:
+                self.hook()
+                start = time.time()
+                s = so.rc_read(self.client, table_id, key,
+                               len(key), ctypes.byref(reject_rules),
+                               ctypes.byref(got_version), ctypes.byref(buf),
+                               len(buf), ctypes.byref(actual_length))
+                if s == 0:
+                    received = min(actual_length.value, len(buf))
+                else:
+                    received = 0
+                self.op_stats.record('read', time.time() - start, s,
+                                     bytes_in=received)
+                self.handle_error(s, got_version.value)
+                if actual_length.value <= len(buf):
+                    return (buf, actual_length.value, got_version.value)
+                buf = self.buffers.grow(buf, actual_length.value)
+        except:
+            self.buffers.put(buf)
+            raise
+
+    def read_rr(self, table_id, id, reject_rules):
+        buf, length, version = self._read_into(table_id, id, reject_rules)
+        try:
+            return (self.decode_value(table_id, ctypes.string_at(buf, length)),
+                    version)
+        finally:
+            self.buffers.put(buf)
+
+    def read_rr_view(self, table_id, id, reject_rules):
+        """Like L{read_rr}, but return a C{memoryview} instead of a copy.
+
+        The view aliases a buffer owned by this client and is only valid until
+        the next read issued through this client. If the table has a value
+        codec, the view is of a decoded copy instead.
+        """
+        buf, length, version = self._read_into(table_id, id, reject_rules)
+        self.buffers.put(buf)
+        if self.value_codecs.get(table_id, self.value_codec) is not None:
+            return (memoryview(self.decode_value(
+                        table_id, ctypes.string_at(buf, length))), version)
+        return (memoryview(buf)[:length], version)
 
     def update(self, table_id, id, data, want_version=None):
         if want_version:
@@ -362,39 +1757,58 @@ class RAMCloud(object):
         return self.write_rr(table_id, id, data, reject_rules)
 
     def write_rr(self, table_id, id, data, reject_rules):
+        """Write an object, subject to reject rules.
+
+        @param data: the value: a C{str}, or any object with the buffer
+                     protocol, which is written without copying it first.
+                     See L{data_arg}.
+
+        @return: the new version of the object
+        """
+        key = self.encode_key(id)
+        data = self.encode_value(table_id, data)
+        arg, length = data_arg(data)
         got_version = ctypes.c_uint64()
         self.hook()
-        s = so.rc_write(self.client, table_id, get_key(id), get_keyLength(id),
-                        data, len(data),
+        start = time.time()
+        s = so.rc_write(self.client, table_id, key, len(key),
+                        arg, length,
                         ctypes.byref(reject_rules), ctypes.byref(got_version))
+        self.op_stats.record('write', time.time() - start, s,
+                             bytes_out=length)
+        self._invalidate(table_id, [key])
         self.handle_error(s, got_version.value)
         return got_version.value
 
     def testing_kill(self, table_id, id):
+        key = self.encode_key(id)
         s = so.rc_testing_kill(self.client, table_id,
-                               get_key(id), get_keyLength(id))
+                               key, len(key))
         self.handle_error(s)
 
     def testing_fill(self, table_id, id, object_count, object_size):
+        key = self.encode_key(id)
         s = so.rc_testing_fill(self.client, table_id,
-                               get_key(id), get_keyLength(id),
+                               key, len(key),
                                object_count, object_size)
         self.handle_error(s)
 
     def testing_get_server_id(self, table_id, id):
+        key = self.encode_key(id)
         cserver_id = ctypes.c_uint64()
-        s = so.rc_testing_get_server_id(self.client, table_id, get_key(id),
-                                        get_keyLength(id),
+        s = so.rc_testing_get_server_id(self.client, table_id, key,
+                                        len(key),
                                         ctypes.byref(cserver_id))
         self.handle_error(s)
         return cserver_id.value
 
     def testing_get_service_locator(self, table_id, id):
+        key = self.encode_key(id)
         max_len = 128
         buffer = ctypes.create_string_buffer(max_len)
         s = so.rc_testing_get_service_locator(self.client,
-                                              table_id, get_key(id),
-                                              get_keyLength(id),
+                                              table_id, key,
+                                              len(key),
                                               buffer, max_len)
         self.handle_error(s)
         return buffer.value
@@ -408,6 +1822,533 @@ class RAMCloud(object):
     def set_log_file(self, path):
         so.rc_set_log_file(path)
 
+class PoolTimeout(Exception):
+    """Raised when no pooled client became free in time."""
+    pass
+
+class RAMCloudPool(object):
+    """A fixed set of connected clients shared between threads.
+
+    A native client must not be used by two threads at once. Threads borrow a
+    client for the duration of a C{with} block::
+
+        with pool.client() as rc:
+            rc.write(table, key, data)
+
+    Nested blocks on one thread get the same client back, and a thread is
+    handed the client it used last whenever that one is free. Clients are
+    connected the first time they are needed.
+
+    A client whose block raises L{RCException}, which covers transport and
+    server failures, is dropped and replaced by a newly connected one. The
+    exception is L{TableDoesntExistError}, which the server answered. A
+    client that has sat idle for C{check_interval} seconds is checked with
+    L{RAMCloud.check} before it is handed out, and replaced if that fails.
+    """
+
+    def __init__(self, size=4,
+                 serverLocator=DEFAULT_LOCATOR,
+                 clusterName='main', timeout=None, check_interval=60,
+                 client_factory=None, key_codec=None, read_cache=None,
+                 value_codec=None):
+        """
+        @param size: the most clients the pool will connect
+        @type  size: C{int}
+
+        @param timeout: how long L{client} waits for a free client by
+                        default, in seconds, or C{None} to wait forever
+        @type  timeout: C{float}
+
+        @param check_interval: how long a client may sit idle before it is
+                               health-checked, in seconds, or C{None} to never
+                               check
+        @type  check_interval: C{float}
+
+        @param client_factory: makes an unconnected client, L{RAMCloud} by
+                               default
+        @type  client_factory: callable
+
+        @param key_codec: the key codec for every client, see
+                          L{RAMCloud.set_key_codec}
+
+        @param read_cache: a cache shared by every client for
+                           L{RAMCloud.read_cached}, or C{None}
+        @type  read_cache: L{ReadCache}
+
+        @param value_codec: the value codec for every table, see
+                            L{RAMCloud.set_value_codec}. Codecs for single
+                            tables set through any client apply to them all.
+        """
+        self.size = size
+        self.serverLocator = serverLocator
+        self.clusterName = clusterName
+        self.timeout = timeout
+        self.check_interval = check_interval
+        if client_factory is None:
+            client_factory = RAMCloud
+        self.client_factory = client_factory
+        self.key_codec = key_codec
+        self._cond = threading.Condition()
+        self._idle = []     # (client, time it was released), oldest first
+        self._connected = 0 # clients handed out, idle, or being connected
+        self._local = threading.local()
+        self.table_ids = TableIdCache()
+        self.op_stats = Stats()
+        self.read_cache = read_cache
+        self.value_codec = value_codec
+        self.value_codecs = {}
+
+    def _connect(self):
+        client = self.client_factory()
+        # so that one client's create_table or drop_table reaches them all,
+        # and the stats cover the whole pool
+        client.table_ids = self.table_ids
+        client.op_stats = self.op_stats
+        client.read_cache = self.read_cache
+        client.value_codec = self.value_codec
+        client.value_codecs = self.value_codecs
+        if self.key_codec is not None:
+            client.set_key_codec(self.key_codec)
+        client.connect(self.serverLocator, self.clusterName)
+        return client
+
+    def _healthy(self, client):
+        # whatever goes wrong, a fresh client is the safer bet
+        try:
+            client.check()
+        except Exception:
+            return False
+        return True
+
+    def _take(self, timeout):
+        # Returns (client, idle since), or (None, None) if the caller should
+        # connect a new client in the slot it was given.
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    last = getattr(self._local, 'last', None)
+                    for i, (client, since) in enumerate(self._idle):
+                        if client is last:
+                            return self._idle.pop(i)
+                    # the most recently used is the likeliest to be healthy
+                    return self._idle.pop()
+                if self._connected < self.size:
+                    self._connected += 1
+                    return (None, None)
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolTimeout()
+                    self._cond.wait(remaining)
+
+    def _drop(self):
+        with self._cond:
+            self._connected -= 1
+            self._cond.notify()
+
+    def _check_out(self, timeout):
+        # Takes a client, connected and checked, without tying it to the
+        # calling thread.
+        if timeout is None:
+            timeout = self.timeout
+        client, since = self._take(timeout)
+        try:
+            if client is None:
+                client = self._connect()
+            elif (self.check_interval is not None and
+                  time.time() - since > self.check_interval and
+                  not self._healthy(client)):
+                client = self._connect()
+        except:
+            self._drop()
+            raise
+        return client
+
+    def _check_in(self, client, broken):
+        if broken:
+            self._drop()
+            return
+        with self._cond:
+            self._idle.append((client, time.time()))
+            self._cond.notify()
+
+    def acquire(self, timeout=None):
+        """Borrow a client; prefer L{client}, which also returns it.
+
+        @param timeout: overrides the pool's timeout for this call
+        @type  timeout: C{float}
+
+        @raise PoolTimeout: No client became free in time.
+        """
+        local = self._local
+        if getattr(local, 'client', None) is not None:
+            local.depth += 1
+            return local.client
+        client = self._check_out(timeout)
+        local.client = client
+        local.last = client
+        local.depth = 1
+        local.broken = False
+        return client
+
+    def release(self, client, broken=False):
+        """Return a client taken with L{acquire}.
+
+        @param broken: drop the client instead of reusing it
+        @type  broken: C{bool}
+        """
+        local = self._local
+        assert local.client is client
+        local.broken = local.broken or broken
+        local.depth -= 1
+        if local.depth > 0:
+            return
+        local.client = None
+        if local.broken:
+            local.last = None
+        self._check_in(client, local.broken)
+
+    @contextlib.contextmanager
+    def client(self, timeout=None):
+        """Borrow a client for the duration of a C{with} block.
+
+        @param timeout: overrides the pool's timeout for this call
+        @type  timeout: C{float}
+
+        @raise PoolTimeout: No client became free in time.
+        """
+        client = self.acquire(timeout)
+        try:
+            yield client
+        except TableDoesntExistError:
+            self.release(client)
+            raise
+        except RCException:
+            self.release(client, broken=True)
+            raise
+        except:
+            self.release(client)
+            raise
+        else:
+            self.release(client)
+
+    def proxy(self):
+        """Return an object with L{RAMCloud}'s methods that borrows a client
+        from this pool for each call.
+
+        Calls made inside a L{client} block use that block's client, so
+        sequences of calls that must share a client, like a table
+        enumeration, should be wrapped in one.
+        """
+        return PooledRAMCloud(self)
+
+    @contextlib.contextmanager
+    def detached_client(self, timeout=None):
+        """Like L{client}, but the client isn't tied to the calling thread,
+        so the block may end on another one.
+
+        This is for clients held across the yields of a generator, which
+        may be resumed, closed or garbage-collected on any thread. Inside
+        a L{client} block, this yields that block's client.
+        """
+        client = getattr(self._local, 'client', None)
+        if client is not None:
+            yield client
+            return
+        client = self._check_out(timeout)
+        broken = False
+        try:
+            yield client
+        except TableDoesntExistError:
+            raise
+        except RCException:
+            broken = True
+            raise
+        finally:
+            self._check_in(client, broken)
+
+class PooledRAMCloud(object):
+    """See L{RAMCloudPool.proxy}."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __getattr__(self, name):
+        if not callable(getattr(RAMCloud, name, None)):
+            raise AttributeError(name)
+        def call(*args, **kwargs):
+            with self.pool.client() as client:
+                return getattr(client, name)(*args, **kwargs)
+        call.__name__ = name
+        return call
+
+    def iter_table(self, *args, **kwargs):
+        # holds one client until the iteration ends, on whichever thread
+        # that is
+        with self.pool.detached_client() as client:
+            for obj in client.iter_table(*args, **kwargs):
+                yield obj
+
+    def iter_keys(self, *args, **kwargs):
+        with self.pool.detached_client() as client:
+            for key in client.iter_keys(*args, **kwargs):
+                yield key
+
+def testing_server_id(client, table_id, key):
+    """Return the id of the server that owns a key, as reported by
+    L{RAMCloud.testing_get_server_id}. The default for L{BatchScheduler}."""
+    return client.testing_get_server_id(table_id, key)
+
+class BatchScheduler(object):
+    """Runs batched operations as one batch per server, at the same time.
+
+    A native client issues one call at a time, so a L{RAMCloud.multi_read}
+    over keys held by several masters waits on them in turn. This splits
+    the objects of a batch by the master that owns each one, and runs each
+    master's share on a client of its own from a L{RAMCloudPool}. The
+    results come back in the order of the request, just as from the
+    client's own method.
+
+    Which server owns a key is remembered. The keys of a batch that aren't
+    known yet go out together as one more share, and a helper thread looks
+    them up in the background, while a client of the pool is free, for the
+    batches that follow. Keys whose share fails with an L{RCException}, or
+    that fail with one by themselves, are forgotten, in case their tablet
+    has moved.
+
+    The calling thread works through the shares along with up to
+    C{workers} helper threads. Helpers only use clients that are free at
+    the time, so this makes progress even when the caller holds the last
+    client of the pool.
+
+    The helpers start with the first batch a process runs, so a process
+    forked after the scheduler was made starts its own. Once L{close}d,
+    the scheduler runs every share on the calling thread.
+    """
+
+    def __init__(self, pool, workers=4, locations=65536,
+                 locate=testing_server_id):
+        """
+        @param pool: where to borrow clients from
+        @type  pool: L{RAMCloudPool}
+
+        @param workers: the number of helper threads
+        @type  workers: C{int}
+
+        @param locations: how many key locations to remember
+        @type  locations: C{int}
+
+        @param locate: called as C{locate(client, table_id, key)} to find
+                       the id of the server that owns a key, or C{None} to
+                       never split batches. If it fails with anything but
+                       an L{RCException}, as L{testing_server_id} does with
+                       a library that lacks the testing RPC, it isn't
+                       called again.
+        @type  locate: callable
+        """
+        self.pool = pool
+        self.workers = workers
+        self.locations = LRUCache(locations)
+        self.locate = locate
+        self._lock = threading.Lock()
+        self._locating = False
+        self._requests = None
+        self._closed = False
+        self._threads = []
+        self._pid = None    # the process that self._threads belong to
+
+    def _worker(self, requests):
+        while True:
+            request = requests.get()
+            if request is None:
+                return
+            request()
+
+    def _helpers(self):
+        # Returns the queue of this process's helpers and how many there
+        # are, starting them if need be.
+        with self._lock:
+            if self._closed:
+                return (None, 0)
+            if self._pid != os.getpid():
+                # a fork leaves the parent's threads behind
+                self._pid = os.getpid()
+                self._locating = False
+                self._requests = Queue.Queue()
+                self._threads = []
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self._worker,
+                                              args=(self._requests,),
+                                              name='BatchScheduler-%d' % i)
+                    thread.daemon = True
+                    thread.start()
+                    self._threads.append(thread)
+            return (self._requests, len(self._threads))
+
+    def close(self):
+        """Stop the helper threads."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._pid != os.getpid():
+                return
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            self._requests.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _locate_later(self, requests, table_id, keys):
+        # Has a helper look up where keys are, unless one already is.
+        if requests is None or self.locate is None:
+            return
+        with self._lock:
+            if self._locating:
+                return
+            self._locating = True
+        requests.put(lambda: self._locate(table_id, keys))
+
+    def _locate(self, table_id, keys):
+        # Runs on a helper. Gives way to batches: a client is only borrowed
+        # for one key at a time, and only while one is free.
+        try:
+            for key in keys:
+                try:
+                    client = self.pool.acquire(timeout=0)
+                except Exception:
+                    return
+                try:
+                    server = self.locate(client, table_id, key)
+                except TableDoesntExistError:
+                    self.pool.release(client)
+                    return
+                except RCException:
+                    self.pool.release(client, broken=True)
+                    return
+                except Exception:
+                    self.pool.release(client)
+                    self.locate = None
+                    return
+                self.pool.release(client)
+                with self._lock:
+                    self.locations.put((table_id, key), server)
+        finally:
+            with self._lock:
+                self._locating = False
+
+    def forget(self, table_id, keys):
+        """Forget where some keys are, so they're looked up again."""
+        with self._lock:
+            for key in keys:
+                self.locations.discard((table_id, key))
+
+    def _run(self, table_id, items, key_of, batch):
+        # Calls batch(client, share) for each server's share of items and
+        # returns the combined results in order.
+        results = [None] * len(items)
+        errors = []
+        client = self.pool.acquire()
+        broken = False
+        try:
+            keys = [client.encode_key(key_of(item)) for item in items]
+            shares = collections.OrderedDict()
+            unknown = []
+            with self._lock:
+                for (i, key) in enumerate(keys):
+                    server = self.locations.get((table_id, key))
+                    if server is None:
+                        unknown.append(i)
+                    else:
+                        shares.setdefault(server, []).append(i)
+            if unknown:
+                # one share, whichever servers it spans
+                shares[None] = unknown
+            pending = collections.deque(shares.itervalues())
+            cond = threading.Condition()
+            running = [0]
+
+            def work(client):
+                # returns whether the client should be dropped
+                while True:
+                    with cond:
+                        if not pending:
+                            return False
+                        share = pending.popleft()
+                        running[0] += 1
+                    try:
+                        outcomes = batch(client, [items[i] for i in share])
+                    except Exception, e:
+                        self.forget(table_id, [keys[i] for i in share])
+                        errors.append(e)
+                        return (isinstance(e, RCException) and
+                                not isinstance(e, TableDoesntExistError))
+                    else:
+                        for (i, outcome) in zip(share, outcomes):
+                            results[i] = outcome
+                        self.forget(table_id,
+                                    [keys[i] for (i, outcome)
+                                     in zip(share, outcomes)
+                                     if isinstance(outcome, RCException)])
+                    finally:
+                        with cond:
+                            running[0] -= 1
+                            cond.notifyAll()
+
+            def helper():
+                with cond:
+                    if not pending:
+                        return
+                try:
+                    client = self.pool.acquire(timeout=0)
+                except Exception:
+                    # no client is free, or connecting one failed; the
+                    # caller's thread does the work instead
+                    return
+                broken = False
+                try:
+                    broken = work(client)
+                finally:
+                    self.pool.release(client, broken)
+
+            requests, helpers = self._helpers()
+            for i in range(min(len(pending) - 1, helpers)):
+                requests.put(helper)
+            if unknown:
+                self._locate_later(requests, table_id,
+                                   [keys[i] for i in unknown])
+            broken = work(client)
+            with cond:
+                while running[0]:
+                    cond.wait()
+        finally:
+            self.pool.release(client, broken)
+        if errors:
+            raise errors[0]
+        return results
+
+    def multi_read(self, table_id, keys):
+        """See L{RAMCloud.multi_read}."""
+        return self._run(table_id, keys, lambda key: key,
+                         lambda client, share:
+                             client.multi_read(table_id, share))
+
+    def multi_write(self, table_id, requests):
+        """See L{RAMCloud.multi_write}."""
+        return self._run(table_id, requests, lambda request: request[0],
+                         lambda client, share:
+                             client.multi_write(table_id, share))
+
+    def multi_remove(self, table_id, requests):
+        """See L{RAMCloud.multi_remove}."""
+        return self._run(table_id, requests, lambda request: request[0],
+                         lambda client, share:
+                             client.multi_remove(table_id, share))
+
 def main():
     r = RAMCloud()
     r.connect()
@@ -444,7 +2385,7 @@ def main():
     r.drop_table("01234567890123456789A")
     r.drop_table("01234567890123456789B")
 
-so = load_so()
+so = LazyLibrary()
 
 if __name__ == '__main__':
     main()
@@ -20,7 +20,9 @@ class RamCloudDbDriver(db_api.DbApi):
     def __init__(self):
         super(RamCloudDbDriver, self).__init__()
         self.client = None
+        self.pool = None
         self.current_key = 0
+        self.key_upgraded = False
         self.service_locator = None
 
     def create_tables(self, tables):
@@ -29,9 +31,10 @@ class RamCloudDbDriver(db_api.DbApi):
             self.client.create_table(t)
 
     def initialize(self, db_ip, db_port, **args):
-        self.client = ramcloud.RAMCloud()
         self.service_locator = 'fast+udp:host='+db_ip+',port='+str(db_port)+''
-        self.client.connect()
+        self.pool = ramcloud.RAMCloudPool(size=args.get('pool_size', 4),
+                                          serverLocator=self.service_locator)
+        self.client = self.pool.proxy()
 
     def support_publish_subscribe(self):
         return False
@@ -53,30 +56,36 @@ class RamCloudDbDriver(db_api.DbApi):
         self.client.delete(table_id, key)
 
     def get_all_entries(self, table):
-        res = []
         table_id = self.client.get_table_id(table)
-        enumeration_state = self.client.enumerate_table_prepare(table_id)
+        return [value for key, value in self.client.iter_table(table_id)]
+
+    def _upgrade_unique_key(self, table_id):
+        # earlier versions of this driver kept the counter as a decimal
+        # string; turn it into a counter for increment. A packed counter is
+        # only all digits once it's past 0x3030303030303030, so a string of
+        # digits is always the old format.
         while True:
-            key, value = self.client.enumerate_table_next(enumeration_state)
-            if (key == ''):
-                break
-            res.append(value)
-        self.client.enumerate_table_finalize(enumeration_state)
-        return res
+            try:
+                value, version = self.client.read(table_id, 1)
+            except ramcloud.NoObjectError:
+                return
+            if not value.isdigit():
+                return
+            try:
+                self.client.update(table_id, 1,
+                                   ramcloud.pack_counter(int(value)), version)
+                return
+            except (ramcloud.NoObjectError, ramcloud.VersionError):
+                pass
 
     def _allocate_unique_key(self):
+        # one RPC however many neutron workers allocate at once; the counter
+        # starts out at 0 if it doesn't exist yet
         table_id = self.client.get_table_id('tunnel_key')
-        key = 1
-        version_exception = True
-        while version_exception:
-            try:
-                value, version = self.client.read(table_id, key)
-                prev_value = int(value)
-                self.client.write(table_id, key, str(prev_value + 1), version)
-                version_exception = False
-                return prev_value + 1
-            except ramcloud.VersionError:
-                version_exception = True
+        if not self.key_upgraded:
+            self._upgrade_unique_key(table_id)
+            self.key_upgraded = True
+        return self.client.increment(table_id, 1, 1)
 
     def allocate_unique_key(self):
         return self._allocate_unique_key()
@@ -90,7 +99,6 @@ def main():
     rc = RamCloudDbDriver()
     rc.initialize("127.0.0.1", "12246")
     rc.create_tables(['dragonflow', 'tunnel_key'])
-    rc.create_key('tunnel_key', '1', '0')
     # Mock Data
 
     test_data = '{"external_ids": {"neutron:router_name": "router1"}, "name": "neutron-8b8a2dd9-698d-4fc3-aba3-379c8770d8af",' \
@@ -24,44 +24,90 @@ from dragonflow.db import api_nb
 #Test
 class RamcloudNbApi(api_nb.NbApi):
 
-    def __init__(self, db_ip='127.0.0.1', db_port=12246):
+    def __init__(self, db_ip='127.0.0.1', db_port=12246, pool_size=4,
+                 compressed_tables=()):
         super(RamcloudNbApi, self).__init__()
-        self.client = ramcloud.RAMCloud()
-        self.client.connect()
         self.ip = db_ip
         self.port = db_port
         self.service_locator = 'fast+udp:host='+db_ip+',port='+str(db_port)+'';
+        # API workers share these connections; each call borrows one. The
+        # controller polls the same, mostly unchanged, objects over and over,
+        # so keep them around and only fetch those that changed.
+        self.pool = ramcloud.RAMCloudPool(size=pool_size,
+                                          serverLocator=self.service_locator,
+                                          read_cache=ramcloud.ReadCache())
+        # The JSON values repeat the same field names and ids, so the tables
+        # named here store them compressed. Whatever reads these tables has
+        # to name them too, so none are by default.
+        self.compressed_tables = frozenset(compressed_tables)
+        self.codec = ramcloud.ZlibValueCodec()
+        self.client = self.pool.proxy()
+        # batches of ports span every master; read and write each master's
+        # share on its own connection, at the same time. Its helper threads
+        # start with the first batch, in whichever API worker runs it.
+        self.batches = ramcloud.BatchScheduler(self.pool,
+                                               workers=pool_size - 1)
 
     def create_tables(self, tables):
         for t in tables:
             self.client.drop_table(t)
             self.client.create_table(t)
+        self._set_codecs(tables)
+
+    def _set_codecs(self, tables):
+        # a codec goes with a table id, so this is needed again whenever a
+        # table is created
+        for t in tables:
+            if t not in self.compressed_tables:
+                continue
+            try:
+                table_id = self.client.get_table_id(t)
+            except ramcloud.TableDoesntExistError:
+                continue
+            self.client.set_value_codec(self.codec, table_id)
 
     def initialize(self):
-        pass
+        self._set_codecs(self.compressed_tables)
 
     def sync(self):
         pass
 
+    def close(self):
+        # stops the helper threads of this process; the connections stay
+        # with the pool
+        self.batches.close()
+
     def get_chassis(self, name):
         try:
             table_id = self.client.get_table_id("chassis")
-            chassis_value, got_version = self.client.read(table_id, name)
+            chassis_value, got_version = self.client.read_cached(table_id,
+                                                                 name)
             return RamcloudChassis(chassis_value)
         except Exception:
             return None
 
+    def _read_all_cached(self, table):
+        table_id = self.client.get_table_id(table)
+        keys = [key for key in self.client.iter_keys(table_id)
+                if not ramcloud.is_chunk_key(key)]
+        values = []
+        for key, result in zip(keys,
+                               self.client.multi_read_cached(table_id, keys)):
+            if isinstance(result, ramcloud.NoObjectError):
+                # deleted since its key was listed
+                continue
+            if isinstance(result, Exception):
+                raise result
+            value = result[0]
+            if ramcloud.unpack_manifest(value) is not None:
+                # too big for one object, see create_lrouter
+                value, version = self.client.read_chunked(table_id, key)
+            values.append(value)
+        return values
+
     def get_all_chassis(self):
-        table_id = self.client.get_table_id("chassis")
-        res = []
-        enumeration_state = self.client.enumerate_table_prepare(table_id)
-        while True:
-            key, value = self.client.enumerate_table_next(enumeration_state)
-            if (key == ''):
-                break
-            res.append(RamcloudChassis(value))
-        self.client.enumerate_table_finalize(enumeration_state)
-        return res
+        return [RamcloudChassis(value)
+                for value in self._read_all_cached("chassis")]
 
     def add_chassis(self, name, ip, tunnel_type):
         table_id = self.client.get_table_id("chassis")
@@ -69,15 +115,26 @@ class RamcloudNbApi(api_nb.NbApi):
         self.client.write(table_id, name, chassis_value)
 
     def get_all_logical_ports(self):
+        table_id = self.client.get_table_id("lport")
+        return [RamcloudLogicalPort(value)
+                for key, value in self.client.iter_table(table_id)]
+
+    def diff_logical_ports(self, known_ids):
+        # Returns the ids of the ports added since known_ids was taken and
+        # of those removed since, without fetching any port.
+        table_id = self.client.get_table_id("lport")
+        return self.client.diff_keys(table_id, known_ids)
+
+    def get_logical_ports(self, ids):
         table_id = self.client.get_table_id("lport")
         res = []
-        enumeration_state = self.client.enumerate_table_prepare(table_id)
-        while True:
-            key, value = self.client.enumerate_table_next(enumeration_state)
-            if (key == ''):
-                break
-            res.append(RamcloudLogicalPort(value))
-        self.client.enumerate_table_finalize(enumeration_state)
+        for result in self.batches.multi_read(table_id, list(ids)):
+            if isinstance(result, ramcloud.NoObjectError):
+                # deleted since its id was listed
+                continue
+            if isinstance(result, Exception):
+                raise result
+            res.append(RamcloudLogicalPort(result[0]))
         return res
 
     def create_lswitch(self, name, **columns):
@@ -102,16 +159,31 @@ class RamcloudNbApi(api_nb.NbApi):
         table_id = self.client.get_table_id("lswitch")
         self.client.delete(table_id, name)
 
-    def create_lport(self, name, lswitch_name, **columns):
+    def _lport_json(self, name, lswitch_name, columns):
         lport = {}
         lport['name'] = name
         lport['lswitch'] = lswitch_name
         for col, val in columns.items():
             lport[col] = val
-        lport_json = jsonutils.dumps(lport)
+        return jsonutils.dumps(lport)
+
+    def create_lport(self, name, lswitch_name, **columns):
+        lport_json = self._lport_json(name, lswitch_name, columns)
         table_id = self.client.get_table_id("lport")
         self.client.write(table_id, name, lport_json)
 
+    def create_lports(self, lports):
+        # lports is a list of (name, lswitch_name, columns) tuples. They are
+        # written in one batch; every port is attempted before the first
+        # failure, if any, is raised.
+        table_id = self.client.get_table_id("lport")
+        requests = [(name, self._lport_json(name, lswitch_name, columns),
+                     ramcloud.RejectRules())
+                    for (name, lswitch_name, columns) in lports]
+        for result in self.batches.multi_write(table_id, requests):
+            if isinstance(result, Exception):
+                raise result
+
     def update_lport(self, name, **columns):
         table_id = self.client.get_table_id("lport")
         lport_json, got_version = self.client.read(table_id, name)
@@ -132,15 +204,17 @@ class RamcloudNbApi(api_nb.NbApi):
             lrouter[col] = val
         lrouter_json = jsonutils.dumps(lrouter)
         table_id = self.client.get_table_id("lrouter")
-        self.client.write(table_id, name, lrouter_json)
+        # routers embed all of their ports, so they can outgrow an object
+        self.client.write_chunked(table_id, name, lrouter_json)
 
     def delete_lrouter(self, name):
         table_id = self.client.get_table_id("lrouter")
-        self.client.delete(table_id, name)
+        self.client.delete_chunked(table_id, name)
 
     def add_lrouter_port(self, name, lrouter_name, lswitch, **columns):
         table_id = self.client.get_table_id("lrouter")
-        lrouter_json, got_version = self.client.read(table_id, lrouter_name)
+        lrouter_json, got_version = self.client.read_chunked(table_id,
+                                                             lrouter_name)
         lrouter = jsonutils.loads(lrouter_json)
         lrouter_port = {}
         lrouter_port['name'] = name
@@ -152,11 +226,12 @@ class RamcloudNbApi(api_nb.NbApi):
         router_ports.append(lrouter_port)
         lrouter['ports'] = router_ports
         lrouter_json = jsonutils.dumps(lrouter)
-        self.client.write(table_id, lrouter_name, lrouter_json)
+        self.client.write_chunked(table_id, lrouter_name, lrouter_json)
 
     def delete_lrouter_port(self, lrouter_name, lswitch): # is it delete ?
         table_id = self.client.get_table_id("lrouter")
-        lrouter_json, got_version = self.client.read(table_id, lrouter_name)
+        lrouter_json, got_version = self.client.read_chunked(table_id,
+                                                             lrouter_name)
         lrouter = jsonutils.loads(lrouter_json)
 
         new_ports = []
@@ -166,19 +241,11 @@ class RamcloudNbApi(api_nb.NbApi):
 
         lrouter['ports'] = new_ports
         lrouter_json = jsonutils.dumps(lrouter)
-        self.client.write(table_id, lrouter_name, lrouter_json)
+        self.client.write_chunked(table_id, lrouter_name, lrouter_json)
 
     def get_routers(self):
-        table_id = self.client.get_table_id("lrouter")
-        res = []
-        enumeration_state = self.client.enumerate_table_prepare(table_id)
-        while True:
-            key, value = self.client.enumerate_table_next(enumeration_state)
-            if (key == ''):
-                break
-            res.append(RamcloudLogicalRouter(value))
-        self.client.enumerate_table_finalize(enumeration_state)
-        return res
+        return [RamcloudLogicalRouter(value)
+                for value in self._read_all_cached("lrouter")]
 
 class RamcloudChassis(api_nb.Chassis):
 
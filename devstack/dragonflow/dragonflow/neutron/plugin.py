@@ -59,6 +59,15 @@ df_opts = [
     cfg.StrOpt('remote_db_ip',
                default='127.0.0.1',
                help=_('The remote db ip address')),
+    cfg.IntOpt('db_pool_size',
+               default=4,
+               help=_('The number of db connections shared by the API '
+                      'workers of each process')),
+    cfg.ListOpt('db_compressed_tables',
+                default=[],
+                help=_('The NB tables whose values are stored compressed. '
+                       'Every controller must be started with the same '
+                       'tables.')),
 ]
 
 cfg.CONF.register_opts(df_opts, 'df')
@@ -97,7 +106,10 @@ class DFPlugin(db_base_plugin_v2.NeutronDbPluginV2,
         self.vif_details = {portbindings.CAP_PORT_FILTER: True}
 
         #self.nb_api = etcd_nb_impl.EtcdNbApi(db_ip=cfg.CONF.df.remote_db_ip)
-        self.nb_api = ramcloud_nb_impl.RamcloudNbApi(db_ip=cfg.CONF.df.remote_db_ip)
+        self.nb_api = ramcloud_nb_impl.RamcloudNbApi(
+            db_ip=cfg.CONF.df.remote_db_ip,
+            pool_size=cfg.CONF.df.db_pool_size,
+            compressed_tables=cfg.CONF.df.db_compressed_tables)
         #TODO: call create table on installtion phase not here
         self.nb_api.create_tables(['chassis', 'lport', 'lswitch', 'lrouter'])
         self.nb_api.initialize()
@@ -275,9 +287,7 @@ class DFPlugin(db_base_plugin_v2.NeutronDbPluginV2,
             allowed_macs.add(allowed_address['mac_address'])
         return list(allowed_macs)
 
-    @oslo_db_api.wrap_db_retry(max_retries=db_api.MAX_RETRIES,
-                               retry_on_deadlock=True)
-    def create_port(self, context, port):
+    def _create_port_in_db(self, context, port):
         with context.session.begin(subtransactions=True):
             self._validate_binding_profile(context, port)
             dhcp_opts = port['port'].get(edo_ext.EXTRADHCPOPTS, [])
@@ -292,9 +302,27 @@ class DFPlugin(db_base_plugin_v2.NeutronDbPluginV2,
             db_port[portbindings.VNIC_TYPE] = portbindings.VNIC_NORMAL
             self._process_port_create_extra_dhcp_opts(context, db_port,
                                                       dhcp_opts)
+        return db_port
+
+    @oslo_db_api.wrap_db_retry(max_retries=db_api.MAX_RETRIES,
+                               retry_on_deadlock=True)
+    def create_port(self, context, port):
+        db_port = self._create_port_in_db(context, port)
         return self.create_port_in_nb_api(db_port)
 
-    def create_port_in_nb_api(self, port):
+    @oslo_db_api.wrap_db_retry(max_retries=db_api.MAX_RETRIES,
+                               retry_on_deadlock=True)
+    def create_port_bulk(self, context, ports):
+        # Create all the ports in the Neutron DB in one transaction, then
+        # write them to the NB DB in a single batch.
+        with context.session.begin(subtransactions=True):
+            db_ports = [self._create_port_in_db(context, port)
+                        for port in ports['ports']]
+        self.nb_api.create_lports([self._get_lport_args(db_port)
+                                   for db_port in db_ports])
+        return db_ports
+
+    def _get_lport_args(self, port):
         # The port name *must* be port['id'].  It must match the iface-id set
         # in the Interfaces table of the Open_vSwitch database, which nova sets
         # to be the port ID.
@@ -312,16 +340,18 @@ class DFPlugin(db_base_plugin_v2.NeutronDbPluginV2,
 
         tunnel_key = self._allocate_tunnel_key()
 
-        self.nb_api.create_lport(
-            name=port['id'],
-            lswitch_name=utils.ovn_name(port['network_id']),
-            macs=[port['mac_address']], ips=ips,
-            external_ids=external_ids,
-            parent_name=parent_name, tag=tag,
-            enabled=port.get('admin_state_up', None),
-            chassis=chassis, tunnel_key=tunnel_key,
-            port_security=allowed_macs)
+        columns = dict(macs=[port['mac_address']], ips=ips,
+                       external_ids=external_ids,
+                       parent_name=parent_name, tag=tag,
+                       enabled=port.get('admin_state_up', None),
+                       chassis=chassis, tunnel_key=tunnel_key,
+                       port_security=allowed_macs)
+        return (port['id'], utils.ovn_name(port['network_id']), columns)
 
+    def create_port_in_nb_api(self, port):
+        name, lswitch_name, columns = self._get_lport_args(port)
+        self.nb_api.create_lport(name=name, lswitch_name=lswitch_name,
+                                 **columns)
         return port
 
     def _allocate_tunnel_key(self):